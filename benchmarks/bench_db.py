@@ -0,0 +1,144 @@
+"""
+Concurrent read/write throughput: db (per-thread WAL connections) vs the old shared cursor.
+
+    python benchmarks/bench_db.py [--readers 1 8 32] [--writers 1 4] [--seconds 3] [--dir DIR]
+
+Readers load the latest 15 turns of a random chat (get_last_history, the
+/chat context read); writers append a turn (add_history). "old" is the
+pre-db.py setup: one module-level connection in the default rollback-journal
+mode and one cursor shared by every thread. Using that cursor from several
+threads at once can hand one thread another's rows, so here it is guarded by
+a lock, which is what it amounted to anyway. Each configuration runs on a
+fresh copy of the same seeded database.
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+CHATS = 200
+TURNS_PER_CHAT = 100
+
+
+class OldSharedCursor:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.cursor = self.conn.cursor()
+        self.lock = threading.Lock()
+
+    def read(self, chat_id):
+        with self.lock:
+            self.cursor.execute(db.SQL_LAST_HISTORY, (chat_id, 15))
+            return self.cursor.fetchall()
+
+    def write(self, chat_id):
+        with self.lock:
+            self.cursor.execute(db.SQL_INSERT_HISTORY, (chat_id, "question " * 10, "answer " * 80))
+            self.conn.commit()
+            return self.cursor.lastrowid
+
+    def close(self):
+        self.conn.close()
+
+
+class PerThreadDb:
+    def read(self, chat_id):
+        return db.get_last_history(chat_id)
+
+    def write(self, chat_id):
+        return db.add_history(chat_id, "question " * 10, "answer " * 80)
+
+    def close(self):
+        db.close_all()
+
+
+def seed(path):
+    db.DB_PATH = path
+    db.migrate()
+    user_id = db.create_user("bench", "bench@example.com", "x", None)
+    with db.transaction() as conn:
+        conn.executemany("INSERT INTO chats (user_id, title) VALUES (?, ?)", [(user_id, f"chat {i}") for i in range(CHATS)])
+        conn.executemany(
+            "INSERT INTO history (chat_id, user_text, bot_text) VALUES (?, ?, ?)",
+            [(1 + i % CHATS, "question " * 10, "answer " * 80) for i in range(CHATS * TURNS_PER_CHAT)],
+        )
+    db.close_all()
+    # The old code never enabled WAL; start it in the default journal mode
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = DELETE")
+    conn.close()
+
+
+def run(target, readers, writers, seconds):
+    stop = threading.Event()
+    counts = {"read": 0, "write": 0}
+    lock = threading.Lock()
+    errors = []
+
+    def worker(kind):
+        op = target.read if kind == "read" else target.write
+        rng = random.Random()
+        done = 0
+        try:
+            while not stop.is_set():
+                op(rng.randint(1, CHATS))
+                done += 1
+        except Exception as e:
+            errors.append(e)
+        with lock:
+            counts[kind] += done
+
+    threads = [threading.Thread(target=worker, args=("read",)) for _ in range(readers)]
+    threads += [threading.Thread(target=worker, args=("write",)) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+    return counts["read"] / seconds, counts["write"] / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--readers", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--dir")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        seeded = os.path.join(tmp, "seed.db")
+        seed(seeded)
+        path = os.path.join(tmp, "bench.db")
+        for readers in args.readers:
+            for writers in args.writers:
+                for name, make in (("old", OldSharedCursor), ("db", lambda p: PerThreadDb())):
+                    for suffix in ("", "-wal", "-shm"):
+                        if os.path.exists(path + suffix):
+                            os.remove(path + suffix)
+                    shutil.copy(seeded, path)
+                    db.DB_PATH = path
+                    db.write_queue = db.WriteBehindQueue()
+                    target = make(path)
+                    try:
+                        reads, writes = run(target, readers, writers, args.seconds)
+                    finally:
+                        target.close()
+                    print(f"{readers:3d} readers {writers:2d} writers  {name:<4} "
+                          f"reads {reads:9.0f}/s  writes {writes:7.0f}/s  total {reads + writes:9.0f} ops/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Event-loop lag while /run_code jobs run: ExecutionEngine vs a blocking subprocess call.
+
+    python benchmarks/bench_event_loop_lag.py [--jobs 4] [--job-seconds 1] [--workers 2]
+
+A 10 ms asyncio ticker stands in for the chat streams sharing the loop and
+records how late each tick fires while `--jobs` CPU-bound scripts run.
+"engine" submits them to code_runner.ExecutionEngine; "blocking" runs each
+with subprocess.run on the loop thread, as /run_code used to.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from code_runner import ExecutionEngine  # noqa: E402
+
+TICK = 0.01
+
+
+def busy_script(seconds):
+    return f"import time\nend = time.time() + {seconds}\nwhile time.time() < end: pass\nprint('done')"
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(pct / 100 * (len(values) - 1)))]
+
+
+async def with_ticker(work):
+    lags = []
+    stop = asyncio.Event()
+
+    async def ticker():
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - started - TICK)
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(TICK)
+    try:
+        await work()
+    finally:
+        stop.set()
+        await tick
+    return [lag * 1000 for lag in lags]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=4)
+    parser.add_argument("--job-seconds", type=float, default=1)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+    code = busy_script(args.job_seconds)
+
+    engine = ExecutionEngine(workers=args.workers, queue_size=args.jobs, per_user=args.jobs, timeout=60)
+    engine.warm = False
+
+    async def engine_jobs():
+        jobs = [await engine.submit("python", code, user_id) for user_id in range(args.jobs)]
+        for job in jobs:
+            await job.result()
+
+    async def blocking_jobs():
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "job.py")
+            with open(path, "w") as f:
+                f.write(code)
+            for _ in range(args.jobs):
+                subprocess.run([sys.executable, path], capture_output=True, timeout=60)
+
+    try:
+        for name, work in (("engine", engine_jobs), ("blocking", blocking_jobs)):
+            started = time.perf_counter()
+            lags = await with_ticker(work)
+            print(
+                f"{name:<8} {args.jobs} jobs  wall {time.perf_counter() - started:6.2f} s  ticks {len(lags):4d}  "
+                f"lag p50 {percentile(lags, 50):7.1f} ms  p99 {percentile(lags, 99):7.1f} ms  max {max(lags):7.1f} ms"
+            )
+    finally:
+        await engine.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
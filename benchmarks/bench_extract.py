@@ -0,0 +1,60 @@
+"""
+Page-to-text extraction: the streaming extractor vs BeautifulSoup html.parser.
+
+    python benchmarks/bench_extract.py [--paragraphs 12 300 3000] [--runs 5]
+
+Pages are synthetic articles (as in tests/test_extract.py) with navigation,
+scripts and ad blocks around the paragraphs. "stream" is
+scraper.extract_paragraphs with the per-link limit the search path uses,
+"stream, no limit" parses the whole page, "bs4" is the old extractor.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scraper  # noqa: E402
+
+
+def article(n_paragraphs, words=60):
+    body = "".join(
+        f"<p>Paragraph {i} &amp; <b>bold {i}</b> " + " ".join(f"word{j}" for j in range(words)) + "</p>\n"
+        f"<div class='ad'><script>var x = '<p>not text</p>';</script>sidebar {i}</div>\n"
+        for i in range(n_paragraphs)
+    )
+    return (
+        "<!doctype html><html><head><title>t</title><style>p { color: red }</style></head>"
+        f"<body><nav><a href='/'>home</a></nav><article>{body}</article>"
+        "<footer><p>Footer &copy; 2025</p></footer></body></html>"
+    )
+
+
+EXTRACTORS = [
+    ("stream", lambda html: scraper.extract_paragraphs(html, limit_chars=scraper.LINK_CHAR_LIMIT)),
+    ("stream, no limit", lambda html: scraper.extract_paragraphs(html, limit_chars=None)),
+    ("bs4", scraper.extract_paragraphs_bs4),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--paragraphs", type=int, nargs="+", default=[12, 300, 3000])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    for n in args.paragraphs:
+        html = article(n)
+        for name, extract in EXTRACTORS:
+            times = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                extract(html)
+                times.append((time.perf_counter() - started) * 1000)
+            print(f"{len(html) / 1024:8.0f} KB  {name:<17} median {statistics.median(times):9.2f} ms  min {min(times):9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""
+SSE streaming at rising concurrency: AsyncOpenAI on the event loop vs the old sync client in threads.
+
+    python benchmarks/bench_llm_streaming.py [--concurrency 10 40 100 200] [--chunks 20] [--chunk-delay-ms 50]
+        [--first-token-delay-ms 0] [--shards 16]
+
+A local OpenRouter stub (own thread and event loop) waits
+`--first-token-delay-ms`, then streams `--chunks` deltas `--chunk-delay-ms`
+apart. Two FastAPI routes relay it as SSE the way main.py does: "async"
+awaits AsyncOpenAI clients over `--shards` httpx pools (the current /chat,
+see LLM_POOL_SHARDS), "threaded" iterates a sync OpenAI client inside a sync
+generator (the old /chat), which Starlette runs on its worker-thread pool.
+All streams of a round start together; the report gives time to first token
+and to the end of the stream. `--shards 1` shows the single shared pool.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+from aiohttp import web  # noqa: E402
+from fastapi import FastAPI  # noqa: E402
+from fastapi.responses import StreamingResponse  # noqa: E402
+from openai import AsyncOpenAI, OpenAI  # noqa: E402
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def start_stub(chunks, delay, first_delay):
+    """OpenRouter stand-in on its own loop in a daemon thread; returns its base URL."""
+    ready = threading.Event()
+    box = {}
+
+    async def completions(request):
+        await request.json()
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        await asyncio.sleep(first_delay)
+        for i in range(chunks):
+            await asyncio.sleep(delay)
+            chunk = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+                     "choices": [{"index": 0, "delta": {"content": f"t{i} "}, "finish_reason": None}]}
+            await resp.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await resp.write(b"data: [DONE]\n\n")
+        await resp.write_eof()
+        return resp
+
+    async def serve():
+        app = web.Application()
+        app.router.add_post("/api/v1/chat/completions", completions)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0, backlog=1024)
+        await site.start()
+        box["url"] = f"http://127.0.0.1:{runner.addresses[0][1]}/api/v1"
+        ready.set()
+        await asyncio.Event().wait()
+
+    threading.Thread(target=lambda: asyncio.run(serve()), daemon=True).start()
+    ready.wait()
+    return box["url"]
+
+
+def build_app(base_url, shards):
+    app = FastAPI()
+    per_shard = -(-500 // shards)
+    http_clients = [
+        httpx.AsyncClient(limits=httpx.Limits(max_connections=per_shard, max_keepalive_connections=per_shard))
+        for _ in range(shards)
+    ]
+    async_clients = [AsyncOpenAI(base_url=base_url, api_key=f"k{i}", http_client=c) for c in http_clients for i in range(2)]
+    sync_clients = [OpenAI(base_url=base_url, api_key=f"k{i}") for i in range(2)]
+    counter = {"n": 0}
+
+    def next_index(size):
+        counter["n"] += 1
+        return counter["n"] % size
+
+    @app.post("/async")
+    async def async_stream():
+        client = async_clients[next_index(len(async_clients))]
+
+        async def events():
+            stream = await client.chat.completions.create(model="stub", stream=True, messages=MESSAGES)
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content or ""
+                if delta:
+                    yield f"event: bot\ndata: {json.dumps(delta)}\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/threaded")
+    def threaded_stream():
+        client = sync_clients[next_index(len(sync_clients))]
+
+        def events():
+            for chunk in client.chat.completions.create(model="stub", stream=True, messages=MESSAGES):
+                delta = chunk.choices[0].delta.content or ""
+                if delta:
+                    yield f"event: bot\ndata: {json.dumps(delta)}\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app, http_clients
+
+
+async def one_stream(app, path):
+    """
+    One request straight through the ASGI interface, timing the body messages
+    as a server would send them (httpx's ASGITransport buffers the whole body,
+    which would hide the time to first token).
+    """
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"host", b"bench")], "server": ("bench", 80), "client": ("127.0.0.1", 0),
+    }
+    requested = False
+    started = time.perf_counter()
+    first = None
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()  # the client never disconnects
+
+    async def send(message):
+        nonlocal first
+        if message["type"] == "http.response.body" and message.get("body") and first is None:
+            first = time.perf_counter() - started
+
+    await app(scope, receive, send)
+    return first, time.perf_counter() - started
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(pct / 100 * (len(values) - 1)))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 40, 100, 200])
+    parser.add_argument("--chunks", type=int, default=20)
+    parser.add_argument("--chunk-delay-ms", type=float, default=50)
+    parser.add_argument("--first-token-delay-ms", type=float, default=0)
+    parser.add_argument("--shards", type=int, default=16)
+    args = parser.parse_args()
+
+    stub = start_stub(args.chunks, args.chunk_delay_ms / 1000, args.first_token_delay_ms / 1000)
+    app, http_clients = build_app(stub, args.shards)
+    try:
+        await one_stream(app, "/async")
+        await one_stream(app, "/threaded")
+        for n in args.concurrency:
+            for path in ("/async", "/threaded"):
+                started = time.perf_counter()
+                results = await asyncio.gather(*(one_stream(app, path) for _ in range(n)))
+                wall = time.perf_counter() - started
+                ttft = [r[0] * 1000 for r in results]
+                total = [r[1] * 1000 for r in results]
+                print(
+                    f"{n:4d} streams  {path[1:]:<8}  first token p50 {percentile(ttft, 50):7.0f} ms  p95 {percentile(ttft, 95):7.0f} ms  "
+                    f"stream p95 {percentile(total, 95):7.0f} ms  mean {statistics.mean(total):7.0f} ms  wall {wall:6.2f} s"
+                )
+    finally:
+        for http_client in http_clients:
+            await http_client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
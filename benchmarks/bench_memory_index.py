@@ -0,0 +1,62 @@
+"""
+Memory retrieval: MemoryIndex top-k search vs sending every memory, by memory count.
+
+    python benchmarks/bench_memory_index.py [--memories 100 1000 5000 20000] [--queries 200] [--k 5]
+
+Memories are synthetic (as in tests/test_memory_index.py): one distinctive
+keyword each plus shared filler. "build" indexes all of them from scratch,
+as the first lookup for a user does; "query" is one search; "all" is the
+old prompt, every memory joined, shown by size.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory_index import MemoryIndex  # noqa: E402
+
+TOPICS = ["guitar", "python", "marathon", "sourdough", "chess", "kayak", "violin", "espresso", "tulips", "rust"]
+
+
+def synthetic_memories(n, seed=7):
+    rng = random.Random(seed)
+    return [
+        f"user mentioned {rng.choice(TOPICS)} and the keyword zq{i} while talking about plans"
+        for i in range(n)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--memories", type=int, nargs="+", default=[100, 1000, 5000, 20000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    for n in args.memories:
+        memories = synthetic_memories(n)
+        started = time.perf_counter()
+        index = MemoryIndex()
+        for memory_id, text in enumerate(memories, start=1):
+            index.add(memory_id, text)
+        build = time.perf_counter() - started
+
+        rng = random.Random(1)
+        times, found = [], 0
+        for i in (rng.randrange(n) for _ in range(args.queries)):
+            started = time.perf_counter()
+            hits = index.search(f"what did I say about zq{i} {TOPICS[i % 10]}?", args.k)
+            times.append((time.perf_counter() - started) * 1000)
+            found += memories[i] in hits
+        print(
+            f"{n:6d} memories  build {build * 1000:8.1f} ms  query median {statistics.median(times):7.3f} ms  "
+            f"max {max(times):7.3f} ms  recall {found / args.queries:.2f}  all {len(', '.join(memories)) / 1024:7.0f} KB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+/chats and /chats/{id}/history: full responses vs keyset pages, serialization included.
+
+    python benchmarks/bench_pagination.py [--turns 100000] [--chats 5000]
+
+Builds a throwaway database with one long chat and many short ones, then times
+the old full-list json encoding against a page of 50 (orjson + gzip, as the
+endpoints send it). The database lives in a temp dir and is deleted afterwards.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+TMP_DIR = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = os.path.join(TMP_DIR.name, "bench.db")
+
+import orjson  # noqa: E402
+
+import db  # noqa: E402
+
+PAGE = 50
+
+
+def turn_json(r):
+    return {"id": r["id"], "user": r["user_text"], "bot": r["bot_text"], "ts": r["ts"]}
+
+
+def chat_json(r):
+    return {"id": r["id"], "title": r["title"], "created_at": str(r["created_at"])}
+
+
+def fill(turns, chats):
+    user_id = db.create_user("bench", "bench@example.com", "x", None)
+    chat_id = db.create_chat(user_id, "long chat")
+    with db.transaction() as conn:
+        conn.executemany("INSERT INTO chats (user_id, title) VALUES (?, ?)", [(user_id, f"chat {i}") for i in range(chats)])
+        conn.executemany(
+            "INSERT INTO history (chat_id, user_text, bot_text) VALUES (?, ?, ?)",
+            [(chat_id, "question " * 20, "answer with some *markdown* " * 40) for _ in range(turns)],
+        )
+    return user_id, chat_id
+
+
+def bench(name, fn, runs):
+    body = fn()   # warm the statement cache and page cache
+    started = time.perf_counter()
+    for _ in range(runs):
+        fn()
+    elapsed = (time.perf_counter() - started) / runs
+    print(f"{name:<40} {elapsed * 1000:9.2f} ms  {len(body) / 1024:10.1f} KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--turns", type=int, default=100_000)
+    parser.add_argument("--chats", type=int, default=5000)
+    args = parser.parse_args()
+
+    db.migrate()
+    user_id, chat_id = fill(args.turns, args.chats)
+    scans = db.find_full_scans()
+    if scans:
+        print("full scans:", scans)
+
+    def history_page(before_id=None):
+        rows = db.get_history_page(chat_id, before_id, PAGE + 1)[:PAGE][::-1]
+        return gzip.compress(orjson.dumps([turn_json(r) for r in rows]), 5)
+
+    def chats_page():
+        rows = db.list_user_chats_page(user_id, None, PAGE + 1)[:PAGE]
+        return gzip.compress(orjson.dumps([chat_json(r) for r in rows]), 5)
+
+    bench("history full, json (before)", lambda: json.dumps([turn_json(r) for r in db.get_chat_history(chat_id)]).encode(), 3)
+    bench(f"history page of {PAGE}, latest", history_page, 200)
+    bench(f"history page of {PAGE}, before_id=500", lambda: history_page(500), 200)
+    bench("chat list full, json (before)", lambda: json.dumps([chat_json(r) for r in db.list_user_chats(user_id)]).encode(), 20)
+    bench(f"chat page of {PAGE}", chats_page, 200)
+    db.close_all()
+
+
+if __name__ == "__main__":
+    main()
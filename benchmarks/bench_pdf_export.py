@@ -0,0 +1,62 @@
+"""
+/export_pdf latency: first render in the export pool vs a content-hash cache hit.
+
+    python benchmarks/bench_pdf_export.py [--runs 20] [--paragraphs 40]
+
+Every miss renders a distinct document (the run number is in the title), and
+the hit is the same document requested again straight after.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pdf_export  # noqa: E402
+
+
+def document(i, paragraphs):
+    body = "\n\n".join(
+        f"Paragraph {n} with **bold**, *italic*, `code` and a [link](https://example.com/{n})."
+        for n in range(paragraphs)
+    )
+    return f"# Report {i}\n\n{body}\n\n- one\n- two\n\n```\nprint({i})\n```\n"
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(pct / 100 * (len(values) - 1)))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--paragraphs", type=int, default=40)
+    args = parser.parse_args()
+
+    # Start the pool's workers outside the measurement, as a long-running server would
+    await pdf_export.export_pdf_bytes(document(-1, args.paragraphs))
+    misses, hits = [], []
+    try:
+        for i in range(args.runs):
+            content = document(i, args.paragraphs)
+            for latencies in (misses, hits):
+                started = time.perf_counter()
+                await pdf_export.export_pdf_bytes(content)
+                latencies.append((time.perf_counter() - started) * 1000)
+    finally:
+        pdf_export.shutdown_export_pool()
+
+    for name, latencies in (("miss", misses), ("hit", hits)):
+        print(
+            f"{name:<4}: p50 {percentile(latencies, 50):8.2f} ms  p95 {percentile(latencies, 95):8.2f} ms  "
+            f"mean {statistics.mean(latencies):8.2f} ms  (n={len(latencies)})"
+        )
+    print(pdf_export.pdf_cache.stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
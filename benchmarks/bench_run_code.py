@@ -0,0 +1,75 @@
+"""
+/run_code latency through ExecutionEngine, cold processes vs warm runtimes.
+
+    python benchmarks/bench_run_code.py [--runs 40] [--language javascript java]
+
+Each run executes a distinct one-line snippet, so the Java numbers include a
+compile (javac cold, the in-process compiler warm) on every job. Languages
+whose toolchain is not installed are skipped.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from code_runner import ExecutionEngine  # noqa: E402
+
+SNIPPETS = {
+    "javascript": lambda i: f"console.log({i} * 2, 'js-{i}'.toUpperCase())",
+    "java": lambda i: (
+        "public class Main { public static void main(String[] a) { "
+        f"System.out.println({i} * 2 + \" java-{i}\"); }} }}"
+    ),
+}
+TOOLCHAIN = {"javascript": "node", "java": "javac"}
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(pct / 100 * (len(values) - 1)))]
+
+
+async def measure(language, runs, warm):
+    engine = ExecutionEngine(workers=1, queue_size=runs, per_user=runs, timeout=30)
+    engine.warm = warm
+    latencies = []
+    try:
+        if warm:
+            # Start the runtime outside the measurement, as a long-running server would
+            await (await engine.submit(language, SNIPPETS[language](-1))).result()
+        for i in range(runs):
+            started = time.perf_counter()
+            result = await (await engine.submit(language, SNIPPETS[language](i))).result()
+            latencies.append(time.perf_counter() - started)
+            if result["status"] != "success":
+                raise RuntimeError(f"{language} snippet {i} failed: {result['error']}")
+    finally:
+        await engine.close()
+    return latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=40)
+    parser.add_argument("--language", nargs="+", choices=sorted(SNIPPETS), default=["javascript", "java"])
+    args = parser.parse_args()
+
+    for language in args.language:
+        if shutil.which(TOOLCHAIN[language]) is None:
+            print(f"{language}: skipped, {TOOLCHAIN[language]} not found")
+            continue
+        for mode, warm in (("cold", False), ("warm", True)):
+            latencies = [t * 1000 for t in await measure(language, args.runs, warm)]
+            print(
+                f"{language:<10} {mode}: p50 {percentile(latencies, 50):6.0f} ms  "
+                f"p95 {percentile(latencies, 95):6.0f} ms  mean {statistics.mean(latencies):6.0f} ms  (n={len(latencies)})"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
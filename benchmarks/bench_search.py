@@ -0,0 +1,108 @@
+"""
+/search/history: db.search_history (FTS5) vs the LIKE scan it replaces.
+
+    python benchmarks/bench_search.py [--rows 1000000] [--runs 30]
+
+Builds a throwaway database: 1000 users with 10 chats each share 90% of the
+rows, one heavy user owns the other 10% in 1000 chats. Text is drawn from a
+Zipf-like vocabulary of 20k random words, so the first words are very common
+and the last ones rare. Each query runs for a light and for the heavy user.
+The database lives in a temp dir and is deleted afterwards.
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+TMP_DIR = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = os.path.join(TMP_DIR.name, "bench.db")
+
+import db  # noqa: E402
+
+LIGHT_USER, HEAVY_USER = 7, 1001
+SQL_LIKE = (
+    "SELECT h.id FROM history h JOIN chats c ON c.id = h.chat_id "
+    "WHERE c.user_id = ? AND c.is_private = 0 AND (h.user_text LIKE ? OR h.bot_text LIKE ?) "
+    "ORDER BY h.id DESC LIMIT ?"
+)
+
+
+def fill(rows, words):
+    cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(len(words))))
+
+    def text(n):
+        return " ".join(random.choices(words, cum_weights=cum_weights, k=n))
+
+    with db.transaction() as conn:
+        conn.executemany("INSERT INTO users (username, email, password_hash) VALUES (?, ?, ?)",
+                         [(f"u{i}", f"u{i}@example.com", "x") for i in range(1001)])
+        conn.executemany("INSERT INTO chats (user_id, title) VALUES (?, ?)",
+                         [(1 + i // 10, f"chat {i}") for i in range(10000)])
+        conn.executemany("INSERT INTO chats (user_id, title) VALUES (?, ?)",
+                         [(HEAVY_USER, f"heavy {i}") for i in range(1000)])
+    started = time.time()
+    chunk = 100_000
+    for done in range(0, rows, chunk):
+        n = min(chunk, rows - done)
+        light = [(random.randint(1, 10000), text(12), text(60)) for _ in range(n * 9 // 10)]
+        heavy = [(10001 + random.randint(0, 999), text(12), text(60)) for _ in range(n - len(light))]
+        with db.transaction() as conn:
+            conn.executemany("INSERT INTO history (chat_id, user_text, bot_text) VALUES (?, ?, ?)", light + heavy)
+    print(f"inserted {rows} rows (FTS triggers on) in {time.time() - started:.0f} s")
+
+
+def like_search(user_id, q, limit=20):
+    # One LIKE per query string, as the pre-FTS search did; fine for single words
+    pattern = f"%{q}%"
+    return db.get_conn().execute(SQL_LIKE, (user_id, pattern, pattern, limit)).fetchall()
+
+
+def timed(fn, runs):
+    result = fn()
+    times = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    times.sort()
+    return len(result), times[runs // 2], times[min(runs - 1, int(runs * 0.95))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--runs", type=int, default=30)
+    args = parser.parse_args()
+
+    random.seed(1)
+    words = ["".join(random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(random.randint(3, 9)))
+             for _ in range(20000)]
+    db.migrate()
+    fill(args.rows, words)
+
+    queries = [
+        ("common word", words[0]),
+        ("common word", words[50]),
+        ("mid-frequency", words[1000]),
+        ("mid-frequency", words[3000]),
+        ("rare", words[19000]),
+        ("two terms", f"{words[10]} {words[200]}"),
+    ]
+    for label, q in queries:
+        for user_id in (LIGHT_USER, HEAVY_USER):
+            hits, p50, p95 = timed(lambda: db.search_history(user_id, q), args.runs)
+            line = f"{label:<14} user {user_id:<5} fts  hits {hits:3d}  p50 {p50:8.2f} ms  p95 {p95:8.2f} ms"
+            if " " not in q:
+                hits, p50, p95 = timed(lambda: like_search(user_id, q), max(3, args.runs // 10))
+                line += f"   like  hits {hits:3d}  p50 {p50:8.2f} ms  p95 {p95:8.2f} ms"
+            print(line)
+    db.close_all()
+
+
+if __name__ == "__main__":
+    main()
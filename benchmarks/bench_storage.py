@@ -0,0 +1,183 @@
+"""
+End-to-end /generate-image and /exec-chat latency on each storage backend.
+
+    python benchmarks/bench_storage.py [--runs 20] [--backend local supabase] [--supabase-latency-ms 0]
+
+Everything except storage is local and identical for both backends: a fake
+Hugging Face client returns a 512x512 noise PNG, and a local OpenRouter stub
+answers code generation with a script that writes a ~200 KB CSV plus a small
+text file, and then answers the summary call. "supabase" is a stand-in for
+the storage REST API in a thread (as in tests/test_storage.py), optionally
+with an added per-upload delay to model the round trip. Every request is
+fresh, so neither the image nor the exec caches are hit.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+TMP_DIR = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = os.path.join(TMP_DIR.name, "bench.db")
+
+import httpx  # noqa: E402
+from aiohttp import web  # noqa: E402
+from aiohttp.test_utils import TestServer  # noqa: E402
+from openai import AsyncOpenAI  # noqa: E402
+from PIL import Image  # noqa: E402
+
+import db  # noqa: E402
+import exctr  # noqa: E402
+import image_service  # noqa: E402
+import main  # noqa: E402
+import storage  # noqa: E402
+from image_service import HFClientPool, ImageService  # noqa: E402
+from storage import LocalBackend, StorageUploader, SupabaseBackend  # noqa: E402
+from warm_pool import warm_pool  # noqa: E402
+
+CODEGEN_REPLY = (
+    "```python\n"
+    "# run {n}\n"
+    "with open('report.csv', 'w') as f:\n"
+    "    f.write('x,y\\n' + ''.join(f'{{i}},{{i * i}}\\n' for i in range(20000)) + '# {n}\\n')\n"
+    "with open('notes.txt', 'w') as f:\n"
+    "    f.write('run {n}\\n')\n"
+    "print('written')\n"
+    "```"
+)
+
+
+class FakeHFClient:
+    def text_to_image(self, prompt, model=None):
+        return Image.frombytes("RGB", (512, 512), os.urandom(512 * 512 * 3))
+
+
+class SupabaseStandIn(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        time.sleep(self.server.delay)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+async def openrouter_stub():
+    runs = itertools.count()
+
+    async def completions(request):
+        body = await request.json()
+        if body["messages"][0]["content"] == exctr.EXC_SYS["content"]:
+            text = CODEGEN_REPLY.format(n=next(runs))
+        else:
+            text = "Here are your files."
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        chunk = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": "stub",
+                 "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]}
+        await resp.write(f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode())
+        await resp.write_eof()
+        return resp
+
+    app = web.Application()
+    app.router.add_post("/api/v1/chat/completions", completions)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+def use_uploader(uploader):
+    for module in (storage, main, exctr, image_service):
+        module.uploader = uploader
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(pct / 100 * (len(values) - 1)))]
+
+
+async def timed_stream(api, path, payload):
+    started = time.perf_counter()
+    async with api.stream("POST", path, json=payload) as resp:
+        body = "".join([part async for part in resp.aiter_text()])
+    elapsed = time.perf_counter() - started
+    if resp.status_code != 200 or "event: error" in body or '"error": "' in body:
+        raise RuntimeError(f"{path} failed: {body[-500:]}")
+    return elapsed
+
+
+async def measure(api, chat_id, runs, tag):
+    image, exec_chat = [], []
+    for i in range(runs + 1):
+        # The first round warms pools and connections and is not counted
+        t_image = await timed_stream(api, "/generate-image", {"message": f"{tag} image {i}", "chat_id": chat_id, "fresh": True})
+        t_exec = await timed_stream(api, "/exec-chat", {"message": f"{tag} csv {i}", "chat_id": chat_id, "fresh": True})
+        if i:
+            image.append(t_image * 1000)
+            exec_chat.append(t_exec * 1000)
+    return {"/generate-image": image, "/exec-chat": exec_chat}
+
+
+async def main_async():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--backend", nargs="+", choices=["local", "supabase"], default=["local", "supabase"])
+    parser.add_argument("--supabase-latency-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    stub = await openrouter_stub()
+    http_client = httpx.AsyncClient()
+    main.async_clients = [AsyncOpenAI(base_url=str(stub.make_url("/api/v1")), api_key="bench", http_client=http_client)]
+    main.async_client_index = 0
+    main.image_service = ImageService(HFClientPool([FakeHFClient()]))
+    user_id = db.create_user("bench", "bench@example.com", "x", None)
+    chat_id = db.create_chat(user_id, "bench")
+    main.app.dependency_overrides[main.get_current_user_id] = lambda: user_id
+
+    supabase = ThreadingHTTPServer(("127.0.0.1", 0), SupabaseStandIn)
+    supabase.delay = args.supabase_latency_ms / 1000
+    threading.Thread(target=supabase.serve_forever, daemon=True).start()
+    os.environ["SUPABASE_URL"] = f"http://127.0.0.1:{supabase.server_address[1]}"
+    os.environ["SUPABASE_KEY"] = "bench"
+
+    warm_pool.start()
+    transport = httpx.ASGITransport(app=main.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as api:
+            for name in args.backend:
+                backend = LocalBackend(root=os.path.join(TMP_DIR.name, "storage"), public_url="") if name == "local" else SupabaseBackend()
+                uploader = StorageUploader(backend)
+                use_uploader(uploader)
+                try:
+                    results = await measure(api, chat_id, args.runs, name)
+                finally:
+                    uploader.close()
+                for route, latencies in results.items():
+                    print(
+                        f"{name:<9} {route:<16} p50 {percentile(latencies, 50):7.1f} ms  p95 {percentile(latencies, 95):7.1f} ms  "
+                        f"mean {statistics.mean(latencies):7.1f} ms  (n={len(latencies)})"
+                    )
+    finally:
+        await main.image_service.close()
+        await http_client.aclose()
+        await stub.close()
+        supabase.shutdown()
+        warm_pool.shutdown()
+        db.close_all()
+
+
+if __name__ == "__main__":
+    asyncio.run(main_async())
@@ -0,0 +1,57 @@
+"""
+Token counting and source-prompt budgeting: cold vs memoized counts.
+
+    python benchmarks/bench_token_budget.py [--sources 8] [--words 4000] [--runs 20]
+
+"cold" clears count_tokens' cache before each call, "warm" repeats the call
+with the cache filled, as happens when the same scraped pages are budgeted
+again for a follow-up message. Needs tiktoken's cl100k_base encoding.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scraper  # noqa: E402
+
+
+def page(n, words):
+    return {"url": f"https://example.com/{n}", "content": " ".join(f"token{n}x{i}" for i in range(words))}
+
+
+def timed(func, runs, cold):
+    times = []
+    for _ in range(runs):
+        if cold:
+            scraper.count_tokens.cache_clear()
+        started = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - started) * 1000)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sources", type=int, default=8)
+    parser.add_argument("--words", type=int, default=4000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    scraper.get_tokenizer()
+    text = page(0, args.words)["content"]
+    results = [page(n, args.words) for n in range(args.sources)]
+    cases = [
+        ("count_tokens", lambda: scraper.count_tokens(text)),
+        ("build_sources_prompt", lambda: scraper.build_sources_prompt(results, max_tokens=6000)),
+    ]
+    for name, func in cases:
+        for label, cold in (("cold", True), ("warm", False)):
+            times = timed(func, args.runs, cold)
+            print(f"{name:<21} {label}  median {statistics.median(times):9.3f} ms  min {min(times):9.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
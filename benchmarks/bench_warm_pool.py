@@ -0,0 +1,81 @@
+"""
+Generated-script latency: cold interpreter vs a fork of a warm template.
+
+    python benchmarks/bench_warm_pool.py [--runs 10] [--script numpy|matplotlib|plain]
+
+"cold" starts a fresh interpreter per job (warm_pool.run_cold); "warm" runs
+it in a fork of a template that has already imported PRELOAD_MODULES. The
+template starts outside the measurement, as it does at server start-up.
+Scripts whose library is not installed are skipped.
+"""
+import argparse
+import importlib.util
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import warm_pool  # noqa: E402
+from warm_pool import WarmPool  # noqa: E402
+
+SCRIPTS = {
+    "plain": "print(sum(range(1000)))\n",
+    "numpy": "import numpy\nprint(numpy.arange(1000).sum())\n",
+    "matplotlib": (
+        "import matplotlib\nmatplotlib.use('Agg')\nimport matplotlib.pyplot as plt\n"
+        "plt.plot([1, 2, 3])\nplt.savefig('plot.png')\nprint(499500)\n"
+    ),
+}
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(pct / 100 * (len(values) - 1)))]
+
+
+def measure(run, script, cwd, runs):
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        code, output, _ = run(script, cwd, 60)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if code != 0 or output.strip() != "499500":
+            raise RuntimeError(f"job failed ({code}): {output[-500:]}")
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--script", nargs="+", choices=sorted(SCRIPTS), default=["plain", "numpy", "matplotlib"])
+    args = parser.parse_args()
+
+    pool = WarmPool(size=1)
+    pool.start()
+    deadline = time.monotonic() + 120
+    while pool._idle.qsize() < 1 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    try:
+        with tempfile.TemporaryDirectory() as cwd:
+            for name in args.script:
+                if name != "plain" and importlib.util.find_spec(name) is None:
+                    print(f"{name}: skipped, not installed")
+                    continue
+                script = os.path.join(cwd, f"job_{name}.py")
+                with open(script, "w") as f:
+                    f.write(SCRIPTS[name])
+                for mode, run in (("cold", warm_pool.run_cold), ("warm", pool.run)):
+                    latencies = measure(run, script, cwd, args.runs)
+                    print(
+                        f"{name:<10} {mode}: p50 {percentile(latencies, 50):7.1f} ms  p95 {percentile(latencies, 95):7.1f} ms  "
+                        f"mean {statistics.mean(latencies):7.1f} ms  (n={len(latencies)})"
+                    )
+    finally:
+        pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
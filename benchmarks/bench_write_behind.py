@@ -0,0 +1,85 @@
+"""
+Hot INSERT throughput: per-row commits vs db.write_queue, by number of writer threads.
+
+    python benchmarks/bench_write_behind.py [--writers 1 16 64] [--rows 3200] [--dir DIR]
+
+Each writer thread inserts ~1 KB history rows and waits for every commit, as
+add_history does. fsync cost depends on the filesystem, so --dir should be on
+the same disk as the production database (default: a temp dir).
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+ROW = ("question text " * 10, "answer text " * 80)
+
+
+def reset(path):
+    db.close_all()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    db.DB_PATH = path
+    db.write_queue = db.WriteBehindQueue()
+    db.migrate()
+    user_id = db.create_user("bench", "bench@example.com", "x", None)
+    with db.transaction() as conn:
+        return conn.execute("INSERT INTO chats (user_id, title) VALUES (?, 'bench')", (user_id,)).lastrowid
+
+
+def per_row(synchronous):
+    def insert(chat_id, n):
+        conn = db.get_conn()
+        conn.execute(f"PRAGMA synchronous = {synchronous}")
+        for _ in range(n):
+            with db.transaction() as c:
+                c.execute(db.SQL_INSERT_HISTORY, (chat_id, *ROW))
+    return insert
+
+
+def queued(chat_id, n):
+    for _ in range(n):
+        db.write_queue.execute(db.SQL_INSERT_HISTORY, (chat_id, *ROW))
+
+
+MODES = [
+    ("per-row commit, synchronous=NORMAL (old)", per_row("NORMAL")),
+    ("per-row commit, synchronous=FULL", per_row("FULL")),
+    ("write_queue, synchronous=FULL", queued),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--rows", type=int, default=3200)
+    parser.add_argument("--dir")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        path = os.path.join(tmp, "bench.db")
+        for writers in args.writers:
+            per_writer = args.rows // writers
+            for name, insert in MODES:
+                chat_id = reset(path)
+                threads = [threading.Thread(target=insert, args=(chat_id, per_writer)) for _ in range(writers)]
+                started = time.perf_counter()
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                elapsed = time.perf_counter() - started
+                extra = f"  {db.write_queue.stats()}" if insert is queued else ""
+                print(f"{writers:3d} writers  {name:<42} {per_writer * writers / elapsed:8.0f} rows/s{extra}")
+        db.close_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+import asyncio
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+# Every TTLCache registers itself here so /metrics/cache can report on all of them.
+CACHES = {}
+
+
+def approx_size(value) -> int:
+    """Cheap byte estimate used for the memory budget."""
+    if isinstance(value, str):
+        return len(value.encode("utf-8", "ignore"))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, (list, tuple, set)):
+        return sum(approx_size(v) for v in value) + 8 * len(value)
+    if isinstance(value, dict):
+        return sum(approx_size(k) + approx_size(v) for k, v in value.items()) + 16 * len(value)
+    return sys.getsizeof(value)
+
+
+class DiskStore:
+    """
+    SQLite-backed persistence for a TTLCache so entries survive restarts.
+
+    Holds at most `max_bytes` of pickled values per cache name: a write that
+    goes over the budget evicts the least recently used entries.
+    """
+
+    def __init__(self, path, name, max_bytes):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS cache_entries (
+            name TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value BLOB NOT NULL,
+            stored_at REAL NOT NULL,
+            size INTEGER NOT NULL DEFAULT 0,
+            used_at REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (name, key)
+        )
+        """)
+        # Files written before the size budget lack the LRU columns
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(cache_entries)")}
+        if "size" not in columns:
+            self._conn.execute("ALTER TABLE cache_entries ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+            self._conn.execute("ALTER TABLE cache_entries ADD COLUMN used_at REAL NOT NULL DEFAULT 0")
+            self._conn.execute("UPDATE cache_entries SET size = length(value), used_at = stored_at")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_lru ON cache_entries (name, used_at)")
+        self._conn.commit()
+        self._bytes = self._total()
+
+    def _total(self):
+        return self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cache_entries WHERE name = ?", (self.name,)
+        ).fetchone()[0]
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, stored_at FROM cache_entries WHERE name = ? AND key = ?", (self.name, key)
+            ).fetchone()
+            if row:
+                self._conn.execute(
+                    "UPDATE cache_entries SET used_at = ? WHERE name = ? AND key = ?", (time.time(), self.name, key)
+                )
+                self._conn.commit()
+        if not row:
+            return None
+        try:
+            return pickle.loads(row[0]), row[1]
+        except Exception:
+            self.delete(key)
+            return None
+
+    def set(self, key, value, stored_at):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(blob) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT size FROM cache_entries WHERE name = ? AND key = ?", (self.name, key)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (name, key, value, stored_at, size, used_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.name, key, blob, stored_at, len(blob), time.time())
+            )
+            self._bytes += len(blob) - (old[0] if old else 0)
+            if self._bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Other processes may share the file, so recount before evicting
+        self._bytes = self._total()
+        rows = self._conn.execute(
+            "SELECT key, size FROM cache_entries WHERE name = ? ORDER BY used_at ASC", (self.name,)
+        )
+        victims = []
+        for key, size in rows:
+            if self._bytes <= self.max_bytes:
+                break
+            victims.append((self.name, key))
+            self._bytes -= size
+        self._conn.executemany("DELETE FROM cache_entries WHERE name = ? AND key = ?", victims)
+        self.evictions += len(victims)
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache_entries WHERE name = ? AND key = ?", (self.name, key))
+            self._conn.commit()
+            self._bytes = self._total()
+
+    def prune(self, older_than):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache_entries WHERE name = ? AND stored_at < ?", (self.name, older_than))
+            self._conn.commit()
+            self._bytes = self._total()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with a per-entry TTL and a byte budget.
+
+    Entries younger than `ttl` are fresh. Entries between `ttl` and
+    `ttl + stale_ttl` are stale: get_or_load / aget_or_load still return them
+    immediately and refresh them in the background (stale-while-revalidate).
+    Anything older is a miss. With `disk_path`, entries are also written to a
+    SQLite file and read back on a memory miss; the file keeps at most
+    `disk_max_bytes` (default 8 * max_bytes) for this cache.
+    """
+
+    def __init__(self, name, ttl, max_bytes, stale_ttl=0, disk_path=None, sizeof=approx_size, disk_max_bytes=None):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._data = OrderedDict()  # key -> (value, stored_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._tasks = set()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk = DiskStore(disk_path, name, disk_max_bytes or 8 * max_bytes) if disk_path else None
+        if self.disk:
+            self.disk.prune(time.time() - ttl - stale_ttl)
+        CACHES[name] = self
+
+    def _state(self, stored_at, now):
+        age = now - stored_at
+        if age < self.ttl:
+            return "fresh"
+        if age < self.ttl + self.stale_ttl:
+            return "stale"
+        return "expired"
+
+    def _insert(self, key, value, stored_at):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        old = self._data.pop(key, None)
+        if old:
+            self._bytes -= old[2]
+        self._data[key] = (value, stored_at, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._data:
+            _, (_, _, evicted_size) = self._data.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def get_entry(self, key):
+        """Return (value, state) where state is "fresh", "stale" or "miss"."""
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry:
+                state = self._state(entry[1], now)
+                if state != "expired":
+                    self._data.move_to_end(key)
+                    if state == "fresh":
+                        self.hits += 1
+                    else:
+                        self.stale_hits += 1
+                    return entry[0], state
+                self._bytes -= entry[2]
+                del self._data[key]
+        if self.disk:
+            stored = self.disk.get(key)
+            if stored:
+                value, stored_at = stored
+                state = self._state(stored_at, now)
+                if state != "expired":
+                    with self._lock:
+                        self._insert(key, value, stored_at)
+                        if state == "fresh":
+                            self.hits += 1
+                        else:
+                            self.stale_hits += 1
+                    return value, state
+        with self._lock:
+            self.misses += 1
+        return None, "miss"
+
+    def get(self, key):
+        value, state = self.get_entry(key)
+        return value if state != "miss" else None
+
+    def set(self, key, value):
+        stored_at = time.time()
+        with self._lock:
+            self._insert(key, value, stored_at)
+        if self.disk:
+            try:
+                self.disk.set(key, value, stored_at)
+            except Exception as e:
+                print(f"[cache:{self.name}] disk write failed: {e}")
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry:
+                self._bytes -= entry[2]
+        if self.disk:
+            self.disk.delete(key)
+
+    def _claim_refresh(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def _release_refresh(self, key):
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def get_or_load(self, key, loader, should_cache=bool):
+        """Sync read-through; stale entries are refreshed on a background thread."""
+        value, state = self.get_entry(key)
+        if state == "fresh":
+            return value
+        if state == "stale":
+            if self._claim_refresh(key):
+                def refresh():
+                    try:
+                        fresh = loader()
+                        if should_cache(fresh):
+                            self.set(key, fresh)
+                    except Exception as e:
+                        print(f"[cache:{self.name}] background refresh failed: {e}")
+                    finally:
+                        self._release_refresh(key)
+                threading.Thread(target=refresh, daemon=True).start()
+            return value
+        value = loader()
+        if should_cache(value):
+            self.set(key, value)
+        return value
+
+    async def aget_or_load(self, key, loader, should_cache=bool):
+        """Async read-through; `loader` is a zero-arg coroutine function."""
+        value, state = self.get_entry(key)
+        if state == "fresh":
+            return value
+        if state == "stale":
+            if self._claim_refresh(key):
+                async def refresh():
+                    try:
+                        fresh = await loader()
+                        if should_cache(fresh):
+                            self.set(key, fresh)
+                    except Exception as e:
+                        print(f"[cache:{self.name}] background refresh failed: {e}")
+                    finally:
+                        self._release_refresh(key)
+                task = asyncio.ensure_future(refresh())
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            return value
+        value = await loader()
+        if should_cache(value):
+            self.set(key, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+        if self.disk:
+            stats.update(disk_bytes=self.disk._bytes, disk_max_bytes=self.disk.max_bytes, disk_evictions=self.disk.evictions)
+        return stats
+
+
+def all_stats():
+    return {name: cache.stats() for name, cache in CACHES.items()}
@@ -0,0 +1,87 @@
+import io
+import json
+import re
+import zipfile
+
+import db
+
+EXPORT_FORMATS = {
+    "md": ("text/markdown; charset=utf-8", ".md"),
+    "ndjson": ("application/x-ndjson", ".ndjson"),
+    "pdf": ("application/pdf", ".pdf"),
+}
+
+# Bytes of a zip archive to buffer before handing them to the response
+ZIP_FLUSH_BYTES = 64 * 1024
+
+
+def markdown_chunks(chat, rows):
+    """One chat as markdown, a turn at a time."""
+    yield f"# {chat['title']}\n\n"
+    for r in rows:
+        yield f"### You\n\n{r['user_text']}\n\n### Nexora\n\n{r['bot_text']}\n\n---\n\n"
+
+
+def ndjson_chunks(chat, rows):
+    """One JSON object per turn, same fields as /chats/{chat_id}/history."""
+    for r in rows:
+        yield json.dumps(
+            {"id": r["id"], "user": r["user_text"], "bot": r["bot_text"], "ts": r["ts"]},
+            ensure_ascii=False
+        ) + "\n"
+
+
+CHUNK_WRITERS = {"md": markdown_chunks, "ndjson": ndjson_chunks}
+
+
+def iter_chat_export(chat, fmt: str):
+    """Encoded export of `chat` read straight from the history table."""
+    for chunk in CHUNK_WRITERS[fmt](chat, db.iter_chat_history(chat["id"])):
+        yield chunk.encode("utf-8")
+
+
+def archive_name(chat, ext: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", chat["title"] or "").strip("-")[:60] or "chat"
+    return f"{chat['id']:06d}-{slug}{ext}"
+
+
+class _ZipSink(io.RawIOBase):
+    """Write-only, unseekable file that collects what zipfile writes until drained."""
+
+    def __init__(self):
+        self._chunks = []
+        self.pending = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self.pending += len(b)
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self.pending = 0
+        return data
+
+
+def iter_user_archive(user_id: int, fmt: str = "md"):
+    """
+    Zip of every (non-private) chat of the user, one file per chat, produced
+    while it is written. zipfile falls back to data descriptors on an
+    unseekable sink, so nothing but the current deflate window is buffered.
+    """
+    ext = EXPORT_FORMATS[fmt][1]
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for chat in db.list_user_chats(user_id):
+            with zf.open(archive_name(chat, ext), mode="w", force_zip64=True) as member:
+                for chunk in iter_chat_export(chat, fmt):
+                    member.write(chunk)
+                    if sink.pending >= ZIP_FLUSH_BYTES:
+                        yield sink.drain()
+            if sink.pending:
+                yield sink.drain()
+    yield sink.drain()
@@ -0,0 +1,253 @@
+import asyncio
+import os
+import shutil
+import signal
+import tempfile
+from collections import defaultdict
+
+from warm_runtimes import (
+    WARM_RUNTIMES_ENABLED, JavaClassCache, RuntimePool, WarmCommandUnavailable, WarmRuntimeError,
+    java_runner_command, node_runner_command, read_lines,
+)
+
+EXEC_WORKERS = int(os.getenv("EXEC_WORKERS", "4"))
+EXEC_QUEUE_SIZE = int(os.getenv("EXEC_QUEUE_SIZE", "32"))
+EXEC_PER_USER = int(os.getenv("EXEC_PER_USER", "2"))
+EXEC_TIMEOUT = 10
+
+SUPPORTED_LANGUAGES = ("python", "javascript", "java")
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class ExecJob:
+    """One /run_code request. Output is pushed to `events` as it is produced."""
+
+    def __init__(self, language, code, user_id):
+        self.language = language
+        self.code = code
+        self.user_id = user_id
+        self.events = asyncio.Queue()
+
+    def emit(self, kind, data):
+        self.events.put_nowait((kind, data))
+
+    async def stream(self):
+        """Yield (kind, data) until the final ("result", {...}) event."""
+        while True:
+            kind, data = await self.events.get()
+            yield kind, data
+            if kind == "result":
+                return
+
+    async def result(self):
+        async for kind, data in self.stream():
+            if kind == "result":
+                return data
+
+
+def _result(status, output, error):
+    return {"status": status, "output": output, "error": error}
+
+
+class ExecutionEngine:
+    """
+    Runs user code in subprocesses without blocking the event loop. Jobs wait on
+    a bounded queue served by a fixed number of workers. Each user may hold at
+    most `per_user` queued or running jobs.
+    """
+
+    def __init__(self, workers=EXEC_WORKERS, queue_size=EXEC_QUEUE_SIZE, per_user=EXEC_PER_USER, timeout=EXEC_TIMEOUT):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.per_user = per_user
+        self.timeout = timeout
+        self._queue = None
+        self._worker_tasks = []
+        self._user_slots = defaultdict(lambda: asyncio.Semaphore(self.per_user))
+
+        self.python_cmd = shutil.which("python3") or shutil.which("python") or "python3"
+        self.node_cmd = shutil.which("node") or shutil.which("nodejs") or "node"
+
+        self.class_cache = JavaClassCache()
+        self.warm = WARM_RUNTIMES_ENABLED
+        self._pools = {}
+        self._pool_failed = set()
+        self._unavailable = set()  # (language, command) the warm runner cannot serve
+
+    async def _pool(self, language):
+        """Warm runtime pool for `language`, or None to run cold."""
+        if not self.warm or language in self._pool_failed:
+            return None
+        pool = self._pools.get(language)
+        if pool is None:
+            try:
+                if language == "java":
+                    command = await asyncio.to_thread(java_runner_command)
+                else:
+                    command = node_runner_command(self.node_cmd)
+            except Exception as e:
+                print(f"[code_runner] warm {language} runtime unavailable, running cold: {e}")
+                self._pool_failed.add(language)
+                return None
+            pool = self._pools[language] = RuntimePool(command)
+        return pool
+
+    async def _call_warm(self, language, args, job):
+        """Run a command on a warm runtime; None means fall back to a cold process."""
+        if (language, args[0]) in self._unavailable:
+            return None
+        pool = await self._pool(language)
+        if pool is None:
+            return None
+        try:
+            return await pool.call(args, self.timeout, job)
+        except WarmCommandUnavailable as e:
+            print(f"[code_runner] warm {language} runtime cannot {args[0]}, running cold from now on: {e}")
+            self._unavailable.add((language, args[0]))
+            return None
+        except (OSError, WarmRuntimeError) as e:
+            print(f"[code_runner] warm {language} runtime failed, running cold: {e}")
+            return None
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._worker_tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def submit(self, language, code, user_id=None) -> ExecJob:
+        """Queue a job; waits for a per-user slot and raises QueueFullError if the queue is full."""
+        self._ensure_workers()
+        job = ExecJob(language, code, user_id)
+        slot = self._user_slots[user_id]
+        await slot.acquire()
+        try:
+            self._queue.put_nowait((job, slot))
+        except asyncio.QueueFull:
+            slot.release()
+            raise QueueFullError("Too many code executions in progress, try again shortly.")
+        job.emit("status", "queued")
+        return job
+
+    async def _worker(self):
+        while True:
+            job, slot = await self._queue.get()
+            try:
+                job.emit("status", "running")
+                job.emit("result", await self._run(job))
+            except Exception as e:
+                job.emit("result", _result("error", "", f"Failed to run code: {str(e)}"))
+            finally:
+                slot.release()
+                self._queue.task_done()
+
+    async def _compile_java(self, path, workdir, source):
+        """Class dir for the job's source, compiling only on a cache miss. Returns (class_dir, error)."""
+        key, class_dir = self.class_cache.lookup(source)
+        if class_dir is not None:
+            return class_dir, None
+        staging = self.class_cache.staging_dir()
+        result = await self._call_warm("java", ["compile", path, str(staging)], None)
+        if result is None:
+            result = await self._exec(["javac", "-d", str(staging), path], workdir, None)
+        ret, out, err, timed_out = result
+        if timed_out or ret != 0:
+            shutil.rmtree(staging, ignore_errors=True)
+            return None, _result("error", out, f"Compilation failed: {err}")
+        return self.class_cache.commit(key, staging), None
+
+    async def _run(self, job: ExecJob):
+        with tempfile.TemporaryDirectory() as workdir:
+            if job.language == "python":
+                path = os.path.join(workdir, "main.py")
+            elif job.language == "javascript":
+                path = os.path.join(workdir, "main.js")
+            elif job.language == "java":
+                path = os.path.join(workdir, "Main.java")
+            else:
+                return _result("error", "", f"Unsupported or unsafe language for execution: {job.language}")
+
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(job.code)
+
+            result = None
+            if job.language == "python":
+                command = [self.python_cmd, path]
+            elif job.language == "javascript":
+                command = [self.node_cmd, path]
+                result = await self._call_warm("javascript", ["run", path], job)
+            else:
+                class_dir, error = await self._compile_java(path, workdir, job.code)
+                if error:
+                    return error
+                command = ["java", "-cp", str(class_dir), "Main"]
+                result = await self._call_warm("java", ["run", str(class_dir)], job)
+
+            if result is None:
+                result = await self._exec(command, workdir, job)
+            ret, out, err, timed_out = result
+            if timed_out:
+                return _result("error", out, f"Code execution timed out after {self.timeout} seconds. The process was terminated.")
+            if ret != 0:
+                full_error_output = f"Execution failed with exit code {ret}.\n"
+                if out:
+                    full_error_output += f"STDOUT:\n{out}\n"
+                if err:
+                    full_error_output += f"STDERR:\n{err}"
+                return _result("error", out, full_error_output)
+            return _result("success", out, err)
+
+    async def _exec(self, command, cwd, job):
+        """Run `command`, forwarding lines to `job` (if any). Returns (code, stdout, stderr, timed_out)."""
+        proc = await asyncio.create_subprocess_exec(
+            *command,
+            cwd=cwd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=(os.name != "nt"),
+        )
+        out_lines, err_lines = [], []
+
+        async def pump(stream, sink, kind):
+            async for text in read_lines(stream):
+                sink.append(text)
+                if job is not None:
+                    job.emit(kind, text)
+
+        pumps = asyncio.gather(pump(proc.stdout, out_lines, "stdout"), pump(proc.stderr, err_lines, "stderr"))
+        timed_out = False
+        try:
+            await asyncio.wait_for(proc.wait(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            self._kill(proc)
+            await proc.wait()
+        try:
+            await asyncio.wait_for(pumps, timeout=1)
+        except asyncio.TimeoutError:
+            pumps.cancel()
+        return proc.returncode, "".join(out_lines), "".join(err_lines), timed_out
+
+    @staticmethod
+    def _kill(proc):
+        try:
+            if os.name != "nt":
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                proc.kill()
+        except ProcessLookupError:
+            pass
+
+    async def close(self):
+        for pool in self._pools.values():
+            pool.close()
+        self._pools = {}
+        for task in self._worker_tasks:
+            task.cancel()
+        self._worker_tasks = []
+        self._queue = None
+
+
+execution_engine = ExecutionEngine()
@@ -0,0 +1,166 @@
+import asyncio
+import os
+import re
+
+import db
+from config import CHAT_MODEL
+from scraper import count_tokens, fair_share, truncate_to_tokens
+
+# Token budget for prior turns (summary included); the current message is extra.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+# How many recent rows to look at when packing the window.
+CONTEXT_SCAN_TURNS = int(os.getenv("CONTEXT_SCAN_TURNS", "50"))
+# Turns folded into the summary per refresh, and the per-turn cap inside that prompt.
+SUMMARY_BATCH_TURNS = 20
+# Oldest turns a refresh will go back for; anything earlier is left out of the summary.
+SUMMARY_MAX_TURNS = int(os.getenv("SUMMARY_MAX_TURNS", "100"))
+SUMMARY_TURN_TOKENS = 600
+SUMMARY_MAX_TOKENS = 400
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", CHAT_MODEL)
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Update the existing summary with the new turns. Keep names, facts, decisions, open questions "
+    "and user preferences; drop code listings and pleasantries. Reply with the updated summary only, "
+    "in at most 200 words."
+)
+
+
+def strip_first_think_block(text: str) -> str:
+
+    cleaned_text = re.sub(r"<think>[\s\S]*?</think>", "", text, count=1)
+    return re.sub(r"###CODE_EXEC[\s\S]*?###CODE_EXEC", "", cleaned_text)
+
+
+class ChatContext:
+    """Packed history for one request: an optional summary plus recent turns, oldest first."""
+
+    def __init__(self, summary, turns):
+        self.summary = summary
+        self.turns = turns  # list of (user_text, bot_text)
+
+    def messages(self, user_content=None):
+        """History as chat messages. `user_content` maps stored user text to message content."""
+        messages = []
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+        for user_text, bot_text in self.turns:
+            content = user_content(user_text) if user_content else user_text
+            messages.append({"role": "user", "content": content})
+            messages.append({"role": "assistant", "content": bot_text})
+        return messages
+
+
+class ContextBuilder:
+    """
+    Packs a chat's history into a token budget, newest turns first. Turns that fall
+    out of the window are folded into a per-chat rolling summary (chat_summaries
+    table), which is refreshed in the background so requests never wait on it.
+    """
+
+    def __init__(self, client_factory, budget=CONTEXT_TOKEN_BUDGET):
+        self.client_factory = client_factory
+        self.budget = budget
+        self._locks = {}
+        self._tasks = set()
+
+    async def build(self, chat_id, budget=None) -> ChatContext:
+        """Pack the window off the event loop (SQLite reads, tokenizing) and schedule a summary refresh if due."""
+        if not chat_id:
+            return ChatContext(None, [])
+        context, refresh_up_to = await asyncio.to_thread(self._pack, chat_id, budget or self.budget)
+        if refresh_up_to is not None:
+            self._schedule_refresh(chat_id, refresh_up_to)
+        return context
+
+    def _pack(self, chat_id, budget):
+        """Returns (context, id the summary should be advanced to, or None)."""
+        summary_row = db.get_chat_summary(chat_id)
+        summary = summary_row["summary"] if summary_row else None
+        summarized_up_to = summary_row["last_history_id"] if summary_row else 0
+        used = count_tokens(summary) if summary else 0
+
+        packed = []
+        oldest_packed_id = None
+        rows = db.get_recent_history(chat_id, CONTEXT_SCAN_TURNS)
+        for row in rows:
+            if row["id"] <= summarized_up_to:
+                break
+            user_text = row["user_text"]
+            bot_text = strip_first_think_block(row["bot_text"])
+            user_cost, bot_cost = count_tokens(user_text), count_tokens(bot_text)
+            cost = user_cost + bot_cost
+            if packed and used + cost > budget:
+                break
+            if not packed and used + cost > budget:
+                # Always keep the latest turn, both sides trimmed to a fair share of what is left
+                user_share, bot_share = fair_share([user_cost, bot_cost], max(budget - used, 0))
+                user_text = truncate_to_tokens(user_text, user_share)
+                bot_text = truncate_to_tokens(bot_text, bot_share)
+                cost = user_share + bot_share
+            packed.append((user_text, bot_text))
+            oldest_packed_id = row["id"]
+            used += cost
+
+        packed.reverse()
+        refresh_up_to = None
+        if oldest_packed_id is not None and self._has_unsummarized(chat_id, summarized_up_to, oldest_packed_id):
+            refresh_up_to = oldest_packed_id
+        return ChatContext(summary, packed), refresh_up_to
+
+    def _has_unsummarized(self, chat_id, summarized_up_to, oldest_packed_id):
+        return bool(db.get_history_between(chat_id, summarized_up_to, oldest_packed_id, 1))
+
+    def _schedule_refresh(self, chat_id, up_to_id):
+        loop = asyncio.get_running_loop()
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        if lock.locked():
+            return
+        task = loop.create_task(self._refresh_summary(chat_id, up_to_id, lock))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh_summary(self, chat_id, up_to_id, lock):
+        async with lock:
+            try:
+                # Only the last SUMMARY_MAX_TURNS turns before the window are folded in, so
+                # the first refresh of a long existing chat costs a few LLM calls, not hundreds.
+                window = await asyncio.to_thread(db.get_history_page, chat_id, up_to_id, SUMMARY_MAX_TURNS)
+                floor = window[-1]["id"] - 1 if len(window) == SUMMARY_MAX_TURNS else 0
+                while True:
+                    row = await asyncio.to_thread(db.get_chat_summary, chat_id)
+                    summary = row["summary"] if row else ""
+                    after_id = max(row["last_history_id"] if row else 0, floor)
+                    turns = await asyncio.to_thread(db.get_history_between, chat_id, after_id, up_to_id, SUMMARY_BATCH_TURNS)
+                    if not turns:
+                        return
+                    summary = await self._summarize(summary, turns)
+                    if not summary:
+                        return
+                    await asyncio.to_thread(db.save_chat_summary, chat_id, summary, turns[-1]["id"])
+            except Exception as e:
+                print(f"Summary refresh failed for chat {chat_id}: {e}")
+            finally:
+                self._locks.pop(chat_id, None)
+
+    async def _summarize(self, summary, turns):
+        transcript = await asyncio.to_thread(self._transcript, turns)
+        client = self.client_factory()
+        response = await client.chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": f"Existing summary:\n{summary or '(none)'}\n\nNew turns:\n{transcript}"},
+            ],
+            max_tokens=SUMMARY_MAX_TOKENS,
+            temperature=0.2,
+        )
+        return (response.choices[0].message.content or "").strip()
+
+    @staticmethod
+    def _transcript(turns):
+        return "\n\n".join(
+            f"User: {truncate_to_tokens(t['user_text'], SUMMARY_TURN_TOKENS)}\n"
+            f"Assistant: {truncate_to_tokens(strip_first_think_block(t['bot_text']), SUMMARY_TURN_TOKENS)}"
+            for t in turns
+        )
@@ -0,0 +1,901 @@
+import asyncio
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = os.getenv("DATABASE_URL", "chat_history.db")
+
+# sqlite3 keeps a per-connection LRU of compiled statements keyed by SQL text;
+# the helpers below always use the same literal SQL so every hot query is
+# prepared once per thread.
+STATEMENT_CACHE_SIZE = 256
+
+# Upper bound for INTEGER PRIMARY KEY, used as the "no cursor yet" keyset value
+SQLITE_MAX_ROWID = 2 ** 63 - 1
+
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+)
+
+# Group commit for hot INSERTs (see WriteBehindQueue)
+WRITE_BEHIND_ENABLED = os.getenv("DB_WRITE_BEHIND", "1") == "1"
+WRITE_BATCH_MAX_ROWS = int(os.getenv("DB_WRITE_BATCH_ROWS", "256"))
+WRITE_BATCH_WINDOW_MS = float(os.getenv("DB_WRITE_BATCH_WINDOW_MS", "0"))
+
+# Log hot queries that fall back to a table scan at startup (tests/test_db.py enforces it)
+CHECK_QUERY_PLANS = os.getenv("DB_CHECK_QUERY_PLANS", "0") == "1"
+
+_local = threading.local()
+_connections: list[sqlite3.Connection] = []
+_connections_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, timeout=30, cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_conn() -> sqlite3.Connection:
+    """Return the calling thread's connection, opening it on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _connect()
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    """Commit on success, roll back on error."""
+    conn = get_conn()
+    with conn:
+        yield conn
+
+
+class WriteBehindQueue:
+    """
+    One writer thread that runs queued INSERTs from every request in shared
+    transactions: everything queued while the previous batch was committing,
+    plus whatever arrives within `window_ms`, up to `max_rows`, is committed
+    together, so N concurrent inserts cost one fsync instead of N. The default
+    window of 0 adds no latency to a lone insert; a positive window trades
+    latency for bigger batches. Its connection uses synchronous=FULL; the
+    batching pays for that.
+
+    When nothing is queued and nobody is committing, execute() commits on the
+    caller's thread instead (same connection, same guarantees): a lone writer
+    would otherwise pay a thread handoff per row for batches of one.
+
+    submit() returns a Future that resolves to the row id only after the batch
+    holding it has committed, so a caller that waits on it has a durable row.
+    Each statement runs under its own SAVEPOINT and a failing one only fails
+    its own Future.
+    """
+
+    def __init__(self, max_rows: int = WRITE_BATCH_MAX_ROWS, window_ms: float = WRITE_BATCH_WINDOW_MS):
+        self.max_rows = max_rows
+        self.window = window_ms / 1000
+        self.batches = 0
+        self.rows = 0
+        self.direct = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._conn = None
+        self._writing = threading.Lock()  # held by whoever is committing on self._conn
+
+    def submit(self, sql: str, params: tuple) -> Future:
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Database writer is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+            self._queue.put((sql, params, future))
+        return future
+
+    def _writer_conn(self) -> sqlite3.Connection:
+        """The shared writer connection; only touched with self._writing held."""
+        if self._conn is None:
+            self._conn = _connect()
+            self._conn.isolation_level = None  # explicit BEGIN/COMMIT in _commit
+            self._conn.execute("PRAGMA synchronous = FULL")
+        return self._conn
+
+    def execute(self, sql: str, params: tuple) -> int:
+        """Queue the INSERT and wait until it is committed; after close() it is written directly."""
+        if self._queue.empty() and self._writing.acquire(blocking=False):
+            try:
+                if not self._closed:
+                    future = Future()
+                    self._commit(self._writer_conn(), [(sql, params, future)])
+                    self.direct += 1
+                    return future.result()
+            finally:
+                self._writing.release()
+        try:
+            future = self.submit(sql, params)
+        except RuntimeError:
+            with transaction() as conn:
+                return conn.execute(sql, params).lastrowid
+        return future.result()
+
+    async def execute_async(self, sql: str, params: tuple) -> int:
+        # Always queued: committing inline would block the event loop, and
+        # to_thread costs the same handoff as the writer thread
+        try:
+            future = self.submit(sql, params)
+        except RuntimeError:
+            return await asyncio.to_thread(self.execute, sql, params)
+        return await asyncio.wrap_future(future)
+
+    def _next_batch(self):
+        """Block for the first statement, then gather more until the window or max_rows is hit."""
+        first = self._queue.get()
+        if first is None:
+            return None, True
+        batch = [first]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_rows:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _commit(self, conn: sqlite3.Connection, batch) -> None:
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for sql, params, future in batch:
+                conn.execute("SAVEPOINT write_behind_row")
+                try:
+                    rowid = conn.execute(sql, params).lastrowid
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write_behind_row")
+                    conn.execute("RELEASE write_behind_row")
+                    results.append((future, None, e))
+                    continue
+                conn.execute("RELEASE write_behind_row")
+                results.append((future, rowid, None))
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.error("Write-behind batch of %d rows failed: %s", len(batch), e)
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        self.batches += 1
+        self.rows += len(batch)
+        for future, rowid, error in results:
+            if error is None:
+                future.set_result(rowid)
+            else:
+                future.set_exception(error)
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            if batch:
+                with self._writing:
+                    self._commit(self._writer_conn(), batch)
+
+    def close(self) -> None:
+        """Stop accepting writes, commit everything already queued and stop the thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+        with self._writing:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "rows": self.rows, "direct": self.direct}
+
+
+write_queue = WriteBehindQueue()
+
+
+def _insert(sql: str, params: tuple) -> int:
+    if not WRITE_BEHIND_ENABLED:
+        with transaction() as conn:
+            return conn.execute(sql, params).lastrowid
+    return write_queue.execute(sql, params)
+
+
+async def _insert_async(sql: str, params: tuple) -> int:
+    if not WRITE_BEHIND_ENABLED:
+        return await asyncio.to_thread(_insert, sql, params)
+    return await write_queue.execute_async(sql, params)
+
+
+def close_all() -> None:
+    write_queue.close()
+    with _connections_lock:
+        for conn in _connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        _connections.clear()
+    _local.__dict__.pop("conn", None)
+
+
+def _migration_1_base_schema(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT,
+        email TEXT NOT NULL UNIQUE,
+        password_hash TEXT NOT NULL,
+        date_of_birth DATE,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS push_subscriptions (
+      id INTEGER PRIMARY KEY AUTOINCREMENT,
+      user_id INTEGER NOT NULL,
+      subscription_json TEXT NOT NULL,
+      created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS chats (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        is_private INTEGER NOT NULL DEFAULT 0,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS images (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        image_url TEXT NOT NULL,
+        prompt TEXT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        user_text TEXT NOT NULL,
+        bot_text TEXT NOT NULL,
+        ts DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (chat_id) REFERENCES chats (id)
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS memory (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        memory TEXT NOT NULL,
+        ts DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS code_files (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        filename TEXT NOT NULL,
+        code TEXT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS agents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        title TEXT NOT NULL,
+        time TEXT NOT NULL,
+        frequency TEXT NOT NULL,
+        prompt TEXT NOT NULL,
+        notification INTEGER NOT NULL DEFAULT 0,
+        paused INTEGER NOT NULL DEFAULT 0,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    """)
+
+
+def _migration_2_hot_query_indexes(conn: sqlite3.Connection) -> None:
+    # get_last_history / get_chat_history: WHERE chat_id = ? ORDER BY id
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_history_chat_id ON history (chat_id, id)")
+    # /chats: WHERE user_id = ? AND is_private = 0 ORDER BY created_at DESC
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_user_private_created ON chats (user_id, is_private, created_at)")
+    # /code-files: WHERE user_id = ? GROUP BY filename, MAX(created_at)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_code_files_user_filename_created ON code_files (user_id, filename, created_at)")
+    # send_push_to_user
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_push_subscriptions_user ON push_subscriptions (user_id)")
+    # /images and /agents listings
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_images_user_created ON images (user_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_agents_user_created ON agents (user_id, created_at)")
+
+
+def _migration_3_chat_summaries(conn: sqlite3.Connection) -> None:
+    # Rolling summary of turns that no longer fit the context budget
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS chat_summaries (
+        chat_id INTEGER PRIMARY KEY,
+        summary TEXT NOT NULL,
+        last_history_id INTEGER NOT NULL,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (chat_id) REFERENCES chats (id) ON DELETE CASCADE
+    )
+    """)
+
+
+def _migration_4_memory_owner(conn: sqlite3.Connection) -> None:
+    # Memories become per user. Rows saved before this (user_id NULL) are
+    # handed to their owners by _migration_7_memory_owner_backfill.
+    conn.execute("ALTER TABLE memory ADD COLUMN user_id INTEGER REFERENCES users (id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_memory_user ON memory (user_id)")
+
+
+def _migration_5_chat_keyset_index(conn: sqlite3.Connection) -> None:
+    # /chats?before_id=: WHERE user_id = ? AND is_private = 0 AND id < ? ORDER BY id DESC
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_chats_user_private_id ON chats (user_id, is_private, id)")
+
+
+def _migration_6_history_fts(conn: sqlite3.Connection) -> None:
+    # Full-text index over chat turns. `owner` holds "u<user_id>" ("p<user_id>"
+    # for private chats) so a search intersects with that user's postings
+    # instead of filtering every match. Text is not duplicated: the index reads
+    # it back through history_fts_source.
+    owner = "(CASE c.is_private WHEN 0 THEN 'u' ELSE 'p' END || c.user_id)"
+    conn.execute(f"""
+    CREATE VIEW IF NOT EXISTS history_fts_source AS
+    SELECT h.id AS id, h.user_text AS user_text, h.bot_text AS bot_text, {owner} AS owner
+    FROM history h JOIN chats c ON c.id = h.chat_id
+    """)
+    conn.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+        user_text, bot_text, owner,
+        content = 'history_fts_source', content_rowid = 'id',
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """)
+    # Rows up to backfill_end existed before the index; backfill_done is how far
+    # backfill_history_fts has got. Rows in between are not indexed yet.
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS history_fts_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        backfill_end INTEGER NOT NULL,
+        backfill_done INTEGER NOT NULL
+    )
+    """)
+    conn.execute(
+        "INSERT OR IGNORE INTO history_fts_state (id, backfill_end, backfill_done) "
+        "SELECT 1, COALESCE(MAX(id), 0), 0 FROM history"
+    )
+    indexed = "(old.id > (SELECT backfill_end FROM history_fts_state) OR old.id <= (SELECT backfill_done FROM history_fts_state))"
+    fts_insert = f"""
+        INSERT INTO history_fts (rowid, user_text, bot_text, owner)
+        VALUES (new.id, new.user_text, new.bot_text, (SELECT {owner} FROM chats c WHERE c.id = new.chat_id));
+    """
+    fts_delete = f"""
+        INSERT INTO history_fts (history_fts, rowid, user_text, bot_text, owner)
+        VALUES ('delete', old.id, old.user_text, old.bot_text, (SELECT {owner} FROM chats c WHERE c.id = old.chat_id));
+    """
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS history_fts_ai AFTER INSERT ON history BEGIN {fts_insert} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS history_fts_ad AFTER DELETE ON history WHEN {indexed} BEGIN {fts_delete} END")
+    conn.execute(
+        f"CREATE TRIGGER IF NOT EXISTS history_fts_au AFTER UPDATE OF user_text, bot_text, chat_id ON history "
+        f"WHEN {indexed} BEGIN {fts_delete} {fts_insert} END"
+    )
+
+
+def _migration_7_memory_owner_backfill(conn: sqlite3.Connection) -> None:
+    # Ownerless memories were shown to every user, so every existing user gets
+    # their own copy; the table is rebuilt with user_id NOT NULL so no row can
+    # be ownerless again.
+    conn.execute("""
+    CREATE TABLE memory_owned (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        memory TEXT NOT NULL,
+        ts DATETIME DEFAULT CURRENT_TIMESTAMP,
+        user_id INTEGER NOT NULL REFERENCES users (id)
+    )
+    """)
+    conn.execute("INSERT INTO memory_owned (id, memory, ts, user_id) SELECT id, memory, ts, user_id FROM memory WHERE user_id IS NOT NULL")
+    conn.execute("""
+    INSERT INTO memory_owned (memory, ts, user_id)
+    SELECT m.memory, m.ts, u.id FROM memory m CROSS JOIN users u
+    WHERE m.user_id IS NULL ORDER BY u.id, m.id
+    """)
+    conn.execute("DROP TABLE memory")
+    conn.execute("ALTER TABLE memory_owned RENAME TO memory")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_memory_user ON memory (user_id)")
+
+
+# Append-only: each entry runs once, in order, and bumps PRAGMA user_version.
+# Never edit a migration that has shipped; add a new one instead.
+MIGRATIONS = [
+    _migration_1_base_schema,
+    _migration_2_hot_query_indexes,
+    _migration_3_chat_summaries,
+    _migration_4_memory_owner,
+    _migration_5_chat_keyset_index,
+    _migration_6_history_fts,
+    _migration_7_memory_owner_backfill,
+]
+
+
+def migrate() -> int:
+    """Apply pending migrations and return the resulting schema version."""
+    conn = get_conn()
+    current = conn.execute("PRAGMA user_version").fetchone()[0]
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if version <= current:
+            continue
+        with conn:
+            # Explicit BEGIN so DDL and the version bump commit atomically.
+            conn.execute("BEGIN")
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {version}")
+        logger.info("Applied schema migration %d (%s)", version, migration.__name__)
+        current = version
+    return current
+
+
+# ---------- hot queries ----------
+SQL_LAST_HISTORY = "SELECT user_text, bot_text FROM history WHERE chat_id = ? ORDER BY id DESC LIMIT ?"
+SQL_RECENT_HISTORY = "SELECT id, user_text, bot_text FROM history WHERE chat_id = ? ORDER BY id DESC LIMIT ?"
+SQL_HISTORY_BETWEEN = "SELECT id, user_text, bot_text FROM history WHERE chat_id = ? AND id > ? AND id < ? ORDER BY id ASC LIMIT ?"
+SQL_CHAT_HISTORY = "SELECT id, user_text, bot_text, ts FROM history WHERE chat_id = ? ORDER BY id ASC"
+SQL_CHAT_HISTORY_AFTER = "SELECT id, user_text, bot_text, ts FROM history WHERE chat_id = ? AND id > ? ORDER BY id ASC LIMIT ?"
+SQL_HISTORY_PAGE = "SELECT id, user_text, bot_text, ts FROM history WHERE chat_id = ? AND id < ? ORDER BY id DESC LIMIT ?"
+SQL_USER_CHATS = "SELECT id, title, created_at FROM chats WHERE user_id = ? AND is_private = 0 ORDER BY created_at DESC"
+SQL_USER_CHATS_PAGE = "SELECT id, title, created_at FROM chats WHERE user_id = ? AND is_private = 0 AND id < ? ORDER BY id DESC LIMIT ?"
+SQL_LATEST_CODE_FILES = """
+    SELECT id, filename, code, MAX(created_at) as last_saved
+    FROM code_files
+    WHERE user_id = ?
+    GROUP BY filename
+    ORDER BY last_saved DESC
+"""
+SQL_PUSH_SUBSCRIPTIONS = "SELECT id, subscription_json FROM push_subscriptions WHERE user_id = ?"
+SQL_USER_IMAGES = """
+    SELECT id, image_url, prompt, created_at
+    FROM images
+    WHERE user_id = ?
+    ORDER BY created_at DESC
+    LIMIT ?
+"""
+SQL_USER_AGENTS = "SELECT * FROM agents WHERE user_id = ? ORDER BY created_at DESC"
+
+# Hot inserts, batched through write_queue
+SQL_INSERT_CHAT = "INSERT INTO chats (user_id, title, is_private) VALUES (?, ?, ?)"
+SQL_INSERT_HISTORY = "INSERT INTO history (chat_id, user_text, bot_text) VALUES (?, ?, ?)"
+SQL_INSERT_CODE_FILE = "INSERT INTO code_files (user_id, filename, code) VALUES (?, ?, ?)"
+SQL_INSERT_IMAGE = "INSERT INTO images (user_id, image_url, prompt) VALUES (?, ?, ?)"
+
+# Queries on request paths that must be served from an index. Parameters are
+# placeholders; only the plan matters.
+HOT_QUERIES = {
+    "get_last_history": (SQL_LAST_HISTORY, (1, 15)),
+    "get_chat_history": (SQL_CHAT_HISTORY, (1,)),
+    "iter_chat_history": (SQL_CHAT_HISTORY_AFTER, (1, 0, 500)),
+    "get_recent_history": (SQL_RECENT_HISTORY, (1, 50)),
+    "get_history_between": (SQL_HISTORY_BETWEEN, (1, 0, 100, 20)),
+    "get_history_page": (SQL_HISTORY_PAGE, (1, 100, 50)),
+    "list_user_chats": (SQL_USER_CHATS, (1,)),
+    "list_user_chats_page": (SQL_USER_CHATS_PAGE, (1, 100, 50)),
+    "list_latest_code_files": (SQL_LATEST_CODE_FILES, (1,)),
+    "list_push_subscriptions": (SQL_PUSH_SUBSCRIPTIONS, (1,)),
+    "list_images": (SQL_USER_IMAGES, (1, 50)),
+    "list_agents": (SQL_USER_AGENTS, (1,)),
+}
+
+
+def find_full_scans(conn: Optional[sqlite3.Connection] = None) -> dict[str, list[str]]:
+    """Return {query_name: plan_lines} for every hot query whose plan contains a table scan."""
+    conn = conn or get_conn()
+    offenders = {}
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+        if any(detail.startswith("SCAN ") for detail in plan):
+            offenders[name] = plan
+    return offenders
+
+
+def init_db() -> None:
+    migrate()
+    if not CHECK_QUERY_PLANS:
+        return
+    for name, plan in find_full_scans().items():
+        logger.warning("Hot query %s falls back to a full scan: %s", name, "; ".join(plan))
+
+
+# ---------- users ----------
+def get_user_by_email(email: str) -> Optional[sqlite3.Row]:
+    return get_conn().execute("SELECT * FROM users WHERE email = ?", (email.lower(),)).fetchone()
+
+
+def get_user_by_id(user_id: int) -> Optional[sqlite3.Row]:
+    return get_conn().execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+
+
+def user_exists(user_id: int) -> bool:
+    return get_conn().execute("SELECT 1 FROM users WHERE id = ?", (user_id,)).fetchone() is not None
+
+
+def create_user(username: str, email: str, password_hash: str, dob: str | None) -> int:
+    with transaction() as conn:
+        cur = conn.execute(
+            "INSERT INTO users (username, email, password_hash, date_of_birth) VALUES (?, ?, ?, ?)",
+            (username, email.lower(), password_hash, dob)
+        )
+    return cur.lastrowid
+
+
+# ---------- chats ----------
+def list_user_chats(user_id: int) -> list[sqlite3.Row]:
+    return get_conn().execute(SQL_USER_CHATS, (user_id,)).fetchall()
+
+
+def get_chat(chat_id: int) -> Optional[sqlite3.Row]:
+    return get_conn().execute(
+        "SELECT id, user_id, title, is_private, created_at FROM chats WHERE id = ?", (chat_id,)
+    ).fetchone()
+
+
+def list_user_chats_page(user_id: int, before_id: Optional[int], limit: int) -> list[sqlite3.Row]:
+    """Newest first by id, only ids below `before_id` (None = from the newest)."""
+    before_id = before_id if before_id is not None else SQLITE_MAX_ROWID
+    return get_conn().execute(SQL_USER_CHATS_PAGE, (user_id, before_id, limit)).fetchall()
+
+
+def create_chat(user_id: int, title: str, is_private: int = 0) -> int:
+    return _insert(SQL_INSERT_CHAT, (user_id, title, is_private))
+
+
+async def create_chat_async(user_id: int, title: str, is_private: int = 0) -> int:
+    """create_chat() without blocking the event loop; returns once the row is committed."""
+    return await _insert_async(SQL_INSERT_CHAT, (user_id, title, is_private))
+
+
+def rename_chat(chat_id: int, title: str) -> None:
+    with transaction() as conn:
+        conn.execute("UPDATE chats SET title = ? WHERE id = ?", (title, chat_id))
+
+
+def delete_chat(chat_id: int) -> None:
+    with transaction() as conn:
+        conn.execute("DELETE FROM history WHERE chat_id = ?", (chat_id,))
+        conn.execute("DELETE FROM chat_summaries WHERE chat_id = ?", (chat_id,))
+        conn.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+
+
+# ---------- history ----------
+def add_history(chat_id: int, user_text: str, bot_text: str) -> int:
+    return _insert(SQL_INSERT_HISTORY, (chat_id, user_text, bot_text))
+
+
+async def add_history_async(chat_id: int, user_text: str, bot_text: str) -> int:
+    """add_history() without blocking the event loop; returns once the row is committed."""
+    return await _insert_async(SQL_INSERT_HISTORY, (chat_id, user_text, bot_text))
+
+
+def get_last_history(chat_id: int, n: int = 15) -> list[sqlite3.Row]:
+    rows = get_conn().execute(SQL_LAST_HISTORY, (chat_id, n)).fetchall()
+    return list(reversed(rows))  # chronological order
+
+
+def get_recent_history(chat_id: int, n: int) -> list[sqlite3.Row]:
+    """Newest first, with ids."""
+    return get_conn().execute(SQL_RECENT_HISTORY, (chat_id, n)).fetchall()
+
+
+def get_history_between(chat_id: int, after_id: int, before_id: int, limit: int) -> list[sqlite3.Row]:
+    """Oldest first, exclusive on both ends."""
+    return get_conn().execute(SQL_HISTORY_BETWEEN, (chat_id, after_id, before_id, limit)).fetchall()
+
+
+def get_chat_history(chat_id: int) -> list[sqlite3.Row]:
+    return get_conn().execute(SQL_CHAT_HISTORY, (chat_id,)).fetchall()
+
+
+def get_history_page(chat_id: int, before_id: Optional[int], limit: int) -> list[sqlite3.Row]:
+    """Newest first, only ids below `before_id` (None = from the latest turn)."""
+    before_id = before_id if before_id is not None else SQLITE_MAX_ROWID
+    return get_conn().execute(SQL_HISTORY_PAGE, (chat_id, before_id, limit)).fetchall()
+
+
+def iter_chat_history(chat_id: int, batch_size: int = 500) -> Iterator[sqlite3.Row]:
+    """
+    Every turn of a chat, oldest first, read `batch_size` rows at a time. No
+    cursor is held between batches, so callers may resume from another thread.
+    """
+    last_id = 0
+    while True:
+        rows = get_conn().execute(SQL_CHAT_HISTORY_AFTER, (chat_id, last_id, batch_size)).fetchall()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1]["id"]
+
+
+# ---------- history search ----------
+FTS_BACKFILL_BATCH = 2000
+# bm25() derives IDF from each phrase's full doclist, which costs ~100 ms on a
+# common word at 1M rows however few of them the user owns. Instead the newest
+# SEARCH_CANDIDATES matches are fetched (cheap: rowid order) and ranked here.
+SEARCH_CANDIDATES = 200
+BM25_K1 = 1.2
+BM25_B = 0.75
+TOKEN_RE = re.compile(r"[^\W_]+")  # unicode61: letters and digits, "_" separates
+SQL_SEARCH_CANDIDATES = "SELECT rowid FROM history_fts WHERE history_fts MATCH ? ORDER BY rowid DESC LIMIT ?"
+SQL_SEARCH_SNIPPET = "SELECT snippet(history_fts, -1, ?, ?, '…', ?) FROM history_fts WHERE history_fts MATCH ? AND rowid = ?"
+
+
+def _fold(text: str) -> str:
+    """Case and diacritic folding matching the index's unicode61 tokenizer."""
+    text = text.casefold()
+    if text.isascii():
+        return text
+    return "".join(ch for ch in unicodedata.normalize("NFKD", text) if not unicodedata.combining(ch))
+
+
+def search_terms(text: str) -> list[str]:
+    return TOKEN_RE.findall(_fold(text))
+
+
+def fts_query(user_id: int, terms: list[str]) -> Optional[str]:
+    """
+    MATCH expression limited to the user's public chats in which every term
+    must appear. Terms are quoted, so FTS5 syntax in them is never interpreted.
+    No prefix matching: without a prefix index FTS5 merges the doclists of
+    every expanded term in memory, which takes seconds for common prefixes.
+    """
+    if not terms:
+        return None
+    phrases = [f'"{term}"' for term in terms]
+    return f"owner : u{int(user_id)} AND {{user_text bot_text}} : ({' '.join(phrases)})"
+
+
+def _rank(terms: list[str], docs: list[sqlite3.Row]) -> dict[int, float]:
+    """
+    BM25 over the candidates. Every candidate contains every term, so IDF only
+    reweights terms against each other and is left out.
+    """
+    tokenized = {d["id"]: search_terms(f"{d['user_text']} {d['bot_text']}") for d in docs}
+    avg_len = sum(len(tokens) for tokens in tokenized.values()) / max(len(tokenized), 1) or 1
+    wanted = set(terms)
+    scores = {}
+    for doc_id, tokens in tokenized.items():
+        tf = {}
+        for token in tokens:
+            if token in wanted:
+                tf[token] = tf.get(token, 0) + 1
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * len(tokens) / avg_len)
+        scores[doc_id] = sum(f * (BM25_K1 + 1) / (f + norm) for f in tf.values())
+    return scores
+
+
+def search_history(user_id: int, text: str, limit: int = 20, mark_open: str = "<mark>",
+                   mark_close: str = "</mark>", snippet_tokens: int = 16) -> list[dict]:
+    """
+    Best-ranked turns among the newest SEARCH_CANDIDATES matches in the user's
+    (non-private) chats, each with a snippet around the hits.
+    """
+    terms = search_terms(text)
+    query = fts_query(user_id, terms)
+    if query is None:
+        return []
+    conn = get_conn()
+    ids = [r[0] for r in conn.execute(SQL_SEARCH_CANDIDATES, (query, SEARCH_CANDIDATES))]
+    if not ids:
+        return []
+    docs = conn.execute(
+        "SELECT h.id, h.chat_id, h.user_text, h.bot_text, h.ts, c.title "
+        f"FROM history h JOIN chats c ON c.id = h.chat_id WHERE h.id IN ({','.join('?' * len(ids))})",
+        ids
+    ).fetchall()
+    scores = _rank(terms, docs)
+    best = sorted(docs, key=lambda d: (scores[d["id"]], d["id"]), reverse=True)[:limit]
+    return [
+        {
+            "id": d["id"], "chat_id": d["chat_id"], "title": d["title"], "ts": d["ts"],
+            "snippet": conn.execute(
+                SQL_SEARCH_SNIPPET, (mark_open, mark_close, snippet_tokens, query, d["id"])
+            ).fetchone()[0],
+            "score": round(scores[d["id"]], 4),
+        }
+        for d in best
+    ]
+
+
+def backfill_history_fts(batch_size: int = FTS_BACKFILL_BATCH) -> int:
+    """
+    Index the next `batch_size` rows that predate the FTS index and return
+    the id span still left to do (0 once the backfill is complete). Each batch
+    is its own short transaction, so writers are never blocked for long.
+    """
+    with transaction() as conn:
+        end, done = conn.execute("SELECT backfill_end, backfill_done FROM history_fts_state").fetchone()
+        if done >= end:
+            return 0
+        upto = conn.execute(
+            "SELECT MAX(id) FROM (SELECT id FROM history WHERE id > ? AND id <= ? ORDER BY id LIMIT ?)",
+            (done, end, batch_size)
+        ).fetchone()[0] or end
+        conn.execute(
+            "INSERT INTO history_fts (rowid, user_text, bot_text, owner) "
+            "SELECT id, user_text, bot_text, owner FROM history_fts_source WHERE id > ? AND id <= ?",
+            (done, upto)
+        )
+        conn.execute("UPDATE history_fts_state SET backfill_done = ?", (upto,))
+    return end - upto
+
+
+# ---------- chat summaries ----------
+def get_chat_summary(chat_id: int) -> Optional[sqlite3.Row]:
+    return get_conn().execute(
+        "SELECT summary, last_history_id FROM chat_summaries WHERE chat_id = ?", (chat_id,)
+    ).fetchone()
+
+
+def save_chat_summary(chat_id: int, summary: str, last_history_id: int) -> None:
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO chat_summaries (chat_id, summary, last_history_id) VALUES (?, ?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET summary = excluded.summary, "
+            "last_history_id = excluded.last_history_id, updated_at = CURRENT_TIMESTAMP",
+            (chat_id, summary, last_history_id)
+        )
+
+
+# ---------- memory ----------
+def add_memory(memory_text: str, user_id: int) -> int:
+    with transaction() as conn:
+        cur = conn.execute("INSERT INTO memory (memory, user_id) VALUES (?, ?)", (memory_text, user_id))
+    return cur.lastrowid
+
+
+def list_user_memories(user_id: int, after_id: int = 0) -> list[sqlite3.Row]:
+    """The user's own memories, oldest first (ownerless rows were backfilled by migration 7)."""
+    return get_conn().execute(
+        "SELECT id, memory FROM memory WHERE user_id = ? AND id > ? ORDER BY id ASC",
+        (user_id, after_id)
+    ).fetchall()
+
+
+def memory_version(user_id: int) -> tuple[int, int]:
+    """(count, max id) of the user's memories; changes whenever one is added or deleted."""
+    count, max_id = get_conn().execute(
+        "SELECT COUNT(*), COALESCE(MAX(id), 0) FROM memory WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    return count, max_id
+
+
+# ---------- code files ----------
+def save_code_file(user_id: int, filename: str, code: str) -> int:
+    return _insert(SQL_INSERT_CODE_FILE, (user_id, filename, code))
+
+
+async def save_code_file_async(user_id: int, filename: str, code: str) -> int:
+    """save_code_file() without blocking the event loop; returns once the row is committed."""
+    return await _insert_async(SQL_INSERT_CODE_FILE, (user_id, filename, code))
+
+
+def list_latest_code_files(user_id: int) -> list[sqlite3.Row]:
+    """Most recent version of each file for the user."""
+    return get_conn().execute(SQL_LATEST_CODE_FILES, (user_id,)).fetchall()
+
+
+def get_code_file(file_id: int, user_id: int) -> Optional[sqlite3.Row]:
+    return get_conn().execute(
+        "SELECT id, filename, code, created_at FROM code_files WHERE id = ? AND user_id = ?",
+        (file_id, user_id)
+    ).fetchone()
+
+
+# ---------- images ----------
+def add_image(user_id: int, image_url: str, prompt: str) -> int:
+    return _insert(SQL_INSERT_IMAGE, (user_id, image_url, prompt))
+
+
+async def add_image_async(user_id: int, image_url: str, prompt: str) -> int:
+    """add_image() without blocking the event loop; returns once the row is committed."""
+    return await _insert_async(SQL_INSERT_IMAGE, (user_id, image_url, prompt))
+
+
+def list_images(user_id: int, limit: int) -> list[sqlite3.Row]:
+    return get_conn().execute(SQL_USER_IMAGES, (user_id, limit)).fetchall()
+
+
+# ---------- agents ----------
+def get_agent(agent_id: int) -> Optional[sqlite3.Row]:
+    return get_conn().execute("SELECT * FROM agents WHERE id = ?", (agent_id,)).fetchone()
+
+
+def list_agents(user_id: int) -> list[sqlite3.Row]:
+    return get_conn().execute(SQL_USER_AGENTS, (user_id,)).fetchall()
+
+
+def list_active_agent_ids() -> list[int]:
+    return [r["id"] for r in get_conn().execute("SELECT id FROM agents WHERE paused = 0").fetchall()]
+
+
+def create_agent(user_id: int, title: str, time: str, frequency: str, prompt: str, notification: bool) -> int:
+    with transaction() as conn:
+        cur = conn.execute(
+            "INSERT INTO agents (user_id, title, time, frequency, prompt, notification) VALUES (?, ?, ?, ?, ?, ?)",
+            (user_id, title, time, frequency, prompt, 1 if notification else 0)
+        )
+    return cur.lastrowid
+
+
+def delete_agent(agent_id: int, user_id: int) -> None:
+    with transaction() as conn:
+        conn.execute("DELETE FROM agents WHERE id = ? AND user_id = ?", (agent_id, user_id))
+
+
+def set_agent_paused(agent_id: int, user_id: int, paused: bool) -> None:
+    with transaction() as conn:
+        conn.execute("UPDATE agents SET paused = ? WHERE id = ? AND user_id = ?", (1 if paused else 0, agent_id, user_id))
+
+
+# ---------- push subscriptions ----------
+def add_push_subscription(user_id: int, subscription_json: str) -> int:
+    with transaction() as conn:
+        cur = conn.execute(
+            "INSERT INTO push_subscriptions (user_id, subscription_json) VALUES (?, ?)",
+            (user_id, subscription_json)
+        )
+    return cur.lastrowid
+
+
+def list_push_subscriptions(user_id: int) -> list[sqlite3.Row]:
+    return get_conn().execute(SQL_PUSH_SUBSCRIPTIONS, (user_id,)).fetchall()
+
+
+def delete_push_subscription(sub_id: int) -> None:
+    with transaction() as conn:
+        conn.execute("DELETE FROM push_subscriptions WHERE id = ?", (sub_id,))
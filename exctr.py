@@ -1,72 +1,95 @@
+import ast
+import asyncio
+import hashlib
 import re
-import subprocess
-import tempfile
-import sys
 import os
-import shlex
 import uuid
 from pathlib import Path
-from openai import OpenAI
 import requests
 import mimetypes
 from dotenv import load_dotenv
+from warm_pool import run_python
+from workspace import Workspace
+from storage import file_digest, uploader
+from package_resolver import package_resolver, parse_pip_command
+from cache import TTLCache
 
 load_dotenv()
 
-API_KEY = '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'
-if not API_KEY:
-    print("[ERROR] Please set your OPENAI_API_KEY environment variable before running.")
-    sys.exit(1)
+PYTHON_EXEC_TIMEOUT = int(os.getenv("PYTHON_EXEC_TIMEOUT", "120"))
 
-client = OpenAI(
-    base_url="https://openrouter.ai/api/v1",
-    api_key=API_KEY,
+EXEC_CACHE_ENABLED = os.getenv("EXEC_CACHE", "1") == "1"
+EXEC_CACHE_TTL = int(os.getenv("EXEC_CACHE_TTL", str(24 * 3600)))
+# Code that reads the clock, randomness or the network gives a different answer each run
+NONDETERMINISTIC_MODULES = {
+    "time", "datetime", "random", "uuid", "secrets", "requests", "urllib", "httpx", "socket", "aiohttp", "http",
+}
+# Imported names and attributes that read the clock or an entropy source wherever they
+# come from: numpy.random, pd.Timestamp.now(), os.urandom, date.today(), ...
+NONDETERMINISTIC_NAMES = {"random", "now", "today", "utcnow", "urandom", "getrandom", "default_rng"}
+NOCACHE_RE = re.compile(r"#\s*nocache\b")
+
+# hash(model, prompt, input names+contents) -> raw code-generation reply
+exec_codegen_cache = TTLCache(
+    "exec_codegen", ttl=EXEC_CACHE_TTL, max_bytes=int(os.getenv("EXEC_CODEGEN_CACHE_MAX_BYTES", str(8 * 1024 * 1024))),
+)
+# hash(code, input names+contents, overlays) -> {"output": ..., "urls": [...]}
+exec_result_cache = TTLCache(
+    "exec_results", ttl=EXEC_CACHE_TTL, max_bytes=int(os.getenv("EXEC_RESULT_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
 )
 
 # MODEL_NAME = "qwen/qwen-2.5-coder-32b-instruct:free"
 MODEL_NAME = "qwen/qwen-2.5-72b-instruct:free"
 
-OUTPUT_DIR = Path("./outputs")
-OUTPUT_DIR.mkdir(exist_ok=True)
-
-INPUT_DIR = Path("./input")
-INPUT_DIR.mkdir(exist_ok=True)
-
-INPUT_BACKUP_DIR = Path("./input_backups")
-INPUT_BACKUP_DIR.mkdir(exist_ok=True)
-
-OUTPUT_BACKUP_DIR = Path("./output_backups")
-OUTPUT_BACKUP_DIR.mkdir(exist_ok=True)
-
-
-def upload_file_to_supabase(file_path, bucket_name="nexora-ai"):
-    file_path = Path(file_path)
-    if not file_path.is_file():
-        raise FileNotFoundError(f"File not found: {file_path}")
-    with file_path.open('rb') as f:
-        file_bytes = f.read()
-    extension = file_path.suffix
-    filename = f"{uuid.uuid4().hex}{extension}"
-    mime_type, _ = mimetypes.guess_type(file_path)
-    if mime_type is None:
-        mime_type = "application/octet-stream"  
-    SUPABASE_URL = os.getenv("SUPABASE_URL")
-    SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
-    upload_url = f"{SUPABASE_URL}/storage/v1/object/{bucket_name}/{filename}"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": mime_type
-    }
-    response = requests.post(upload_url, data=file_bytes, headers=headers)
-    if response.status_code not in [200, 201]:
-        raise Exception(f"Upload failed with status code {response.status_code}: {response.text}")
-    public_url = f"{SUPABASE_URL}/storage/v1/object/public/{bucket_name}/{filename}"
-    return public_url
+
+def _inputs_fingerprint(workspace: Workspace) -> str:
+    h = hashlib.sha256()
+    for f in sorted(workspace.input_dir.iterdir()):
+        if f.is_file():
+            h.update(f.name.encode("utf-8"))
+            h.update(file_digest(f).encode("ascii"))
+    return h.hexdigest()
 
 
+def is_time_dependent(code: str) -> bool:
+    """True when the result of `code` may differ between runs (or the code cannot be parsed)."""
+    if NOCACHE_RE.search(code):
+        return True
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return True
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            module = node.module or ""
+            names = [module] + [f"{module}.{alias.name}" for alias in node.names]
+        elif isinstance(node, ast.Attribute):
+            names = [node.attr]
+        else:
+            continue
+        for name in names:
+            parts = name.split(".")
+            if parts[0] in NONDETERMINISTIC_MODULES or NONDETERMINISTIC_NAMES.intersection(parts):
+                return True
+    return False
+
+
+def codegen_cache_key(user_message: dict, workspace: Workspace) -> str | None:
+    if not EXEC_CACHE_ENABLED:
+        return None
+    payload = "\0".join([MODEL_NAME, EXC_SYS["content"], user_message["content"], _inputs_fingerprint(workspace)])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def exec_cache_key(code: str, workspace: Workspace, extra_paths=None) -> str | None:
+    """Result cache key, or None when the result must not be cached."""
+    if not EXEC_CACHE_ENABLED or is_time_dependent(code):
+        return None
+    payload = "\0".join([code, _inputs_fingerprint(workspace), *sorted(extra_paths or [])])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
 
 def extract_pip_commands(text: str) -> list[str]:
     """
@@ -143,101 +166,87 @@ def is_python_code_safe(code: str) -> bool:
     return True
 
 
-
-PREINSTALLED_PACKAGES = {"aiohappyeyeballs", "aiohttp", "aiosignal", "aiosqlite", "altgraph", "annotated", "anyio", "arrow", "asgiref", "asttokens", "async", "attrs", "beautifulsoup4", "bidict", "binaryornot", "blinker", "boto3", "botocore", "bottle", "briefcase", "Brotli", "build", "buildozer", "CacheControl", "cachetools", "certifi", "cffi", "cfgv", "chardet", "charset", "click", "clr_loader", "colorama", "comtypes", "contourpy", "cookiecutter", "cryptography", "cssselect2", 
-"cycler", "Cython", "databases", "decorator", "deprecation", "diagrams", "diskcache", "distlib", "distro", "Django", "django", "dnspython", "docutils", "docx2pdf", "EasyProcess", "ecdsa", "edge", "email_validator", "entrypoint2", "erd", "erdiagram", "exceptiongroup", "executing", "faiss", "Faker", "fastapi", "fastapi", "filelock", "filetype", "fire", "firebase", "Flask", "flask", "Flask", "Flask", "fonttools", "fpdf", "frozenlist", "fsspec", "geographiclib", "geopy", "gitdb", "GitPython", "google", "google", "google", "google", "google", "google", "google", "google", "google", "googleapis", "googlesearch", "gotrue", 
-"gradio_client", "graphviz", "greenlet", "grpcio", "grpcio","PyMuPDF", "h11", "h2", "hpack","sqlite3", "secrets","httpcore", "httplib2", "httptools", "httpx", "huggingface", "hyperframe", "identify", "idna", "iniconfig", "ipython", "itsdangerous", "jedi", "Jinja2", "jiter", "jmespath", "joblib", "jsonpickle", "Kivy", "kivy", "kivy", "kivy_deps", "Kivy", "kivymd", "kiwisolver", "llama_cpp_python", "lxml", "Markdown", "markdown", "MarkupSafe", "matplotlib", "matplotlib", "mdurl", "MouseInfo", "mpmath", "msgpack", "mss", "multidict", "mysqlclient", "networkx", "nodeenv", "numpy", "openai", "opencv", "opencv", "orjson", "packaging", "panda", "pandas", "parso", "passlib", "pdf2docx", "pdfkit", "pefile", "pexpect", "pillow", "pip", "platformdirs", "pluggy", "plyer", "portalocker", "postgrest", "pre_commit", "prompt_toolkit", "propcache", "proto", "protobuf", "proxy_tools", "psutil", "psycopg2", "psycopg2", "ptyprocess", "pure_eval", "pyasn1", "pyasn1_modules", "PyAutoGUI", "pycparser", "pydantic", "pydantic_core", "pydantic", "pydantic", "pyddot", "pydub", "pydyf", "PyGetWindow", "Pygments", "pyinstaller", "pyinstaller", "pyjnius", "PyJWT", "pymongo", "PyMsgBox", "PyMuPDF", "PyOpenGL", "pypandoc", "pyparsing", "PyPDF2", "pyperclip", "pyphen", "pypiwin32", "pyproject_hooks", "PyQt5", "PyQt5", "PyQt5_sip", "pyqtdeploy", "PyRect", "pyscreenshot", "PyScreeze", "PySide6", "PySide6_Addons", "PySide6_Essentials", "PySimpleGUI", "pyswisseph", "pytest", "python", "python", "python", "python", "python", "python", "python", "python", "python", "python", "python", "pythonnet", "pytweening", "pytz", "pyvis", "pywebview", "pywin32", "pywin32", "PyYAML", "pyzbar", "qrcode","qrcode[pil]","razorpay", "realtime", "regex", "reportlab", "requests", "rich", "rich", "rsa", "s3transfer", "safetensors", "scikit", "scipy", "sendgrid", "setuptools", "sh", "shellingham", "shiboken6", "simple", "six", "smmap", "sniffio", "soupsieve", "SQLAlchemy", "sqlalchemy_schemadisplay", "sqlparse", "srt", "stack", "starkbank", "starlette", "storage3", "StrEnum", "supabase", "supafunc", "sympy", "tabulate", "telegram", "termcolor", "text", "threadpoolctl", "tinycss2", "tinyhtml5", "tk", "toga", "toga", "toga", "tokenizers", "toml", "tomli", "tomli_w", "torch", "tqdm", "traitlets", "transformers", "travertino", "typer", "types", "typing_extensions", "tzdata", "ujson", "uritemplate", "urllib3", "uvicorn", "virtualenv", "watchfiles", "wcwidth", "weasyprint", "webencodings", "websockets", "Werkzeug", "wheel", "wkhtmltopdf", "wsproto", "XlsxWriter", "yarl", "zopfli","openpyxl","python-pptx","python-docx"}
+def _echo(line: str) -> None:
+    print(line.rstrip())
 
 
-
-def run_subprocess(cmd_list: list[str]) -> tuple[int, str]:
-    output_lines = []
-    proc = subprocess.Popen(
-        cmd_list,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        text=True,
-        bufsize=1,
-    )
-    for line in iter(proc.stdout.readline, ''):
-        print(line.rstrip())
-        output_lines.append(line)
-    proc.wait()
-    return proc.returncode, ''.join(output_lines)
-
-def execute_pip_commands(pip_commands: list[str]) -> None:
-    """Executes each pip install command if it passes the safety filter and isn't preinstalled."""
+def execute_pip_commands(pip_commands: list[str], on_line=_echo) -> list[str]:
+    """
+    Resolves each safe pip install command against what is installed, installing
+    the rest into a cached overlay. Returns the overlay dirs the code needs on sys.path.
+    """
+    requirements = []
     for raw_cmd in pip_commands:
-        print(f"\n🛠️ Found pip command: {raw_cmd}")
-        parts = shlex.split(raw_cmd)
-        pkg_names = [pkg.lower().split("==")[0].split(">=")[0] for pkg in parts[2:]] if len(parts) > 2 else []
-        skip = False
-        for pkg in pkg_names:
-            if pkg in PREINSTALLED_PACKAGES:
-                print(f"[i] Skipping already-installed package: {pkg}")
-                skip = True
-        if skip:
-            continue
+        on_line(f"🛠️ Found pip command: {raw_cmd}\n")
         if not is_shell_command_safe(raw_cmd):
-            print(f"[!] Skipping unsafe pip command: {raw_cmd}")
+            on_line(f"[!] Skipping unsafe pip command: {raw_cmd}\n")
             continue
-        if parts[0].lower() not in ("pip", "pip3"):
-            print(f"[!] Not strictly a pip command? Skipping: {raw_cmd}")
+        parsed = parse_pip_command(raw_cmd)
+        if not parsed:
+            on_line(f"[!] Not strictly a pip command? Skipping: {raw_cmd}\n")
             continue
-        print(f"▶️ Executing: {raw_cmd}")
-        ret, _ = run_subprocess(parts)
-        if ret != 0:
-            print(f"[✖️] pip command failed with exit code {ret}: {raw_cmd}")
-        else:
-            print(f"[✔️] pip command succeeded: {raw_cmd}")
+        requirements.extend(parsed)
+    if not requirements:
+        return []
+    return package_resolver.resolve(requirements, on_line)
 
 
-
-def backup_directory_contents(src_dir: Path, backup_dir: Path) -> None:
-    for item in src_dir.iterdir():
-        if item.is_file():
-            random_prefix = uuid.uuid4().hex[:8]
-            dest_name = f"{random_prefix}_{item.name}"
-            dest_path = backup_dir / dest_name
-            try:
-                item.rename(dest_path)
-                print(f"Moved {item} to {dest_path}")
-            except Exception as e:
-                print(f"[!] Failed to backup {item}: {e}")
-
-def execute_python_code(code: str) -> tuple[str, list[str]]:
+def run_python_code(code: str, workspace: Workspace, on_line=_echo, extra_paths=None) -> tuple[str, bool]:
+    """Run `code` with the workspace's output dir as cwd; returns (combined output, succeeded)."""
     if not code.strip():
-        return "", []
+        return "", False
     if not is_python_code_safe(code):
         print("[!] Python code contains unsafe patterns. Skipping execution.")
-        return "[!] Python code contains unsafe patterns. Skipping execution.", []
-    with tempfile.NamedTemporaryFile(mode="w+", suffix=".py", delete=False) as tmp:
-        tmp.write(code)
-        tmp_path = tmp.name
-    original_cwd = os.getcwd()
-    try:
-        os.chdir(str(OUTPUT_DIR))
-        ret, output = run_subprocess([sys.executable, tmp_path])
-        if ret != 0:
-            print(f"[✖️] Python code exited with code {ret}")
-        else:
-            print(f"[✔️]")
-    finally:
-        os.chdir(original_cwd)
-        try:
-            os.unlink(tmp_path)
-        except Exception:
-            pass
-    output_files = list(OUTPUT_DIR.iterdir())
+        return "[!] Python code contains unsafe patterns. Skipping execution.", False
+    # The script lives next to (not inside) outputs/ so it is never uploaded
+    script_path = workspace.root / "main.py"
+    script_path.write_text(code, encoding="utf-8")
+    ret, output, timed_out = run_python(
+        str(script_path.resolve()), cwd=str(workspace.output_dir.resolve()), timeout=PYTHON_EXEC_TIMEOUT,
+        on_line=on_line, extra_paths=extra_paths,
+    )
+    if timed_out:
+        print(f"[✖️] Python code timed out after {PYTHON_EXEC_TIMEOUT}s")
+        output += f"\n[!] Execution timed out after {PYTHON_EXEC_TIMEOUT} seconds."
+    elif ret != 0:
+        print(f"[✖️] Python code exited with code {ret}")
+    else:
+        print(f"[✔️]")
+    return output, ret == 0 and not timed_out
+
+
+def upload_outputs(workspace: Workspace, on_upload=None) -> list[str]:
+    """Upload everything the job wrote; `on_upload(filename, url, error)` fires as each one finishes."""
     public_urls = []
-    for f in output_files:
-        if f.is_file():
-            try:
-                public_url = upload_file_to_supabase(f)
-                public_urls.append(public_url)
-            except Exception as e:
-                print(f"[!] Failed to upload {f} to Supabase: {e}")
-    return output, public_urls
+    for f, public_url, error in uploader.upload_files(workspace.output_files()):
+        if error is not None:
+            print(f"[!] Failed to upload {f} to Supabase: {error}")
+        else:
+            public_urls.append(public_url)
+        if on_upload:
+            on_upload(f.name, public_url, str(error) if error else None)
+    return public_urls
+
+
+async def stream_from_thread(func):
+    """
+    Run `func(emit)` in a worker thread and yield ("event", item) for every
+    emit(item) as it happens, then ("result", return value) once it finishes.
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def emit(item):
+        loop.call_soon_threadsafe(events.put_nowait, item)
+
+    future = loop.run_in_executor(None, func, emit)
+    future.add_done_callback(lambda _: events.put_nowait(None))
+    while True:
+        item = await events.get()
+        if item is None:
+            break
+        yield "event", item
+    yield "result", future.result()
 
 import mimetypes
 
@@ -254,12 +263,12 @@ def extract_upimg_links_and_text(message: str):
     return urls, remaining_text
 
 
-def safe_filename_from_url(url: str, content_type: str = None) -> str:
+def safe_filename_from_url(url: str, content_type: str = None, prefix: str = None) -> str:
     """
     Creates a safe filename from a URL.
     - Keeps original filename if available.
     - Adds guessed extension from Content-Type if missing.
-    - Ensures no collisions by prefixing with a short UUID.
+    - Ensures no collisions by prefixing with `prefix` (default: a short UUID).
     """
     # Extract filename from URL path
     name = url.split("/")[-1].split("?")[0]  # Remove query params
@@ -268,7 +277,7 @@ def safe_filename_from_url(url: str, content_type: str = None) -> str:
     # Guess extension if missing
     if not name or "." not in name:
         ext = mimetypes.guess_extension(content_type or "")
-        name = f"{uuid.uuid4().hex}{ext or ''}"
+        name = f"{'file' if prefix else uuid.uuid4().hex}{ext or ''}"
     else:
         # Just to be safe: if name has no extension, add one
         ext = mimetypes.guess_extension(content_type or "")
@@ -276,16 +285,18 @@ def safe_filename_from_url(url: str, content_type: str = None) -> str:
             name += ext
 
     # Prefix with short UUID to avoid collisions
-    name = f"{uuid.uuid4().hex[:8]}_{name}"
+    name = f"{prefix or uuid.uuid4().hex[:8]}_{name}"
     return name
 
 
 def download_files_to_input(urls: list[str], input_dir: Path):
     """
     Downloads each file from the provided URLs into the input_dir.
-    Uses MIME detection and safe filename handling.
+    Uses MIME detection and safe filename handling. Files are prefixed with a
+    hash of their content, so the same upload always gets the same name.
     """
     for url in urls:
+        partial = input_dir / f".partial-{uuid.uuid4().hex}"
         try:
             response = requests.get(url, stream=True, timeout=15)
             response.raise_for_status()
@@ -293,17 +304,21 @@ def download_files_to_input(urls: list[str], input_dir: Path):
             # Detect content type from headers
             content_type = response.headers.get("Content-Type", "").split(";")[0]
 
-            # Create a safe filename
-            filename = safe_filename_from_url(url, content_type)
-            file_path = input_dir / filename
-
-            with open(file_path, "wb") as f:
+            digest = hashlib.sha256()
+            with open(partial, "wb") as f:
                 for chunk in response.iter_content(chunk_size=8192):
+                    digest.update(chunk)
                     f.write(chunk)
 
+            # Create a safe filename
+            filename = safe_filename_from_url(url, content_type, prefix=digest.hexdigest()[:12])
+            file_path = input_dir / filename
+            partial.replace(file_path)
+
             print(f"[✔] Downloaded: {url} -> {file_path}")
 
         except Exception as e:
+            partial.unlink(missing_ok=True)
             print(f"[!] Failed to download {url}: {e}")
 
 
@@ -326,36 +341,38 @@ EXC_SYS = {
     )
 }
 
-def executer_v3(prompt : str):
-    backup_directory_contents(INPUT_DIR, INPUT_BACKUP_DIR)
+def prepare_codegen_message(prompt: str, workspace: Workspace) -> dict:
+    """Download any attached files into the workspace and build the code-generation user message."""
     img_urls, clean_prompt = extract_upimg_links_and_text(prompt)
     if img_urls:
-        download_files_to_input(img_urls, INPUT_DIR)
-    backup_directory_contents(OUTPUT_DIR, OUTPUT_BACKUP_DIR)
-    input_files = list(INPUT_DIR.iterdir())
+        download_files_to_input(img_urls, workspace.input_dir)
+    input_files = sorted(workspace.input_dir.iterdir())
     
     file_info_str = ""
     if input_files:
-        info_list = [f"{f.resolve()} ({f.suffix.lower().lstrip('.')})" for f in input_files]
+        # Relative to the script's cwd (outputs/), so the prompt and code do not depend on the workspace
+        info_list = [f"../input/{f.name} ({f.suffix.lower().lstrip('.')})" for f in input_files]
         file_info_str = " The following input files are provided: " + ", ".join(info_list) + "."
         
     user_message_content = clean_prompt + file_info_str + "\n\nPlease reply with any needed `pip install ...` commands inside ```bash``` fences and/or Python code inside ```python``` fences."
-    user_message = {"role": "user", "content": user_message_content}
-
-    try:
-        completion = client.chat.completions.create(
-            model=MODEL_NAME,
-            messages=[EXC_SYS, user_message],
-            temperature=0.0,
-            max_tokens=1024,
-        )
-    except Exception as e:
-        print(f"[ERROR] Failed to get completion from model: {e}")
-
-    reply = completion.choices[0].message.content
-    pip_cmds = extract_pip_commands(reply)
-    py_code = extract_python_code(reply)
-    
-    return pip_cmds,py_code
+    return {"role": "user", "content": user_message_content}
 
 
+async def stream_codegen(user_message: dict, client):
+    """
+    Stream the code-generation reply token by token. `client` is one of main's
+    AsyncOpenAI clients, so code generation shares their connection pool.
+    """
+    stream = await client.chat.completions.create(
+        model=MODEL_NAME,
+        messages=[EXC_SYS, user_message],
+        temperature=0.0,
+        max_tokens=1024,
+        stream=True,
+    )
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content or ""
+        if delta:
+            yield delta
@@ -0,0 +1,114 @@
+import asyncio
+import base64
+import hashlib
+import os
+import re
+
+import httpx
+
+from cache import TTLCache
+from config import IMAGE_URL_PASSTHROUGH
+
+UPIMG_PATTERN = r"<up-img>(.*?)</up-img>"
+
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR")
+if IMAGE_CACHE_DIR:
+    os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+_image_cache_db = os.path.join(IMAGE_CACHE_DIR, "image_cache.db") if IMAGE_CACHE_DIR else None
+
+# URL -> sha256 of the image bytes, then sha256 -> data URI. Keying the data by
+# content means the same image uploaded under two URLs is stored once.
+image_url_index = TTLCache(
+    "image_url_index",
+    ttl=int(os.getenv("IMAGE_CACHE_TTL", str(7 * 24 * 3600))),
+    max_bytes=4 * 1024 * 1024,
+    disk_path=_image_cache_db,
+)
+image_data_cache = TTLCache(
+    "image_data_uris",
+    ttl=int(os.getenv("IMAGE_CACHE_TTL", str(7 * 24 * 3600))),
+    max_bytes=int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(128 * 1024 * 1024))),
+    disk_path=_image_cache_db,
+)
+
+image_http_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(10.0),
+    limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+    follow_redirects=True,
+)
+
+_inflight = {}
+
+
+async def _download_data_uri(url: str) -> str | None:
+    try:
+        res = await image_http_client.get(url)
+        if res.status_code == 200:
+            content_type = res.headers.get("Content-Type", "image/jpeg")
+            digest = hashlib.sha256(res.content).hexdigest()
+            data_uri = image_data_cache.get(digest)
+            if data_uri is None:
+                encoded = base64.b64encode(res.content).decode("utf-8")
+                data_uri = f"data:{content_type};base64,{encoded}"
+                image_data_cache.set(digest, data_uri)
+            image_url_index.set(url, digest)
+            return data_uri
+        else:
+            print(f"Failed to fetch image: {url} — status {res.status_code}")
+    except Exception as e:
+        print(f"Error downloading image from {url}: {e}")
+    return None
+
+
+async def fetch_image_data_uri(url: str) -> str | None:
+    """Cached, de-duplicated download of an image as a base64 data URI."""
+    digest = image_url_index.get(url)
+    if digest:
+        data_uri = image_data_cache.get(digest)
+        if data_uri:
+            return data_uri
+    task = _inflight.get(url)
+    if task is None:
+        task = asyncio.ensure_future(_download_data_uri(url))
+        _inflight[url] = task
+        task.add_done_callback(lambda _: _inflight.pop(url, None))
+    # Shielded: a caller that disconnects must not cancel the download for the others
+    return await asyncio.shield(task)
+
+
+async def parse_message_with_images(message: str, inline: bool = not IMAGE_URL_PASSTHROUGH):
+    """
+    Split a stored message into OpenAI content parts. Images are fetched
+    concurrently and inlined as data URIs, or passed through as plain URLs when
+    `inline` is False (for models that fetch image URLs themselves).
+    """
+    parts = re.split(UPIMG_PATTERN, message)
+    urls = [part.strip() for i, part in enumerate(parts) if i % 2 == 1]
+    if inline:
+        resolved = await asyncio.gather(*(fetch_image_data_uri(url) for url in urls))
+    else:
+        resolved = urls
+    images = iter(resolved)
+
+    content = []
+    for i, part in enumerate(parts):
+        if i % 2 == 0:
+            if part.strip():
+                content.append({"type": "text", "text": part.strip()})
+        else:
+            image_url = next(images)
+            if image_url:
+                content.append({
+                "type": "image_url",
+                "image_url": {"url": image_url}
+                })
+    return content if content else [{"type": "text", "text": message.strip()}]
+
+
+async def resolve_user_images(messages: list[dict]) -> list[dict]:
+    """Replace every user message's text content with parsed parts, all turns in parallel."""
+    user_messages = [m for m in messages if m["role"] == "user" and isinstance(m["content"], str)]
+    parsed = await asyncio.gather(*(parse_message_with_images(m["content"]) for m in user_messages))
+    for message, content in zip(user_messages, parsed):
+        message["content"] = content
+    return messages
@@ -0,0 +1,227 @@
+import asyncio
+import hashlib
+import io
+import os
+import time
+from collections import deque
+
+from PIL import Image
+
+from cache import TTLCache
+from config import IMAGE_MODEL
+from storage import uploader
+
+IMAGE_PER_KEY_CONCURRENCY = int(os.getenv("IMAGE_PER_KEY_CONCURRENCY", "2"))
+IMAGE_RATE_LIMIT_COOLDOWN = int(os.getenv("IMAGE_RATE_LIMIT_COOLDOWN", "60"))
+IMAGE_MAX_ATTEMPTS = int(os.getenv("IMAGE_MAX_ATTEMPTS", "3"))
+IMAGE_QUEUE_SIZE = int(os.getenv("IMAGE_QUEUE_SIZE", "64"))
+
+# hash(model, prompt) -> public URL of the stored image
+image_results = TTLCache(
+    "image_results",
+    ttl=int(os.getenv("IMAGE_RESULT_CACHE_TTL", str(7 * 24 * 3600))),
+    max_bytes=4 * 1024 * 1024,
+)
+
+
+class ImageQueueFullError(Exception):
+    pass
+
+
+def image_to_bytes(result) -> tuple[bytes, str]:
+    """Normalize whatever text_to_image returned into (bytes, extension)."""
+    if isinstance(result, dict) and "image" in result:
+        result = result["image"]
+    if isinstance(result, Image.Image):
+        fmt = result.format or "PNG"
+        buf = io.BytesIO()
+        result.save(buf, format=fmt)
+        return buf.getvalue(), f".{fmt.lower()}"
+    if isinstance(result, (bytes, bytearray)):
+        # extension unknown — default to png
+        return bytes(result), ".png"
+    # last-resort: try to convert to bytes
+    return str(result).encode("utf-8"), ".png"
+
+
+def _rate_limit_delay(error):
+    """Cooldown in seconds if `error` is an HTTP 429 from the inference API, else None."""
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) != 429:
+        return None
+    try:
+        return max(int(response.headers.get("Retry-After", "")), 1)
+    except (TypeError, ValueError):
+        return IMAGE_RATE_LIMIT_COOLDOWN
+
+
+class _HFKey:
+    def __init__(self, client):
+        self.client = client
+        self.active = 0
+        self.cooldown_until = 0.0
+
+
+class HFClientPool:
+    """
+    InferenceClients for all configured keys. Each key serves at most
+    `per_key` requests at once, and a key that was rate limited sits out its
+    cooldown while the others carry the load.
+    """
+
+    def __init__(self, clients, per_key=IMAGE_PER_KEY_CONCURRENCY):
+        self.keys = [_HFKey(client) for client in clients]
+        self.per_key = per_key
+        self._cond = None
+
+    @property
+    def capacity(self):
+        return len(self.keys) * self.per_key
+
+    async def acquire(self) -> _HFKey:
+        if not self.keys:
+            raise RuntimeError("No Hugging Face API keys configured")
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        async with self._cond:
+            while True:
+                now = time.monotonic()
+                ready = [k for k in self.keys if k.cooldown_until <= now and k.active < self.per_key]
+                if ready:
+                    key = min(ready, key=lambda k: k.active)
+                    key.active += 1
+                    return key
+                cooling = [k.cooldown_until - now for k in self.keys if k.cooldown_until > now]
+                try:
+                    await asyncio.wait_for(self._cond.wait(), min(cooling) if cooling else None)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, key: _HFKey, cooldown=None):
+        async with self._cond:
+            key.active -= 1
+            if cooldown:
+                key.cooldown_until = time.monotonic() + cooldown
+            self._cond.notify_all()
+
+
+class _ImageTask:
+    def __init__(self, key, prompt, model):
+        self.key = key
+        self.prompt = prompt
+        self.model = model
+        self.listeners = set()
+
+    def notify(self, kind, data):
+        for listener in self.listeners:
+            listener.put_nowait((kind, data))
+
+
+class ImageService:
+    """
+    Queue in front of the Hugging Face pool. Requests for a prompt+model that
+    is already queued or generating share that task instead of starting a new
+    one, finished images are served from `image_results`, and every waiting
+    request is told its queue position whenever it changes.
+    """
+
+    def __init__(self, pool: HFClientPool, max_pending=IMAGE_QUEUE_SIZE):
+        self.pool = pool
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._inflight = {}
+        self._wakeup = None
+        self._workers = []
+
+    def _ensure_workers(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Condition()
+            self._workers = [asyncio.ensure_future(self._worker()) for _ in range(max(self.pool.capacity, 1))]
+
+    @staticmethod
+    def cache_key(prompt, model):
+        return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def _broadcast_positions(self):
+        for position, task in enumerate(self._pending, start=1):
+            task.notify("queue", position)
+
+    async def generate(self, prompt, model=IMAGE_MODEL, fresh=False):
+        """
+        Yields ("queue", position) while waiting, ("status", "generating") once
+        started, and finally ("result", url) or ("error", message).
+        """
+        key = self.cache_key(prompt, model)
+        if not fresh:
+            url = image_results.get(key)
+            if url:
+                yield "result", url
+                return
+
+        self._ensure_workers()
+        task = None if fresh else self._inflight.get(key)
+        if task is None:
+            if len(self._pending) >= self.max_pending:
+                raise ImageQueueFullError("Too many images are being generated, try again shortly.")
+            task = _ImageTask(key, prompt, model)
+            if not fresh:
+                self._inflight[key] = task
+            self._pending.append(task)
+            async with self._wakeup:
+                self._wakeup.notify()
+
+        listener = asyncio.Queue()
+        task.listeners.add(listener)
+        if task in self._pending:
+            listener.put_nowait(("queue", self._pending.index(task) + 1))
+        try:
+            while True:
+                kind, data = await listener.get()
+                yield kind, data
+                if kind in ("result", "error"):
+                    return
+        finally:
+            task.listeners.discard(listener)
+
+    async def _worker(self):
+        while True:
+            async with self._wakeup:
+                await self._wakeup.wait_for(lambda: bool(self._pending))
+                task = self._pending.popleft()
+            self._broadcast_positions()
+            task.notify("status", "generating")
+            try:
+                url = await self._run(task)
+                image_results.set(task.key, url)
+                task.notify("result", url)
+            except Exception as e:
+                print(f"Image generation failed: {e}")
+                task.notify("error", str(e))
+            finally:
+                if self._inflight.get(task.key) is task:
+                    del self._inflight[task.key]
+
+    async def _run(self, task):
+        for _ in range(IMAGE_MAX_ATTEMPTS):
+            key = await self.pool.acquire()
+            try:
+                result = await asyncio.to_thread(key.client.text_to_image, task.prompt, model=task.model)
+            except Exception as e:
+                cooldown = _rate_limit_delay(e)
+                await self.pool.release(key, cooldown)
+                if cooldown:
+                    print(f"Image key rate limited, cooling down for {cooldown}s")
+                    continue
+                raise
+            await self.pool.release(key)
+            image_bytes, ext = await asyncio.to_thread(image_to_bytes, result)
+            if not image_bytes:
+                raise RuntimeError("No image bytes obtained from the inference result")
+            return await asyncio.to_thread(uploader.upload_bytes, image_bytes, ext)
+        raise RuntimeError("All image generation keys are rate limited, try again later.")
+
+    async def close(self):
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+        self._wakeup = None
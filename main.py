@@ -1,38 +1,46 @@
-import base64
-import mimetypes
+import gzip
 import os
-from pathlib import Path
-import platform
 import re
-import sqlite3
 import json
-import subprocess
-import uuid
 from fastapi import Body, Depends, FastAPI, HTTPException, Request,Form
-from fastapi.responses import JSONResponse, RedirectResponse, StreamingResponse
+from fastapi.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import httpx
+import orjson
 from pydantic import BaseModel
-from scraper import get_content_from_links,SYSTEM_PROMPT, get_search_links, truncate_prompt_text
+from scraper import SYSTEM_PROMPT, build_sources_prompt, get_search_links, scrape_engine, shutdown_extract_pool
 from config import CHAT_MODEL, IMAGE_MODEL, REASONING_MODEL, LLM_MODEL
-import shutil
 import time
 import logging
 import tempfile
-from exctr import executer_v3,execute_pip_commands,execute_python_code
-from openai import OpenAI, _client
+import cache
+import db
+from context_builder import ContextBuilder
+from memory_index import memory_store
+from warm_pool import WARM_POOL_ENABLED, warm_pool
+from workspace import workspace_manager
+from package_resolver import package_resolver
+from image_service import HFClientPool, ImageQueueFullError, ImageService
+from storage import LocalBackend, iter_file_range, parse_byte_range, serving_headers, uploader
+from pdf_export import export_pdf_bytes, export_pdf_file, shutdown_export_pool
+from chat_export import CHUNK_WRITERS, EXPORT_FORMATS, iter_chat_export, iter_user_archive
+from code_runner import SUPPORTED_LANGUAGES, QueueFullError, execution_engine
+from image_inputs import image_http_client, parse_message_with_images, resolve_user_images
+from exctr import (
+    codegen_cache_key, exec_cache_key, exec_codegen_cache, exec_result_cache, execute_pip_commands,
+    extract_pip_commands, extract_python_code, prepare_codegen_message, run_python_code, stream_codegen,
+    stream_from_thread, upload_outputs,
+)
+from openai import AsyncOpenAI
 from passlib.context import CryptContext
 from typing import Optional
+from starlette.background import BackgroundTask
 from starlette.middleware.sessions import SessionMiddleware
-import os
 import asyncio
 from dotenv import load_dotenv
 import io
-import requests
 from huggingface_hub import InferenceClient
-from PIL import Image
-import logging
 import pytz
 from datetime import timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -49,161 +57,58 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-DB_PATH = "chat_history.db"
-conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-conn.row_factory = sqlite3.Row
-cursor = conn.cursor()
+db.init_db()
 
 class CodeSnippet(BaseModel):
     filename: str
     code: str
     
 api_keys = [os.getenv(f"key{i}") for i in range(1, 5) if os.getenv(f"key{i}")]
-clients = [OpenAI( base_url="https://openrouter.ai/api/v1",api_key=key ) for key in api_keys]
-client_index = 0
-def get_next_client():
-    global client_index
-    client = clients[client_index]
-    client_index = (client_index + 1) % len(clients)
-    return client
-
 
-hf_keys = [os.getenv(f"hf_key{i}") for i in range(1, 5) if os.getenv(f"hf_key{i}")]
-HF_clients = [ InferenceClient(provider="hf-inference", api_key=key) for key in hf_keys ]
-hf_client_index = 0
-
-def get_next_hf_client():
-    global hf_client_index
-    client = HF_clients[hf_client_index]
-    hf_client_index = (hf_client_index + 1) % len(HF_clients)
+# All LLM calls go through AsyncOpenAI clients that share pooled httpx clients, so
+# an open SSE stream costs a socket on the event loop, not a threadpool thread.
+# The limits are split over LLM_POOL_SHARDS pools: httpcore rescans every pooled
+# connection (quadratically) each time a request starts or ends, which made one
+# 200-connection pool the bottleneck (benchmarks/bench_llm_streaming.py).
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "500"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "100"))
+LLM_POOL_SHARDS = max(int(os.getenv("LLM_POOL_SHARDS", "16")), 1)
+llm_http_clients = [
+    httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=-(-LLM_MAX_CONNECTIONS // LLM_POOL_SHARDS),
+            max_keepalive_connections=-(-LLM_MAX_KEEPALIVE // LLM_POOL_SHARDS),
+        ),
+        timeout=httpx.Timeout(120.0, connect=10.0),
+    )
+    for _ in range(LLM_POOL_SHARDS)
+]
+# Round-robin walks the keys within a shard, then moves to the next shard
+async_clients = [
+    AsyncOpenAI(base_url="https://openrouter.ai/api/v1", api_key=key, http_client=http_client)
+    for http_client in llm_http_clients
+    for key in api_keys
+]
+async_client_index = 0
+def get_next_async_client():
+    global async_client_index
+    client = async_clients[async_client_index]
+    async_client_index = (async_client_index + 1) % len(async_clients)
     return client
 
-cursor.execute("PRAGMA foreign_keys = ON;")
-
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    username TEXT,
-    email TEXT NOT NULL UNIQUE,
-    password_hash TEXT NOT NULL,
-    date_of_birth DATE,
-    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-)
-""")
-conn.commit()
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS push_subscriptions (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  user_id INTEGER NOT NULL,
-  subscription_json TEXT NOT NULL,
-  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-)
-""")
-conn.commit()
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS chats (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER NOT NULL,
-    title TEXT NOT NULL,
-    is_private INTEGER NOT NULL DEFAULT 0,
-    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users (id)
-)
-""")
 
+context_builder = ContextBuilder(get_next_async_client)
 
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS images (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER NOT NULL,
-    image_url TEXT NOT NULL,
-    prompt TEXT NOT NULL,
-    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users (id)
-)
-""")
-conn.commit()
-
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS history (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    chat_id INTEGER NOT NULL,
-    user_text TEXT NOT NULL,
-    bot_text TEXT NOT NULL,
-    ts DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (chat_id) REFERENCES chats (id)
-)
-""")
 
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS memory (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    memory TEXT NOT NULL,
-    ts DATETIME DEFAULT CURRENT_TIMESTAMP
-)
-""")
-
-conn.commit()
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS code_files (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER NOT NULL,
-    filename TEXT NOT NULL,
-    code TEXT NOT NULL,
-    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users (id)
-)
-""")
-conn.commit()
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS images (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    image_url TEXT NOT NULL,
-    prompt TEXT NOT NULL,
-    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-)
-""")
-conn.commit()
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS agents (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER NOT NULL,
-    title TEXT NOT NULL,
-    time TEXT NOT NULL,
-    frequency TEXT NOT NULL,
-    prompt TEXT NOT NULL,
-    notification INTEGER NOT NULL DEFAULT 0,
-    paused INTEGER NOT NULL DEFAULT 0,
-    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users (id)
-)
-""")
-conn.commit()
-
-def get_user_by_email(email: str):
-    cursor.execute("SELECT * FROM users WHERE email = ?", (email.lower(),))
-    return cursor.fetchone()
+hf_keys = [os.getenv(f"hf_key{i}") for i in range(1, 5) if os.getenv(f"hf_key{i}")]
+HF_clients = [ InferenceClient(provider="hf-inference", api_key=key) for key in hf_keys ]
+image_service = ImageService(HFClientPool(HF_clients))
 
-def get_user_by_id(user_id: int):
-    cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    return cursor.fetchone()
+pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
 def create_user(username: str, email: str, password: str, dob: str | None):
     password_hash = pwd_context.hash(password)
-    cursor.execute(
-        "INSERT INTO users (username, email, password_hash, date_of_birth) VALUES (?, ?, ?, ?)",
-        (username, email.lower(), password_hash, dob)
-    )
-    conn.commit()
-    return cursor.lastrowid
+    return db.create_user(username, email, password_hash, dob)
 
 def verify_password(plain: str, hashed: str) -> bool:
     try:
@@ -216,7 +121,7 @@ def get_current_user(request: Request):
     user_id = request.session.get("user_id")
     if not user_id:
         return None
-    return get_user_by_id(user_id)
+    return db.get_user_by_id(user_id)
 
 EMAIL_RE = re.compile(r"^[^@]+@[^@]+\.[^@]+$")
 
@@ -227,45 +132,13 @@ def get_current_user_id(request: Request) -> Optional[int]:
     if not user_id:
         return None
 
-    cur = conn.cursor()
-    cur.execute("SELECT id FROM users WHERE id = ?", (user_id,))
-    row = cur.fetchone()
-
-    if row:
-        return row["id"] if isinstance(row, sqlite3.Row) else row[0]
+    if db.user_exists(user_id):
+        return user_id
 
     # invalid session (user deleted) -> clean up session and return None
     request.session.pop("user_id", None)
     return None
 
-# --- MODIFIED: add_history ---
-def add_history(chat_id: int, user: str, bot: str):
-    cursor.execute(
-        "INSERT INTO history (chat_id, user_text, bot_text) VALUES (?, ?, ?)",
-        (chat_id, user, bot)
-    )
-    conn.commit()
-    
-
-# --- MODIFIED: get_last_history ---
-def get_last_history(chat_id: int, n: int = 15):
-    cursor.execute(
-        "SELECT user_text, bot_text FROM history WHERE chat_id = ? ORDER BY id DESC LIMIT ?",
-        (chat_id, n)
-    )
-    rows = cursor.fetchall()
-    return list(reversed(rows))  # chronological order
-
-def add_memory(memory_text: str):
-    cursor.execute("INSERT INTO memory (memory) VALUES (?)", (memory_text,))
-    conn.commit()
-
-
-def get_all_memories(): 
-    cursor.execute("SELECT memory FROM memory ORDER BY id ASC")
-    rows = cursor.fetchall()
-    memories = [row["memory"] for row in rows if row["memory"] is not None]
-    return ", ".join(memories)
 
 
 
@@ -306,10 +179,60 @@ SESSION_SECRET = os.getenv("SESSION_SECRET", "dev_secret_key_change_me")
 app.add_middleware(SessionMiddleware, secret_key=SESSION_SECRET)
 
 
+FTS_BACKFILL_PAUSE = 0.05
+fts_backfill_task = None
+
+
+async def backfill_search_index():
+    """Index history rows written before the FTS index existed, one short batch at a time."""
+    try:
+        while await asyncio.to_thread(db.backfill_history_fts):
+            await asyncio.sleep(FTS_BACKFILL_PAUSE)
+        logger.info("History search index is up to date")
+    except Exception as e:
+        logger.error(f"History search backfill stopped: {str(e)}")
+
+
+@app.on_event("startup")
+async def start_warm_pool():
+    global fts_backfill_task
+    if WARM_POOL_ENABLED:
+        warm_pool.start()
+    workspace_manager.start()
+    await asyncio.to_thread(package_resolver.refresh)
+    fts_backfill_task = asyncio.create_task(backfill_search_index())
+
+
+@app.on_event("shutdown")
+async def close_shared_clients():
+    if fts_backfill_task is not None:
+        fts_backfill_task.cancel()
+    for http_client in llm_http_clients:
+        await http_client.aclose()
+    await image_http_client.aclose()
+    await scrape_engine.close()
+    await execution_engine.close()
+    await image_service.close()
+    warm_pool.shutdown()
+    workspace_manager.stop()
+    uploader.close()
+    shutdown_extract_pool()
+    shutdown_export_pool()
+    db.close_all()
+
+
 @app.api_route("/health", methods=["GET", "HEAD"])
 async def health_check():
     return {"status": "ok"}
 
+@app.get("/metrics/cache")
+async def cache_metrics():
+    return cache.all_stats()
+
+@app.get("/metrics/db")
+async def db_metrics():
+    return {"write_behind": db.write_queue.stats()}
+
 @app.get("/")
 async def home(request: Request):
     user = get_current_user(request)
@@ -341,7 +264,7 @@ async def register_post(
         return templates.TemplateResponse("register.html", {"request": request, "error": "Invalid email.", "form": {"username": username, "email": email, "date_of_birth": date_of_birth}})
     if len(password) < 6:
         return templates.TemplateResponse("register.html", {"request": request, "error": "Password must be at least 6 characters.", "form": {"username": username, "email": email, "date_of_birth": date_of_birth}})
-    if get_user_by_email(email_norm):
+    if db.get_user_by_email(email_norm):
         return templates.TemplateResponse("register.html", {"request": request, "error": "Email already registered.", "form": {"username": username, "email": email, "date_of_birth": date_of_birth}})
     try:
         user_id = create_user(username.strip(), email_norm, password, date_of_birth)
@@ -362,7 +285,7 @@ async def login_get(request: Request):
 
 @app.post("/login")
 async def login_post(request: Request, email: str = Form(...), password: str = Form(...)):
-    user = get_user_by_email(email.strip().lower())
+    user = db.get_user_by_email(email.strip().lower())
     if not user:
         return templates.TemplateResponse("login.html", {"request": request, "error": "Invalid credentials."})
     if not verify_password(password, user["password_hash"]):
@@ -382,6 +305,7 @@ async def logout(request: Request):
 class ChatRequest(BaseModel):
     message: str
     chat_id: int | None = None 
+    fresh: bool = False  # /exec-chat: bypass the code-generation and result caches
 
 
 @app.post("/save_code")
@@ -396,34 +320,59 @@ async def save_code(data: dict = Body(...)):
 
 
 
-def strip_first_think_block(text: str) -> str:
+from datetime import datetime, timezone
 
-    cleaned_text = re.sub(r"<think>[\s\S]*?</think>", "", text, count=1)
-    return re.sub(r"###CODE_EXEC[\s\S]*?###CODE_EXEC", "", cleaned_text)
+HISTORY_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+GZIP_MIN_BYTES = 1024
+NEXT_CURSOR_HEADER = "X-Next-Before-Id"
+
+
+def fast_json(request: Request, content, headers: Optional[dict] = None) -> Response:
+    """orjson-encoded response, gzipped when the client accepts it and the body is worth it."""
+    body = orjson.dumps(content)
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+    if len(body) >= GZIP_MIN_BYTES and "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def page_limit(limit: Optional[int], before_id: Optional[int]) -> Optional[int]:
+    """None keeps the old unpaginated response; otherwise clamp to 1..MAX_PAGE_SIZE."""
+    if limit is None and before_id is None:
+        return None
+    return min(max(limit or HISTORY_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+
+
+def paginate(rows, limit: int):
+    """Rows were fetched with LIMIT limit + 1; returns (page, next before_id or None)."""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1]["id"]
+    return rows, None
+
+
+def chat_json(r) -> dict:
+    # created_at comes back from sqlite as "YYYY-MM-DD HH:MM:SS" text
+    return {"id": r["id"], "title": r["title"], "created_at": str(r["created_at"])}
 
-from datetime import datetime, timezone
 
 @app.get("/chats")
-async def get_user_chats(request: Request):
+async def get_user_chats(request: Request, before_id: Optional[int] = None, limit: Optional[int] = None):
+    """
+    All of the user's chats, newest first. With `limit` and/or `before_id` it
+    returns one page ordered by id and the cursor for the next page in the
+    X-Next-Before-Id header (absent on the last page).
+    """
     user_id = get_current_user_id(request)
-    cursor.execute(
-        "SELECT id, title, created_at FROM chats WHERE user_id = ? AND is_private = 0 ORDER BY created_at DESC",
-        (user_id,)
-    )
-    rows = cursor.fetchall()
-    chats = []
-    for r in rows:
-        created = r["created_at"]
-        # Normalize to an ISO string so JS can parse it reliably
-        if isinstance(created, datetime):
-            if created.tzinfo is None:
-                created = created.replace(tzinfo=timezone.utc).isoformat()
-            else:
-                created = created.isoformat()
-        else:
-            created = str(created)  
-        chats.append({"id": r["id"], "title": r["title"], "created_at": created})
-    return chats
+    limit = page_limit(limit, before_id)
+    if limit is None:
+        return fast_json(request, [chat_json(r) for r in db.list_user_chats(user_id)])
+    rows, next_before_id = paginate(db.list_user_chats_page(user_id, before_id, limit + 1), limit)
+    headers = {NEXT_CURSOR_HEADER: str(next_before_id)} if next_before_id else None
+    return fast_json(request, [chat_json(r) for r in rows], headers)
 
 
 from nameSuggester import suggest_chat_name
@@ -443,170 +392,132 @@ async def create_chat(request: ChatCreateRequest, user_id: int = Depends(get_cur
     title = suggest_chat_name(title)
 
     # Insert into DB including is_private
-    cursor.execute(
-        "INSERT INTO chats (user_id, title, is_private) VALUES (?, ?, ?)",
-        (user_id, title, request.is_private)
-    )
-    conn.commit()
-    new_chat_id = cursor.lastrowid
+    new_chat_id = await db.create_chat_async(user_id, title, request.is_private)
     return {"id": new_chat_id, "title": title, "is_private": request.is_private}
 
 @app.get("/chats/{chat_id}/history")
-async def get_chat_history(chat_id: int):
-    cursor.execute(
-        "SELECT id, user_text, bot_text, ts FROM history WHERE chat_id = ? ORDER BY id ASC",
-        (chat_id,)
-    )
-    return [
+async def get_chat_history(chat_id: int, request: Request, before_id: Optional[int] = None, limit: Optional[int] = None):
+    """
+    The chat's turns, oldest first. With `limit` and/or `before_id` only the
+    newest `limit` turns below `before_id` are returned (still oldest first);
+    X-Next-Before-Id carries the cursor for the turns before them.
+    """
+    limit = page_limit(limit, before_id)
+    if limit is None:
+        rows, next_before_id = db.get_chat_history(chat_id), None
+    else:
+        rows, next_before_id = paginate(db.get_history_page(chat_id, before_id, limit + 1), limit)
+        rows = rows[::-1]
+    headers = {NEXT_CURSOR_HEADER: str(next_before_id)} if next_before_id else None
+    return fast_json(request, [
         {"id": r["id"], "user": r["user_text"], "bot": r["bot_text"], "ts": r["ts"]}
-        for r in cursor.fetchall()
-    ]
-
-def download_and_convert_image(url: str) -> str | None:
-    try:
-        with httpx.Client(timeout=10.0) as client:
-            res = client.get(url)
-            if res.status_code == 200:
-                content_type = res.headers.get("Content-Type", "image/jpeg")
-                encoded = base64.b64encode(res.content).decode("utf-8")
-                return f"data:{content_type};base64,{encoded}"
-            else:
-                print(f"Failed to fetch image: {url} — status {res.status_code}")
-    except Exception as e:
-        print(f"Error downloading image from {url}: {e}")
-    return None
-
-
-def parse_message_with_images(message: str):
-    pattern = r"<up-img>(.*?)</up-img>"
-    parts = re.split(pattern, message)
-    content = []
-
-    for i, part in enumerate(parts):
-        if i % 2 == 0:
-            if part.strip():
-                content.append({"type": "text", "text": part.strip()})
-        else:
-            data_uri = download_and_convert_image(part.strip())
-            if data_uri:
-                content.append({
-                "type": "image_url",
-                "image_url": {"url": data_uri}
-                })
-    return content if content else [{"type": "text", "text": message.strip()}]
+        for r in rows
+    ], headers)
 
+def _owned_chat(chat_id: int, user_id: Optional[int]):
+    chat = db.get_chat(chat_id)
+    if chat is None or user_id is None or chat["user_id"] != user_id:
+        raise HTTPException(status_code=404, detail="Chat not found")
+    return chat
 
 
+def _write_chunks(fd: int, chunks) -> None:
+    with os.fdopen(fd, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
 
-hf_client = get_next_hf_client()
 
-def upload_bytes_to_supabase(file_bytes: bytes, extension: str = ".png", bucket_name="nexora-ai"):
-    """Upload raw bytes to Supabase storage and return the public URL."""
-    filename = f"{uuid.uuid4().hex}{extension}"
-    mime_type, _ = mimetypes.guess_type(filename)
-    if mime_type is None:
-        mime_type = "application/octet-stream"
+def _remove_files(*paths) -> None:
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
 
-    SUPABASE_URL = os.getenv("SUPABASE_URL")
-    SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
 
-    upload_url = f"{SUPABASE_URL.rstrip('/')}/storage/v1/object/{bucket_name}/{filename}"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": mime_type,
-    }
-
-    resp = requests.post(upload_url, data=file_bytes, headers=headers, timeout=60)
-    if resp.status_code not in (200, 201):
-        raise Exception(f"Upload failed with status code {resp.status_code}: {resp.text}")
+@app.get("/chats/export")
+async def export_all_chats(format: str = "md", user_id: Optional[int] = Depends(get_current_user_id)):
+    """Every chat of the user as a zip with one md/ndjson file per chat, streamed as it is built."""
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Not logged in")
+    if format not in CHUNK_WRITERS:
+        raise HTTPException(status_code=400, detail=f"Unsupported archive format: {format}")
+    return StreamingResponse(
+        iter_user_archive(user_id, format),
+        media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=nexora_chats.zip"}
+    )
 
-    public_url = f"{SUPABASE_URL.rstrip('/')}/storage/v1/object/public/{bucket_name}/{filename}"
-    return public_url
 
-def generate_and_upload_sync(prompt: str, user_id: int, model: str = IMAGE_MODEL) -> str:
-    print("generate_and_upload_sync: called, user_id type:", type(user_id), "value:", user_id)
+@app.get("/chats/{chat_id}/export")
+async def export_chat(chat_id: int, format: str = "md", user_id: Optional[int] = Depends(get_current_user_id)):
+    """One chat as md, ndjson or pdf, read from the history table in batches."""
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported export format: {format}")
+    chat = _owned_chat(chat_id, user_id)
+    media_type, ext = EXPORT_FORMATS[format]
+    filename = f"chat_{chat_id}{ext}"
+
+    if format != "pdf":
+        return StreamingResponse(
+            iter_chat_export(chat, format),
+            media_type=media_type,
+            headers={"Content-Disposition": f"attachment; filename={filename}"}
+        )
 
-    # 1) Generate image using huggingface InferenceClient
+    # The markdown is spooled to disk so this process never holds the whole chat
+    fd, md_path = tempfile.mkstemp(suffix=".md")
+    pdf_path = os.path.splitext(md_path)[0] + ".pdf"
     try:
-        result = hf_client.text_to_image(prompt, model=model)
+        await asyncio.to_thread(_write_chunks, fd, iter_chat_export(chat, "md"))
+        await export_pdf_file(md_path)
     except Exception as e:
-        print("generate_and_upload_sync: HF client call failed.", e)
-        return ""
+        _remove_files(md_path, pdf_path)
+        logger.error(f"Chat {chat_id} PDF export failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to generate PDF: {str(e)}")
+    return FileResponse(
+        pdf_path,
+        media_type=media_type,
+        filename=filename,
+        background=BackgroundTask(_remove_files, md_path, pdf_path)
+    )
 
-    # 2) Normalize output to bytes and determine extension
-    image_bytes = None
-    ext = ".png"
-    try:
-        # If the client returns a PIL.Image object:
-        if isinstance(result, Image.Image):
-            pil_img = result
-            fmt = pil_img.format or "PNG"
-            ext = f".{fmt.lower()}"
-            buf = io.BytesIO()
-            pil_img.save(buf, format=fmt)
-            image_bytes = buf.getvalue()
-        # If the client returned bytes (some clients might)
-        elif isinstance(result, (bytes, bytearray)):
-            image_bytes = bytes(result)
-            # extension unknown — default to png
-            ext = ".png"
-        # If the client returned a dict or other structure that contains bytes
-        elif isinstance(result, dict) and "image" in result:
-            # try to handle result["image"] if it's bytes or PIL
-            candidate = result["image"]
-            if isinstance(candidate, Image.Image):
-                pil_img = candidate
-                fmt = pil_img.format or "PNG"
-                ext = f".{fmt.lower()}"
-                buf = io.BytesIO()
-                pil_img.save(buf, format=fmt)
-                image_bytes = buf.getvalue()
-            elif isinstance(candidate, (bytes, bytearray)):
-                image_bytes = bytes(candidate)
-            else:
-                # fallback: try str -> bytes
-                image_bytes = str(candidate).encode("utf-8")
-        else:
-            # last-resort: try to convert to bytes
-            image_bytes = str(result).encode("utf-8")
-    except Exception as e:
-        print("generate_and_upload_sync: converting HF result to bytes failed.", e)
-        return ""
 
-    if not image_bytes:
-        print("generate_and_upload_sync: no image bytes obtained from HF result.")
-        return ""
+@app.get("/search/history")
+async def search_history(request: Request, q: str, limit: int = 20, user_id: Optional[int] = Depends(get_current_user_id)):
+    """Ranked matches across the user's chats; `snippet` marks hits with <mark> in otherwise raw text."""
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Not logged in")
+    limit = min(max(limit, 1), MAX_PAGE_SIZE)
+    return fast_json(request, db.search_history(user_id, q, limit))
 
-    # 3) Upload to Supabase
-    try:
-        supabase_public_url = upload_bytes_to_supabase(image_bytes, extension=ext, bucket_name="nexora-ai")
-    except Exception as e:
-        print("generate_and_upload_sync: Supabase upload failed.", e)
-        return ""
 
-    # 4) Insert into DB
-    try:
-        cur = conn.cursor()
-        if not isinstance(user_id, (int, str)):
-            raise TypeError("user_id must be int or str, got: %r" % type(user_id))
-        cur.execute(
-            "INSERT INTO images (user_id, image_url, prompt) VALUES (?, ?, ?)",
-            (int(user_id), supabase_public_url, prompt)
-        )
-        conn.commit()
-        cur.close()
-    except Exception as e:
+@app.get("/files/{bucket}/{name}")
+async def serve_stored_file(bucket: str, name: str, request: Request):
+    """Objects written by the local storage backend; supports single-range requests."""
+    backend = uploader.backend
+    path = backend.path_for(bucket, name) if isinstance(backend, LocalBackend) else None
+    if path is None or not path.is_file():
+        raise HTTPException(status_code=404, detail="File not found")
+
+    size = path.stat().st_size
+    headers = serving_headers(name, request.query_params.get("download"))
+    media_type = headers.pop("Content-Type")
+    # Names are content hashes, so a URL's content never changes
+    headers.update({"Accept-Ranges": "bytes", "Cache-Control": "public, max-age=31536000, immutable"})
+    range_header = request.headers.get("range")
+    if range_header:
         try:
-            conn.rollback()
-        except Exception:
-            pass
-        print("generate_and_upload_sync: DB insert/commit failed.", e)
-        return ""
+            byte_range = parse_byte_range(range_header, size)
+        except ValueError:
+            raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+        if byte_range:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(iter_file_range(path, start, end), status_code=206, media_type=media_type, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
 
-    return supabase_public_url
 
 @app.post("/generate-image")
 async def generate_image_stream(req: ChatRequest, user_id: int = Depends(get_current_user_id)):
@@ -617,8 +528,8 @@ async def generate_image_stream(req: ChatRequest, user_id: int = Depends(get_cur
     if not chat_id:
         raise HTTPException(status_code=400, detail="chat_id is required")
 
-    def sse_event(name: str, payload: str) -> str:
-        logger.debug("sse_event: name=%s payload_length=%d", name, len(payload) if payload is not None else 0)
+    def sse_event(name: str, payload) -> str:
+        logger.debug("sse_event: name=%s payload_length=%d", name, len(str(payload)) if payload is not None else 0)
         try:
             return f"event: {name}\ndata: {json.dumps(payload)}\n\n"
         except Exception:
@@ -626,15 +537,31 @@ async def generate_image_stream(req: ChatRequest, user_id: int = Depends(get_cur
 
     async def event_generator():
         yield sse_event("user", prompt)
+        public_url = ""
         try:
-            public_url = await asyncio.to_thread(generate_and_upload_sync, prompt,user_id)
-            
-                
+            # "queue" events carry this request's position while it waits for a free key
+            async for kind, data in image_service.generate(prompt, fresh=req.fresh):
+                if kind == "result":
+                    public_url = data
+                elif kind == "error":
+                    yield sse_event("error", data)
+                    return
+                else:
+                    yield sse_event(kind, data)
+        except ImageQueueFullError as e:
+            yield sse_event("error", str(e))
+            return
         except Exception as e:
-            print(e)
+            logger.exception("generate-image: generation failed")
             yield sse_event("error", f"Image generation/upload failed: {str(e)}")
             return
 
+        if public_url:
+            try:
+                await db.add_image_async(int(user_id), public_url, prompt)
+            except Exception:
+                logger.exception("generate-image: DB insert failed")
+
         try:
             if public_url != "":
                 paren_bracket_variant = f"[{prompt}]({public_url})"
@@ -642,7 +569,7 @@ async def generate_image_stream(req: ChatRequest, user_id: int = Depends(get_cur
                 user_text_with_link = f"{prompt}"
                 bot_text = paren_bracket_variant
                 try:
-                    add_history(chat_id, user_text_with_link, bot_text)
+                    await db.add_history_async(chat_id, user_text_with_link, bot_text)
                 except Exception:
                     print("error")
             else:
@@ -659,99 +586,164 @@ async def generate_image_stream(req: ChatRequest, user_id: int = Depends(get_cur
 @app.get("/images")
 def list_images(limit: int = 50,user_id: int = Depends(get_current_user_id)):
     limit = min(limit, 100)
-    cur = conn.cursor()
-    
-    cur.execute(
-        """
-        SELECT id, image_url, prompt, created_at 
-        FROM images 
-        WHERE user_id = ? 
-        ORDER BY created_at DESC 
-        LIMIT ?
-        """,
-        (user_id, limit)
-    )
-    
-    rows = [dict(row) for row in cur.fetchall()]
+    rows = [dict(row) for row in db.list_images(user_id, limit)]
     
     return {"count": len(rows), "images": rows}
 
 
+class MemoryCreate(BaseModel):
+    memory: str
+
+@app.post("/memories")
+async def create_memory(req: MemoryCreate, user_id: int = Depends(get_current_user_id)):
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Not logged in")
+    if not req.memory or not req.memory.strip():
+        raise HTTPException(status_code=400, detail="Memory cannot be empty")
+    memory_id = memory_store.add(user_id, req.memory.strip())
+    return {"id": memory_id}
+
+
 @app.post("/chat")
-async def chat_stream(req: ChatRequest):
+async def chat_stream(req: ChatRequest, user_id: int = Depends(get_current_user_id)):
     user_msg = req.message
     chat_id = req.chat_id
-    client= get_next_client()
+    client= get_next_async_client()
     if not chat_id:
         raise HTTPException(status_code=400, detail="chat_id is required.")
 
-    def event_generator():
+    async def event_generator():
         yield f"event: user\ndata: {json.dumps(user_msg)}\n\n"
 
-        history = get_last_history(chat_id, 15)
-        memories = get_all_memories() # Per-chat memories
+        context = await context_builder.build(chat_id)
+        memories = memory_store.prompt_for(user_id, user_msg) # Top-k relevant to this message
         messages = [
             {"role": "system", "content": "your name is zodio"},
             {"role": "system", "content": memories},
         ]
-        for exchange in history:
-            messages.append({"role": "user", "content": parse_message_with_images(exchange["user_text"])})
-            cleaned = strip_first_think_block(exchange["bot_text"])
-            messages.append({"role": "assistant", "content": cleaned})
+        messages.extend(await resolve_user_images(context.messages()))
             
-        parsed_content = parse_message_with_images(user_msg)
+        parsed_content = await parse_message_with_images(user_msg)
         messages.append({"role": "user", "content": parsed_content})
 
         bot_buffer = ""
-        resp_stream = client.chat.completions.create(
+        resp_stream = await client.chat.completions.create(
             model=CHAT_MODEL,
             stream=True,
             messages=messages,
         )
 
-        for chunk in resp_stream:
+        async for chunk in resp_stream:
             delta = chunk.choices[0].delta.content or ""
             if delta:
                 bot_buffer += delta
                 yield f"event: bot\ndata: {json.dumps(delta)}\n\n"
 
-        add_history(chat_id, user_msg, bot_buffer)
+        await db.add_history_async(chat_id, user_msg, bot_buffer)
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 
 
 
+def sse(name: str, payload) -> str:
+    return f"event: {name}\ndata: {json.dumps(payload)}\n\n"
+
+
 @app.post("/exec-chat")
 async def chat_stream_exec(req: ChatRequest):  
+    """
+    Staged pipeline, each stage streamed as it runs: code generation tokens
+    ("codegen"), pip progress ("pip"), execution output ("exec"), uploads
+    ("upload"), then the summary as the usual "bot" events. "stage" events mark
+    the transitions. Blocking work runs in threads so the loop stays free.
+    """
     user_msg = req.message
     chat_id = req.chat_id
-    client= get_next_client()
-    pip_cmds,py_code=executer_v3(user_msg)
-    if pip_cmds:
-        print(pip_cmds)
-        execute_pip_commands(pip_cmds)
-    if py_code:
-        output, public_urls = execute_python_code(py_code)
-        print(output)
-        print(public_urls)
-    ops_gen="here is the output"+output
-    if public_urls:
-        urls_as_string = ", ".join(public_urls)
-        ops_gen="the link generated:"+urls_as_string
-        print(ops_gen)
-    
+    client= get_next_async_client()
     if not chat_id:
         raise HTTPException(status_code=400, detail="chat_id is required.")
 
-    def event_generator():
-        yield f"event: user\ndata: {json.dumps(user_msg)}\n\n"
+    async def event_generator():
+        yield sse("user", user_msg)
 
+        output, public_urls, py_code = "", [], ""
+        with workspace_manager.job() as workspace:
+            yield sse("stage", "codegen")
+            try:
+                codegen_message = await asyncio.to_thread(prepare_codegen_message, user_msg, workspace)
+                codegen_key = None if req.fresh else await asyncio.to_thread(codegen_cache_key, codegen_message, workspace)
+                reply = exec_codegen_cache.get(codegen_key) if codegen_key else None
+                if reply:
+                    yield sse("codegen", reply)
+                else:
+                    reply = ""
+                    async for delta in stream_codegen(codegen_message, client):
+                        reply += delta
+                        yield sse("codegen", delta)
+                    if codegen_key and reply:
+                        exec_codegen_cache.set(codegen_key, reply)
+            except Exception as e:
+                print(f"[ERROR] Failed to get completion from model: {e}")
+                yield sse("error", f"Code generation failed: {e}")
+                return
+            pip_cmds = extract_pip_commands(reply)
+            py_code = extract_python_code(reply)
+
+            extra_paths = []
+            if pip_cmds:
+                yield sse("stage", "pip")
+                async for kind, data in stream_from_thread(lambda emit: execute_pip_commands(pip_cmds, on_line=emit)):
+                    if kind == "event":
+                        yield sse("pip", data)
+                    else:
+                        extra_paths = data
+
+            exec_key = None
+            if py_code and not req.fresh:
+                exec_key = await asyncio.to_thread(exec_cache_key, py_code, workspace, extra_paths)
+            cached = exec_result_cache.get(exec_key) if exec_key else None
+            if cached:
+                output = cached["output"]
+                public_urls = [url for _, url in cached["files"]]
+                yield sse("stage", "exec")
+                yield sse("exec", output)
+                yield sse("stage", "upload")
+                for filename, url in cached["files"]:
+                    yield sse("upload", {"file": filename, "url": url, "error": None})
+            elif py_code:
+                succeeded = False
+                yield sse("stage", "exec")
+                async for kind, data in stream_from_thread(lambda emit: run_python_code(py_code, workspace, on_line=emit, extra_paths=extra_paths)):
+                    if kind == "event":
+                        yield sse("exec", data)
+                    else:
+                        output, succeeded = data
+
+                files, failed = [], False
+                yield sse("stage", "upload")
+                async for kind, data in stream_from_thread(lambda emit: upload_outputs(workspace, lambda *item: emit(item))):
+                    if kind == "event":
+                        filename, url, error = data
+                        failed = failed or error is not None
+                        if url:
+                            files.append((filename, url))
+                        yield sse("upload", {"file": filename, "url": url, "error": error})
+                    else:
+                        public_urls = data
+                if exec_key and succeeded and not failed:
+                    exec_result_cache.set(exec_key, {"output": output, "files": files})
+
+        ops_gen="here is the output"+output
+        if public_urls:
+            urls_as_string = ", ".join(public_urls)
+            ops_gen="the link generated:"+urls_as_string
+
+        yield sse("stage", "summary")
         links_src=f'###CODE_EXEC{py_code}###CODE_EXEC\n'
-        yield f"event: bot\ndata: {json.dumps(links_src)}\n\n"
+        yield sse("bot", links_src)
         
-        history = get_last_history(chat_id, 15)
-        memories = get_all_memories() # Per-chat memories
+        context = await context_builder.build(chat_id)
         mn_prompt = (
         f"You are Nexora, a large language model developed by Dhruvaraj. "
         f"Your role is to act as a message passer, providing clear, concise, and formally worded responses. "
@@ -768,15 +760,12 @@ async def chat_stream_exec(req: ChatRequest):
             {"role": "system", "content": mn_prompt},
         ]
 
-        for exchange in history:
-            messages.append({"role": "user", "content": exchange["user_text"]})
-            cleaned = strip_first_think_block(exchange["bot_text"])
-            messages.append({"role": "assistant", "content": cleaned})
+        messages.extend(context.messages())
 
         messages.append({"role": "user", "content": user_msg})
 
         bot_buffer = ""
-        resp_stream = client.chat.completions.create(
+        resp_stream = await client.chat.completions.create(
             model=CHAT_MODEL,
             stream=True,
             messages=messages,
@@ -788,13 +777,13 @@ async def chat_stream_exec(req: ChatRequest):
         )
 
 
-        for chunk in resp_stream:
+        async for chunk in resp_stream:
             delta = chunk.choices[0].delta.content or ""
             if delta:
                 bot_buffer += delta
                 yield f"event: bot\ndata: {json.dumps(delta)}\n\n"
 
-        add_history(chat_id, user_msg, links_src+bot_buffer)
+        await db.add_history_async(chat_id, user_msg, links_src+bot_buffer)
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
@@ -813,38 +802,21 @@ class CanvasChatRequest(BaseModel):
 @app.post("/code-files")
 async def save_code_file(req: SaveCodeRequest,request:Request):
     user_id = get_current_user_id(request)
-    cursor.execute(
-        "INSERT INTO code_files (user_id, filename, code) VALUES (?, ?, ?)",
-        (user_id, req.filename, req.code)
-    )
-    conn.commit()
-    new_file_id = cursor.lastrowid
+    new_file_id = await db.save_code_file_async(user_id, req.filename, req.code)
     return {"status": "ok", "id": new_file_id, "filename": req.filename}
 
 # --- NEW: Endpoint to get all of a user's code files (latest version of each) ---
 @app.get("/code-files")
 async def get_user_code_files(request: Request):
     user_id = get_current_user_id(request)
-    # This query gets the most recent version of each file for the user
-    cursor.execute("""
-        SELECT id, filename, code, MAX(created_at) as last_saved
-        FROM code_files
-        WHERE user_id = ?
-        GROUP BY filename
-        ORDER BY last_saved DESC
-    """, (user_id,))
-    files = cursor.fetchall()
+    files = db.list_latest_code_files(user_id)
     return [{"id": r["id"], "filename": r["filename"], "code": r["code"]} for r in files]
 
 # --- NEW: Endpoint to get a specific code file by its ID ---
 @app.get("/code-files/{file_id}")
 async def get_code_file(file_id: int):
     user_id = get_current_user_id()
-    cursor.execute(
-        "SELECT id, filename, code, created_at FROM code_files WHERE id = ? AND user_id = ?",
-        (file_id, user_id)
-    )
-    file = cursor.fetchone()
+    file = db.get_code_file(file_id, user_id)
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
     return {"id": file["id"], "filename": file["filename"], "code": file["code"], "created_at": file["created_at"]}
@@ -854,7 +826,7 @@ async def get_code_file(file_id: int):
 # --- NEW: Endpoint for AI chat within the canvas ---
 @app.post("/canvas-chat")
 async def canvas_chat_stream(req: CanvasChatRequest):
-    client= get_next_client()
+    client= get_next_async_client()
     system_prompt = "You are an expert coding assistant. A user will provide you with their current code and a prompt. You must only respond with the raw code that should be added or changed. The code should be enclosed in a single markdown code block (e.g., ```python ... ```). Do not add explanations or any other text outside the code block."
     
     messages = [
@@ -862,10 +834,9 @@ async def canvas_chat_stream(req: CanvasChatRequest):
         {"role": "user", "content": f"Here is my current code:\n\n```\n{req.code}\n```\n\nMy request is: {req.prompt}"}
     ]
 
-    def event_generator():
+    async def event_generator():
         try:
-            # Note: Ensure your client call is appropriate (sync/async)
-            resp_stream = client.chat.completions.create(
+            resp_stream = await client.chat.completions.create(
                 model=CHAT_MODEL, # Or your preferred model
                 stream=True,
                 messages=messages,
@@ -874,7 +845,7 @@ async def canvas_chat_stream(req: CanvasChatRequest):
             buffer = ""
             in_code_block = False
             
-            for chunk in resp_stream:
+            async for chunk in resp_stream:
                 delta = chunk.choices[0].delta.content or ""
                 if not delta:
                     continue
@@ -925,28 +896,30 @@ async def canvas_chat_stream(req: CanvasChatRequest):
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 
+SEARCH_MIN_PAGES = int(os.getenv("SEARCH_MIN_PAGES", "3"))
+
 @app.post("/search-chat")
 async def search_chat_stream(req: ChatRequest):
     query = req.message
     chat_id = req.chat_id
     num_links = 5
-    client= get_next_client()
+    client= get_next_async_client()
     if not chat_id:
         raise HTTPException(status_code=400, detail="chat_id is required.")
 
-    def event_generator():
+    async def event_generator():
         # First, immediately yield the user's query
         yield f"event: user\ndata: {json.dumps(query)}\n\n"
 
-        retrieved_links = get_search_links(query,num_links)
+        retrieved_links = await asyncio.to_thread(get_search_links, query, num_links)
         formatted_source_links = " ".join([f"[[!]]({link})" for link in retrieved_links])
         links_src=f':::(src){formatted_source_links}:::(src)\n'
         yield f"event: bot\ndata: {json.dumps(links_src)}\n\n"
-        results = get_content_from_links(retrieved_links)
+        # Prompt the LLM as soon as SEARCH_MIN_PAGES pages are in; slower links are dropped
+        results = await scrape_engine.collect(retrieved_links, enough=SEARCH_MIN_PAGES) if retrieved_links else []
         
         # Prepare the prompt for the LLM using the scraped content
-        prompt_parts = [f"[#{i+1}]({res['url']})\n{res.get('content', '<No content>')}\n" for i, res in enumerate(results)]
-        prompt_text = truncate_prompt_text("\n".join(prompt_parts), max_tokens=24000)
+        prompt_text = build_sources_prompt(results, max_tokens=24000)
 
 
         messages=[
@@ -956,7 +929,7 @@ async def search_chat_stream(req: ChatRequest):
         
         bot_buffer = ""
         bot_buffer = links_src
-        stream = client.chat.completions.create(
+        stream = await client.chat.completions.create(
             model=LLM_MODEL,
             messages=messages,
             stream=True,
@@ -965,14 +938,14 @@ async def search_chat_stream(req: ChatRequest):
         link_pass=True
         
         # Stream the LLM's response
-        for chunk in stream:
+        async for chunk in stream:
             delta = chunk.choices[0].delta
             if hasattr(delta, "content") and delta.content:
                 bot_buffer += delta.content
                 yield f"event: bot\ndata: {json.dumps(delta.content)}\n\n"
         
         # Add the search result to the specific chat's history
-        add_history(chat_id, query, bot_buffer)
+        await db.add_history_async(chat_id, query, bot_buffer)
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
@@ -980,26 +953,21 @@ async def search_chat_stream(req: ChatRequest):
 async def chat_reason(req: ChatRequest):
     user_msg = req.message
     chat_id = req.chat_id
-    client=get_next_client()
-    def event_generator():
+    client=get_next_async_client()
+    async def event_generator():
         # 1) Echo user
         yield f"event: user\ndata: {json.dumps(user_msg)}\n\n"
-        history = get_last_history(chat_id, 15)
-        memories = get_all_memories() 
+        context = await context_builder.build(chat_id)
         # For reasoning endpoint, we may choose different system prompts or include memories if needed
         # Here, we pass prior chat context but strip think blocks
-        messages = []
-        for exchange in history:
-            messages.append({"role": "user", "content": exchange["user_text"]})
-            cleaned = strip_first_think_block(exchange["bot_text"])
-            messages.append({"role": "assistant", "content": cleaned})
+        messages = context.messages()
         # Finally, current user message
         messages.append({"role": "user", "content": user_msg})
 
         bot_response = ""
         thinking_open = False
         try:
-            stream = client.chat.completions.create(
+            stream = await client.chat.completions.create(
                 model=REASONING_MODEL,
                 stream=True,
                 messages=messages,
@@ -1010,7 +978,7 @@ async def chat_reason(req: ChatRequest):
                 },
             )
 
-            for chunk in stream:
+            async for chunk in stream:
                 delta = chunk.choices[0].delta
                 # Handle reasoning tokens
                 if getattr(delta, "reasoning", None):
@@ -1032,7 +1000,7 @@ async def chat_reason(req: ChatRequest):
                     bot_response += content
 
             # 3) Persist history
-            add_history(chat_id, user_msg, bot_response)
+            await db.add_history_async(chat_id, user_msg, bot_response)
 
         except Exception as e:
             error_msg = f"Unexpected error: {str(e)}"
@@ -1048,15 +1016,12 @@ class ChatRenameRequest(BaseModel):
 
 @app.post("/chats/{chat_id}/rename")
 async def rename_chat(chat_id: int, data: ChatRenameRequest):
-    cursor.execute("UPDATE chats SET title = ? WHERE id = ?", (data.title, chat_id))
-    conn.commit()
+    db.rename_chat(chat_id, data.title)
     return {"status": "ok"}
 
 @app.delete("/chats/{chat_id}")
 async def delete_chat(chat_id: int):
-    cursor.execute("DELETE FROM history WHERE chat_id = ?", (chat_id,))
-    cursor.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
-    conn.commit()
+    db.delete_chat(chat_id)
     return {"status": "deleted"}
 
 
@@ -1110,141 +1075,35 @@ class RunCodeResponse(BaseModel):
     output: str
     error: str
     
-@app.post("/run_code", response_model=RunCodeResponse)
-async def run_code(req: RunCodeRequest):
-    code = req.code
-    language = req.language
-    language = get_language_from_filename(language)
-    temp_file_path = None
-    print(language)
-
-    # Prefer python3 on systems where it's available (like Ubuntu). Fallback to python.
-    python_cmd = shutil.which("python3") or shutil.which("python") or "python3"
-
-    # Optionally detect node binary (node vs nodejs)
-    node_cmd = shutil.which("node") or shutil.which("nodejs") or "node"
-
-    ALLOWED_COMMANDS = {
-        "python": [python_cmd],
-        "javascript": [node_cmd],
-        "java": ["javac", "java"]
-    }
-
-    if language not in ALLOWED_COMMANDS:
+async def submit_run_code(req: RunCodeRequest, user_id: Optional[int]):
+    language = get_language_from_filename(req.language)
+    if language not in SUPPORTED_LANGUAGES:
         raise HTTPException(status_code=400, detail=f"Unsupported or unsafe language for execution: {language}")
-
-    process = None  # Initialize for finally block cleanup
     try:
-        with tempfile.NamedTemporaryFile(delete=False, mode="w+", encoding="utf-8", suffix=f".{language}") as temp_file:
-            temp_file.write(code)
-            temp_file.flush()
-            temp_file_path = temp_file.name
-
-        command = []
-
-        if language == "python":
-            command = ALLOWED_COMMANDS["python"] + [temp_file_path]
-        elif language == "javascript":
-            command = ALLOWED_COMMANDS["javascript"] + [temp_file_path]
-        elif language == "java":
-            # Use Main as class name (leave as-is or derive from code/file if you want)
-            class_name = "Main"
-            # Build compile command as a list (avoid string + list)
-            java_compile_command = [ALLOWED_COMMANDS["java"][0], temp_file_path]
-
-            # Compile Java code
-            compile_process = subprocess.run(
-                java_compile_command,
-                capture_output=True,
-                text=True,
-                timeout=10,
-                cwd=os.path.dirname(temp_file_path) or None
-            )
-
-            if compile_process.returncode != 0:
-                return RunCodeResponse(
-                    status="error",
-                    output=compile_process.stdout,
-                    error=f"Compilation failed: {compile_process.stderr}"
-                )
-
-            # Run java with -cp pointing to the temp dir
-            command = [ALLOWED_COMMANDS["java"][1], "-cp", os.path.dirname(temp_file_path) or ".", class_name]
-
-        # Execute the command using Popen for timeout handling and termination control
-        process = subprocess.Popen(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        return await execution_engine.submit(language, req.code, user_id)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
 
-        try:
-            output, error = process.communicate(timeout=10)
-
-            if process.returncode != 0:
-                full_error_output = f"Execution failed with exit code {process.returncode}.\n"
-                if output:
-                    full_error_output += f"STDOUT:\n{output}\n"
-                if error:
-                    full_error_output += f"STDERR:\n{error}"
-                return RunCodeResponse(status="error", output=output, error=full_error_output)
-            else:
-                return RunCodeResponse(status="success", output=output, error=error)
 
-        except subprocess.TimeoutExpired:
-            # Terminate/kill depending on platform
-            if platform.system() == "Windows":
-                try:
-                    subprocess.run(["taskkill", "/F", "/PID", str(process.pid)], capture_output=True, text=True, check=True)
-                except subprocess.CalledProcessError as e:
-                    print(f"Warning: taskkill failed: {e.stderr}")
-            else:
-                process.terminate()
-                try:
-                    process.wait(timeout=1)
-                except subprocess.TimeoutExpired:
-                    process.kill()
+@app.post("/run_code", response_model=RunCodeResponse)
+async def run_code(req: RunCodeRequest, user_id: Optional[int] = Depends(get_current_user_id)):
+    job = await submit_run_code(req, user_id)
+    return RunCodeResponse(**await job.result())
 
-            # Read leftover output (communicate will close pipes)
-            try:
-                output, error = process.communicate(timeout=1)
-            except Exception:
-                output, error = "", ""
-            return RunCodeResponse(status="error", output=output, error="Code execution timed out after 10 seconds. The process was terminated.")
 
-    except Exception as e:
-        return RunCodeResponse(status="error", output="", error=f"Failed to run code: {str(e)}")
-    finally:
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.unlink(temp_file_path)
-            except OSError as e:
-                print(f"Warning: could not delete temp file {temp_file_path}: {e}")
-
-        if process and process.poll() is None:
-            try:
-                process.kill()
-            except Exception:
-                pass
-            try:
-                process.wait(timeout=1)
-            except Exception:
-                pass
+@app.post("/run_code/stream")
+async def run_code_stream(req: RunCodeRequest, user_id: Optional[int] = Depends(get_current_user_id)):
+    """Same as /run_code, but stdout/stderr lines are sent as SSE events while the program runs."""
+    job = await submit_run_code(req, user_id)
 
-        # Clean up compiled Java class if present
-        if language == "java" and temp_file_path:
-            class_file_path = os.path.join(os.path.dirname(temp_file_path), "Main.class")
-            if os.path.exists(class_file_path):
-                try:
-                    os.unlink(class_file_path)
-                except OSError as e:
-                    print(f"Warning: Could not delete Java class file {class_file_path}: {e}")
+    async def event_generator():
+        async for kind, data in job.stream():
+            yield f"event: {kind}\ndata: {json.dumps(data)}\n\n"
 
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 
 
-LOGO_FILE_PATH = os.path.join("assets", "nex.jpeg")
 
 @app.post("/export_pdf")
 async def export_pdf(data: str = Form(...)):
@@ -1271,113 +1130,20 @@ async def export_pdf(data: str = Form(...)):
             logger.error("No content provided for PDF export")
             raise HTTPException(status_code=400, detail="No content provided")
 
-        # Check for dependencies early
-        if not shutil.which("pandoc") or not shutil.which("pdflatex"):
-            detail = "Pandoc and/or pdfLaTeX is not installed or not in PATH."
-            logger.error(detail)
-            raise HTTPException(status_code=500, detail=detail)
-
-        # --- Start: Emoji Stripping Logic ---
-        emoji_pattern = re.compile(
-            "["
-            "\U0001F600-\U0001F64F"  # emoticons
-            "\U0001F300-\U0001F5FF"  # symbols & pictographs
-            "\U0001F680-\U0001F6FF"  # transport & map symbols
-            "\U0001F1E0-\U0001F1FF"  # flags (iOS)
-            "\U00002702-\U000027B0"
-            "\U000024C2-\U0001F251"
-            "]+",
-            flags=re.UNICODE
+        try:
+            pdf_content = await export_pdf_bytes(content)
+        except RuntimeError as e:
+            logger.error(str(e))
+            raise HTTPException(status_code=500, detail=str(e))
+        logger.info(f"PDF ready in {time.time() - start_time:.2f} seconds, size: {len(pdf_content)} bytes")
+
+        return StreamingResponse(
+            io.BytesIO(pdf_content),
+            media_type="application/pdf",
+            headers={"Content-Disposition": f"attachment; filename=chat_{chat_id}.pdf"}
         )
-        content = emoji_pattern.sub(r'', content)
-        logger.info("Emojis stripped from content.")
-        # --- End: Emoji Stripping Logic ---
-
-        # Use a temporary directory which is automatically cleaned up
-        with tempfile.TemporaryDirectory() as tmpdir:
-            md_file = os.path.join(tmpdir, "content.md")
-            pdf_file = os.path.join(tmpdir, "output.pdf")
-
-            logger.info(f"Processing content (length: {len(content)} chars, chat_id: {chat_id})")
-
-            # Write the markdown content to a temporary file
-            try:
-                with open(md_file, "w", encoding="utf-8") as f:
-                    f.write(content)
-                logger.info(f"Markdown file written: {md_file}")
-            except Exception as e:
-                logger.error(f"Failed to write markdown file: {str(e)}")
-                raise HTTPException(status_code=500, detail="Failed to write markdown file")
-
-            # Base Pandoc command
-            pandoc_cmd = [
-                "pandoc", md_file, "-o", pdf_file,
-                "--pdf-engine=pdflatex",
-                "-V", "geometry:margin=1in"
-            ]
-
-            # --- Logic to add footer with logo ---
-            if os.path.exists(LOGO_FILE_PATH):
-                logo_filename = os.path.basename(LOGO_FILE_PATH)
-                header_file = os.path.join(tmpdir, "header.tex")
-
-                # 1. Copy logo into the temp directory so LaTeX can find it
-                shutil.copy(LOGO_FILE_PATH, os.path.join(tmpdir, logo_filename))
-
-                # 2. Create the LaTeX header file with footer commands
-                latex_header = f"""
-\\usepackage{{fancyhdr}}
-\\usepackage{{graphicx}} % Required for including images
-\\pagestyle{{fancy}}
-\\fancyhf{{}} % Clear all header and footer fields
-\\renewcommand{{\\headrulewidth}}{{0pt}} % No line at the header
-\\renewcommand{{\\footrulewidth}}{{0.4pt}} % A line at the footer
-\\fancyfoot[L]{{\\includegraphics[height=0.8cm]{{{logo_filename}}}}} % Logo on the left
-\\fancyfoot[R]{{Page \\thepage}} % Page number on the right
-"""
-                with open(header_file, "w", encoding="utf-8") as f:
-                    f.write(latex_header)
-
-                # 3. Add the header include flag to the Pandoc command
-                pandoc_cmd.extend(["-H", header_file])
-                logger.info("Logo and footer configuration will be applied.")
-            else:
-                logger.warning(f"Logo file not found at {LOGO_FILE_PATH}. PDF will be generated without a logo.")
-
-            # --- Run Pandoc to generate the PDF ---
-            try:
-                logger.info(f"Running Pandoc command: {' '.join(pandoc_cmd)}")
-                result = subprocess.run(
-                    pandoc_cmd,
-                    check=True,
-                    capture_output=True,
-                    text=True,
-                    cwd=tmpdir,  # Crucial: run from tmpdir to find logo and header
-                    timeout=60
-                )
-                logger.info(f"Pandoc completed in {time.time() - start_time:.2f} seconds")
-                logger.debug(f"Pandoc stdout: {result.stdout}")
-
-                with open(pdf_file, "rb") as f:
-                    pdf_content = f.read()
-                logger.info(f"PDF file read, size: {len(pdf_content)} bytes")
-
-                return StreamingResponse(
-                    io.BytesIO(pdf_content),
-                    media_type="application/pdf",
-                    headers={"Content-Disposition": f"attachment; filename=chat_{chat_id}.pdf"}
-                )
-
-            except subprocess.TimeoutExpired:
-                logger.error("Pandoc timed out after 60 seconds")
-                raise HTTPException(status_code=500, detail="PDF generation timed out")
-            except subprocess.CalledProcessError as e:
-                error_details = f"Pandoc/LaTeX Error:\nSTDOUT: {e.stdout}\nSTDERR: {e.stderr}"
-                logger.error(error_details)
-                raise HTTPException(status_code=500, detail=error_details)
-            except Exception as e:
-                logger.error(f"Unexpected error during PDF generation: {str(e)}")
-                raise HTTPException(status_code=500, detail=f"Failed to generate PDF")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Unexpected error in export_pdf: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
@@ -1391,11 +1157,8 @@ scheduler = BackgroundScheduler(timezone=tz)
 scheduler.configure(timezone=tz)
 scheduler.start()
 
-import asyncio
-
 def schedule_agent(agent_id):
-    cursor.execute("SELECT * FROM agents WHERE id = ?", (agent_id,))
-    agent = cursor.fetchone()
+    agent = db.get_agent(agent_id)
     if not agent or agent["paused"]:
         return
     freq = agent["frequency"]
@@ -1433,8 +1196,7 @@ def unschedule_agent(agent_id):
         pass
 
 async def run_agent_task(agent_id):
-    cursor.execute("SELECT * FROM agents WHERE id = ?", (agent_id,))
-    row = cursor.fetchone()
+    row = db.get_agent(agent_id)
     if not row:
         return
     agent = dict(row)
@@ -1446,26 +1208,26 @@ async def run_agent_task(agent_id):
     title = agent["title"] + " - " + datetime.now(tz).strftime("%Y-%m-%d %H:%M")
 
     # create chat record
-    cursor.execute("INSERT INTO chats (user_id, title, is_private) VALUES (?, ?, 0)", (user_id, title))
-    conn.commit()
-    chat_id = cursor.lastrowid
+    chat_id = await db.create_chat_async(user_id, title, 0)
 
-    client = get_next_client()
-    memories = get_all_memories()
+    client = get_next_async_client()
+    memories = memory_store.prompt_for(user_id, prompt)
+    context = await context_builder.build(chat_id)
     messages = [
         {"role": "system", "content": "your name is zodio"},
         {"role": "system", "content": memories},
-        {"role": "user", "content": parse_message_with_images(prompt)},
+        *await resolve_user_images(context.messages()),
+        {"role": "user", "content": await parse_message_with_images(prompt)},
     ]
 
     # call the model (keep your existing call)
-    response = client.chat.completions.create(
+    response = await client.chat.completions.create(
         model=CHAT_MODEL,
         stream=False,
         messages=messages,
     )
     bot_text = response.choices[0].message.content
-    add_history(chat_id, prompt, bot_text)
+    await db.add_history_async(chat_id, prompt, bot_text)
 
     # notification text
     notification_msg = f"Nex Agent {agent['title']} triggered: {bot_text[:120]}..."
@@ -1497,9 +1259,8 @@ async def run_agent_task(agent_id):
 
 
 def load_all_agents():
-    cursor.execute("SELECT id FROM agents WHERE paused = 0")
-    for r in cursor.fetchall():
-        schedule_agent(r["id"])
+    for agent_id in db.list_active_agent_ids():
+        schedule_agent(agent_id)
 
 class AgentCreate(BaseModel):
     title: str
@@ -1513,25 +1274,17 @@ class AgentUpdate(BaseModel):
 
 @app.post("/agents")
 async def create_agent(agent: AgentCreate, user_id: int = Depends(get_current_user_id)):
-    cursor.execute(
-        "INSERT INTO agents (user_id, title, time, frequency, prompt, notification) VALUES (?, ?, ?, ?, ?, ?)",
-        (user_id, agent.title, agent.time, agent.frequency, agent.prompt, 1 if agent.notification else 0)
-    )
-    conn.commit()
-    new_id = cursor.lastrowid
+    new_id = db.create_agent(user_id, agent.title, agent.time, agent.frequency, agent.prompt, agent.notification)
     schedule_agent(new_id)
     return {"id": new_id}
 
 @app.get("/agents")
 async def get_agents(user_id: int = Depends(get_current_user_id)):
-    cursor.execute("SELECT * FROM agents WHERE user_id = ? ORDER BY created_at DESC", (user_id,))
-    rows = cursor.fetchall()
-    return [dict(r) for r in rows]
+    return [dict(r) for r in db.list_agents(user_id)]
 
 @app.delete("/agents/{agent_id}")
 async def delete_agent(agent_id: int, user_id: int = Depends(get_current_user_id)):
-    cursor.execute("DELETE FROM agents WHERE id = ? AND user_id = ?", (agent_id, user_id))
-    conn.commit()
+    db.delete_agent(agent_id, user_id)
     unschedule_agent(agent_id)
     return {"status": "deleted"}
 
@@ -1539,8 +1292,7 @@ async def delete_agent(agent_id: int, user_id: int = Depends(get_current_user_id
 async def update_agent(agent_id: int, update: AgentUpdate, user_id: int = Depends(get_current_user_id)):
     if update.paused is not None:
         paused = 1 if update.paused else 0
-        cursor.execute("UPDATE agents SET paused = ? WHERE id = ? AND user_id = ?", (paused, agent_id, user_id))
-        conn.commit()
+        db.set_agent_paused(agent_id, user_id, update.paused)
         if paused:
             unschedule_agent(agent_id)
         else:
@@ -1568,11 +1320,7 @@ async def push_subscribe(payload: dict, user_id: int = Depends(get_current_user_
         return JSONResponse({"error":"no subscription"}, status_code=400)
 
     # store as text
-    cursor.execute(
-        "INSERT INTO push_subscriptions (user_id, subscription_json) VALUES (?, ?)",
-        (user_id, json.dumps(subscription))
-    )
-    conn.commit()
+    db.add_push_subscription(user_id, json.dumps(subscription))
     return {"status":"ok"}
 
 
@@ -1584,8 +1332,7 @@ VAPID_PRIVATE_KEY = "Q3zjIVpwPYCNPLb-d8R4zgGStVlopeda9JLAOZ8DMsk"
 VAPID_CLAIMS = {"sub": "mailto:you@yourdomain.com"}  # update email
 
 def send_push_to_user(user_id: int, payload: dict):
-    cursor.execute("SELECT id, subscription_json FROM push_subscriptions WHERE user_id = ?", (user_id,))
-    rows = cursor.fetchall()
+    rows = db.list_push_subscriptions(user_id)
     seen_endpoints = set()
 
     for row in rows:
@@ -1593,15 +1340,13 @@ def send_push_to_user(user_id: int, payload: dict):
         try:
             sub = json.loads(row["subscription_json"])
         except Exception:
-            cursor.execute("DELETE FROM push_subscriptions WHERE id = ?", (sub_id,))
-            conn.commit()
+            db.delete_push_subscription(sub_id)
             continue
 
         endpoint = sub.get("endpoint")
         if not endpoint or endpoint in seen_endpoints:
             # duplicate or invalid -> delete duplicate record to keep DB clean
-            cursor.execute("DELETE FROM push_subscriptions WHERE id = ?", (sub_id,))
-            conn.commit()
+            db.delete_push_subscription(sub_id)
             continue
 
         seen_endpoints.add(endpoint)
@@ -1618,7 +1363,6 @@ def send_push_to_user(user_id: int, payload: dict):
             try: status = ex.response.status_code
             except Exception: pass
             if status in (404, 410):
-                cursor.execute("DELETE FROM push_subscriptions WHERE id = ?", (sub_id,))
-                conn.commit()
+                db.delete_push_subscription(sub_id)
             else:
                 print("WebPush failed:", ex)
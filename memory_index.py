@@ -0,0 +1,134 @@
+import heapq
+import math
+import os
+import re
+import threading
+from collections import Counter, OrderedDict, defaultdict
+
+import db
+
+MEMORY_TOP_K = int(os.getenv("MEMORY_TOP_K", "5"))
+MEMORY_INDEX_MAX_USERS = int(os.getenv("MEMORY_INDEX_MAX_USERS", "256"))
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "do", "for", "from", "has", "have", "he",
+    "her", "his", "i", "if", "in", "is", "it", "its", "me", "my", "of", "on", "or", "our", "she", "so",
+    "that", "the", "their", "them", "they", "this", "to", "was", "we", "were", "what", "when", "which",
+    "who", "will", "with", "you", "your",
+}
+
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class MemoryIndex:
+    """In-memory BM25 inverted index over one user's memories; add() is incremental."""
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self.texts = {}                      # memory_id -> text
+        self.lengths = {}                    # memory_id -> token count
+        self.postings = defaultdict(dict)    # term -> {memory_id: tf}
+        self.total_length = 0
+
+    def version(self) -> tuple[int, int]:
+        """Same shape as db.memory_version(): (count, max id)."""
+        return len(self.texts), max(self.texts, default=0)
+
+    def add(self, memory_id: int, text: str) -> None:
+        if memory_id in self.texts:
+            return
+        terms = Counter(tokenize(text))
+        self.texts[memory_id] = text
+        self.lengths[memory_id] = sum(terms.values())
+        self.total_length += self.lengths[memory_id]
+        for term, tf in terms.items():
+            self.postings[term][memory_id] = tf
+
+    def search(self, query: str, k: int) -> list[str]:
+        n = len(self.texts)
+        if n == 0:
+            return []
+        avg_len = self.total_length / n or 1.0
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            # Smoothed IDF: stays positive for a term in every memory, so such a
+            # term still ranks by tf and length instead of matching nothing
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for memory_id, tf in docs.items():
+                norm = tf + self.K1 * (1 - self.B + self.B * self.lengths[memory_id] / avg_len)
+                scores[memory_id] += idf * tf * (self.K1 + 1) / norm
+        ranked = heapq.nlargest(k, scores.items(), key=lambda item: (item[1], item[0]))
+        # Keep the original (chronological) order in the prompt
+        return [self.texts[memory_id] for memory_id, _ in sorted(ranked)]
+
+
+class MemoryStore:
+    """
+    Per-user memories with a lazily built retrieval index. Only the top-k memories
+    relevant to the current message are sent to the model, so prompt size stays
+    flat as memories accumulate.
+
+    Indexes are kept for the `max_users` most recently used users. Each lookup
+    checks the index against db.memory_version(), so memories written by another
+    worker process are picked up: new rows are added incrementally, anything
+    else (a deletion) rebuilds the index.
+    """
+
+    def __init__(self, top_k=MEMORY_TOP_K, max_users=MEMORY_INDEX_MAX_USERS):
+        self.top_k = top_k
+        self.max_users = max_users
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _index_for(self, user_id) -> MemoryIndex:
+        version = db.memory_version(user_id)
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None and index.version() != version:
+                for row in db.list_user_memories(user_id, after_id=index.version()[1]):
+                    index.add(row["id"], row["memory"])
+                if index.version() != version:
+                    index = None
+            if index is None:
+                index = MemoryIndex()
+                for row in db.list_user_memories(user_id):
+                    index.add(row["id"], row["memory"])
+                self._indexes[user_id] = index
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+            return index
+
+    def add(self, user_id: int, text: str) -> int:
+        if user_id is None:
+            raise ValueError("Memories must belong to a user")
+        memory_id = db.add_memory(text, user_id)
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                index.add(memory_id, text)
+        return memory_id
+
+    def relevant(self, user_id, query: str, k=None) -> list[str]:
+        if user_id is None:
+            return []
+        k = k or self.top_k
+        index = self._index_for(user_id)
+        with self._lock:
+            if len(index.texts) <= k:
+                return [index.texts[i] for i in sorted(index.texts)]
+            return index.search(query, k)
+
+    def prompt_for(self, user_id, query: str) -> str:
+        return ", ".join(self.relevant(user_id, query))
+
+
+memory_store = MemoryStore()
@@ -0,0 +1,169 @@
+import hashlib
+import importlib.metadata
+import os
+import re
+import shlex
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+WHEELHOUSE_DIR = Path(os.getenv("WHEELHOUSE_DIR", "./wheelhouse"))
+OVERLAY_DIR = Path(os.getenv("PACKAGE_OVERLAY_DIR", "./overlays"))
+PIP_TIMEOUT = int(os.getenv("PIP_TIMEOUT", "300"))
+
+REQUIREMENT_RE = re.compile(r"^([A-Za-z0-9][A-Za-z0-9._-]*)(\[[^\]]*\])?\s*(?:==\s*([A-Za-z0-9.+!*_-]+))?")
+COMPLETE_MARKER = ".complete"
+
+
+def normalize_name(name: str) -> str:
+    """PEP 503 normalized distribution name."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def parse_pip_command(raw_cmd: str) -> list[str]:
+    """Requirement strings from a `pip install ...` command; options are dropped."""
+    parts = shlex.split(raw_cmd)
+    if len(parts) < 3 or parts[0].lower() not in ("pip", "pip3") or parts[1] != "install":
+        return []
+    return [part for part in parts[2:] if not part.startswith("-")]
+
+
+class InstalledIndex:
+    """
+    Name -> version for every distribution importable by the server's
+    interpreter (which is also what generated code runs under). Each sys.path
+    directory is rescanned only when its mtime changes, so refresh() is a few
+    stat calls in the common case.
+    """
+
+    def __init__(self, paths=None):
+        self.paths = paths
+        self._scanned = {}   # path entry -> (mtime, {name: version})
+        self._lock = threading.Lock()
+
+    def refresh(self) -> None:
+        entries = [p for p in (self.paths or sys.path) if p and os.path.isdir(p)]
+        with self._lock:
+            for entry in entries:
+                try:
+                    mtime = os.stat(entry).st_mtime_ns
+                except OSError:
+                    continue
+                cached = self._scanned.get(entry)
+                if cached and cached[0] == mtime:
+                    continue
+                found = {}
+                for dist in importlib.metadata.distributions(path=[entry]):
+                    name = dist.metadata["Name"]
+                    if name:
+                        found.setdefault(normalize_name(name), dist.version)
+                self._scanned[entry] = (mtime, found)
+            for entry in set(self._scanned) - set(entries):
+                del self._scanned[entry]
+
+    def version(self, name: str) -> str | None:
+        name = normalize_name(name)
+        with self._lock:
+            for _, found in self._scanned.values():
+                if name in found:
+                    return found[name]
+        return None
+
+    def __len__(self):
+        with self._lock:
+            return len({name for _, found in self._scanned.values() for name in found})
+
+
+class PackageResolver:
+    """
+    Satisfies a job's `pip install` commands without touching the server's own
+    environment. Requirements already installed are skipped. The rest are built
+    once into a shared wheelhouse and installed, offline from that wheelhouse,
+    into an overlay directory keyed by the requirement set; jobs get the overlay
+    on their sys.path. A given package is therefore downloaded/built at most once
+    and a given set installed at most once.
+    """
+
+    def __init__(self, wheelhouse=WHEELHOUSE_DIR, overlay_root=OVERLAY_DIR, index=None):
+        self.wheelhouse = Path(wheelhouse)
+        self.overlay_root = Path(overlay_root)
+        self.index = index or InstalledIndex()
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+
+    def refresh(self) -> None:
+        self.index.refresh()
+
+    def is_satisfied(self, requirement: str) -> bool:
+        match = REQUIREMENT_RE.match(requirement)
+        if not match:
+            return False
+        installed = self.index.version(match.group(1))
+        if installed is None:
+            return False
+        pinned = match.group(3)
+        # Only exact pins are checked; any other specifier is taken as satisfied by what is installed
+        return pinned is None or pinned == installed or "*" in pinned
+
+    def _lock_for(self, key):
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _pip(self, args, on_line):
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "pip", *args, "--disable-pip-version-check", "--no-input"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+        )
+        timer = threading.Timer(PIP_TIMEOUT, proc.kill)
+        timer.start()
+        try:
+            for line in iter(proc.stdout.readline, ''):
+                on_line(line)
+            return proc.wait()
+        finally:
+            timer.cancel()
+
+    def _install_overlay(self, requirements, on_line) -> Path | None:
+        key = hashlib.sha256("\n".join(requirements).encode("utf-8")).hexdigest()[:16]
+        overlay = self.overlay_root / key
+        with self._lock_for(key):
+            if (overlay / COMPLETE_MARKER).exists():
+                on_line(f"[i] Reusing installed overlay for: {' '.join(requirements)}\n")
+                return overlay
+            self.wheelhouse.mkdir(parents=True, exist_ok=True)
+            install = ["install", "--no-index", "--find-links", str(self.wheelhouse),
+                       "--target", str(overlay), "--upgrade", *requirements]
+            if self._pip(install, on_line) != 0:
+                # Something is not in the wheelhouse yet: fetch/build it there once, then retry offline
+                on_line(f"▶️ Building wheels: {' '.join(requirements)}\n")
+                if self._pip(["wheel", "--wheel-dir", str(self.wheelhouse), "--find-links", str(self.wheelhouse), *requirements], on_line) != 0:
+                    return None
+                if self._pip(install, on_line) != 0:
+                    return None
+            (overlay / COMPLETE_MARKER).touch()
+            return overlay
+
+    def resolve(self, requirements, on_line) -> list[str]:
+        """Make `requirements` importable; returns the overlay dirs to add to the job's sys.path."""
+        self.refresh()
+        missing = []
+        for requirement in requirements:
+            if self.is_satisfied(requirement):
+                on_line(f"[i] Skipping already-installed package: {requirement}\n")
+            else:
+                missing.append(requirement)
+        if not missing:
+            return []
+        overlay = self._install_overlay(sorted(set(missing)), on_line)
+        if overlay is None:
+            on_line(f"[✖️] Could not install: {' '.join(missing)}\n")
+            return []
+        on_line(f"[✔️] Installed: {' '.join(missing)}\n")
+        return [str(overlay.resolve())]
+
+
+package_resolver = PackageResolver()
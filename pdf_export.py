@@ -0,0 +1,320 @@
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
+
+from cache import TTLCache
+
+PDF_EXPORT_WORKERS = int(os.getenv("PDF_EXPORT_WORKERS", "2"))
+PDF_EXPORT_TIMEOUT = int(os.getenv("PDF_EXPORT_TIMEOUT", "60"))
+PDF_TEMPLATE_DIR = os.getenv("PDF_TEMPLATE_DIR", os.path.join(tempfile.gettempdir(), "nexora-pdf-template"))
+LOGO_FILE_PATH = os.path.join("assets", "nex.jpeg")
+# Bump when either renderer's output changes so cached PDFs are not reused
+RENDERER_VERSION = "2"
+
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR")
+if PDF_CACHE_DIR:
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+
+pdf_cache = TTLCache(
+    "pdf_exports",
+    ttl=int(os.getenv("PDF_CACHE_TTL", str(24 * 3600))),
+    max_bytes=int(os.getenv("PDF_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    disk_path=os.path.join(PDF_CACHE_DIR, "pdf_cache.db") if PDF_CACHE_DIR else None,
+)
+
+EMOJI_RE = re.compile(
+    "["
+    "\U0001F600-\U0001F64F"  # emoticons
+    "\U0001F300-\U0001F5FF"  # symbols & pictographs
+    "\U0001F680-\U0001F6FF"  # transport & map symbols
+    "\U0001F1E0-\U0001F1FF"  # flags (iOS)
+    "\U00002702-\U000027B0"
+    "\U000024C2-\U0001F251"
+    "]+",
+    flags=re.UNICODE
+)
+
+# Anything the in-process renderer cannot lay out properly goes to pandoc/LaTeX
+NEEDS_LATEX_RE = re.compile(
+    r"\$[^$\n]+\$|\\\(|\\\[|\\begin\{|^\s*\|.*\|\s*$|!\[[^\]]*\]\(|<[a-zA-Z][^>]*>",
+    re.MULTILINE,
+)
+
+LATEX_HEADER = """
+\\usepackage{{fancyhdr}}
+\\usepackage{{graphicx}} % Required for including images
+\\graphicspath{{{{{template_dir}/}}}}
+\\pagestyle{{fancy}}
+\\fancyhf{{}} % Clear all header and footer fields
+\\renewcommand{{\\headrulewidth}}{{0pt}} % No line at the header
+\\renewcommand{{\\footrulewidth}}{{0.4pt}} % A line at the footer
+{logo_line}
+\\fancyfoot[R]{{Page \\thepage}} % Page number on the right
+"""
+
+
+def strip_emoji(content: str) -> str:
+    return EMOJI_RE.sub(r'', content)
+
+
+def needs_latex(content: str) -> bool:
+    return bool(NEEDS_LATEX_RE.search(content))
+
+
+def prepare_template_dir(template_dir=PDF_TEMPLATE_DIR, logo_path=LOGO_FILE_PATH) -> str:
+    """Write header.tex (and the logo) once; every pandoc run reuses the directory."""
+    template_dir = os.path.abspath(template_dir)
+    header_file = os.path.join(template_dir, "header.tex")
+    if os.path.exists(header_file):
+        return template_dir
+    os.makedirs(template_dir, exist_ok=True)
+    logo_line = ""
+    if os.path.exists(logo_path):
+        logo_filename = os.path.basename(logo_path)
+        shutil.copy(logo_path, os.path.join(template_dir, logo_filename))
+        logo_line = f"\\fancyfoot[L]{{\\includegraphics[height=0.8cm]{{{logo_filename}}}}} % Logo on the left"
+    fd, tmp = tempfile.mkstemp(dir=template_dir, suffix=".tex")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(LATEX_HEADER.format(template_dir=template_dir, logo_line=logo_line))
+    os.replace(tmp, header_file)
+    return template_dir
+
+
+def render_pandoc(content: str, template_dir: str) -> bytes:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        md_file = os.path.join(tmpdir, "content.md")
+        pdf_file = os.path.join(tmpdir, "output.pdf")
+        with open(md_file, "w", encoding="utf-8") as f:
+            f.write(content)
+        pandoc_cmd = [
+            "pandoc", md_file, "-o", pdf_file,
+            "--pdf-engine=pdflatex",
+            "-V", "geometry:margin=1in",
+            "-H", os.path.join(template_dir, "header.tex"),
+        ]
+        try:
+            subprocess.run(pandoc_cmd, check=True, capture_output=True, text=True, cwd=tmpdir, timeout=PDF_EXPORT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            raise RuntimeError("PDF generation timed out")
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"Pandoc/LaTeX Error:\nSTDOUT: {e.stdout}\nSTDERR: {e.stderr}")
+        with open(pdf_file, "rb") as f:
+            return f.read()
+
+
+# Links are matched as whole tokens so emphasis can never straddle a <link> tag
+INLINE_RE = re.compile(r"\[(?P<text>[^\]]+)\]\((?P<href>https?://[^)\s\"]+)\)|\*\*|__|\*")
+EMPHASIS_TAGS = {"**": "b", "__": "b", "*": "i"}
+
+
+def _emphasis(text: str) -> str:
+    """Escaped text -> balanced <b>/<i>/<link> markup; unmatched delimiters stay literal."""
+    out, openers = [], []  # openers: (delimiter, index of its placeholder in out)
+    pos = 0
+    for m in INLINE_RE.finditer(text):
+        out.append(text[pos:m.start()])
+        pos = m.end()
+        if m.group("href"):
+            out.append(f'<link href="{m.group("href")}" color="blue">{_emphasis(m.group("text"))}</link>')
+            continue
+        delim = m.group()
+        before, after = text[m.start() - 1:m.start()], text[m.end():m.end() + 1]
+        if openers and openers[-1][0] == delim and before.strip():
+            # Only the innermost open delimiter may close, which keeps the tags nested
+            _, index = openers.pop()
+            out[index] = f"<{EMPHASIS_TAGS[delim]}>"
+            out.append(f"</{EMPHASIS_TAGS[delim]}>")
+        elif after.strip():
+            openers.append((delim, len(out)))
+            out.append(delim)
+        else:
+            out.append(delim)
+    out.append(text[pos:])
+    return "".join(out)
+
+
+def _inline(text: str) -> str:
+    """Markdown inline markup -> reportlab paragraph markup."""
+    parts = re.split(r"(`[^`]+`)", text)
+    out = []
+    for part in parts:
+        if part.startswith("`") and part.endswith("`") and len(part) > 1:
+            out.append(f'<font face="Courier">{escape(part[1:-1])}</font>')
+        else:
+            out.append(_emphasis(escape(part)))
+    return "".join(out)
+
+
+def render_reportlab(content: str, logo_path=LOGO_FILE_PATH, markup=True) -> bytes:
+    """In-process renderer for plain markdown: headings, paragraphs, lists, code blocks, quotes.
+
+    With markup=False inline formatting is dropped and text is only escaped.
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.platypus import ListFlowable, ListItem, Paragraph, Preformatted, SimpleDocTemplate, Spacer
+
+    styles = getSampleStyleSheet()
+    code_style = ParagraphStyle("CodeBlock", parent=styles["Code"], fontSize=8.5, leading=10.5, backColor="#f4f4f4")
+    quote_style = ParagraphStyle("Quote", parent=styles["BodyText"], leftIndent=18, textColor="#555555")
+    heading_styles = {1: styles["Heading1"], 2: styles["Heading2"], 3: styles["Heading3"]}
+    inline = _inline if markup else escape
+
+    story, paragraph, items, ordered = [], [], [], False
+    lines = content.splitlines()
+
+    def flush_paragraph():
+        if paragraph:
+            story.append(Paragraph(inline(" ".join(paragraph)), styles["BodyText"]))
+            paragraph.clear()
+
+    def flush_list():
+        nonlocal items
+        if items:
+            story.append(ListFlowable(
+                [ListItem(Paragraph(inline(item), styles["BodyText"])) for item in items],
+                bulletType="1" if ordered else "bullet", leftIndent=18,
+            ))
+            items = []
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        stripped = line.strip()
+        if stripped.startswith("```"):
+            flush_paragraph(); flush_list()
+            block = []
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith("```"):
+                block.append(lines[i])
+                i += 1
+            story.append(Preformatted("\n".join(block), code_style))
+            story.append(Spacer(1, 6))
+        elif not stripped:
+            flush_paragraph(); flush_list()
+        elif re.match(r"^#{1,6}\s", stripped):
+            flush_paragraph(); flush_list()
+            level = len(stripped) - len(stripped.lstrip("#"))
+            story.append(Paragraph(inline(stripped[level:].strip()), heading_styles.get(level, styles["Heading4"])))
+        elif re.match(r"^([-*+]|\d+[.)])\s+", stripped):
+            flush_paragraph()
+            is_ordered = bool(re.match(r"^\d", stripped))
+            if items and is_ordered != ordered:
+                flush_list()
+            ordered = is_ordered
+            items.append(re.sub(r"^([-*+]|\d+[.)])\s+", "", stripped))
+        elif stripped.startswith(">"):
+            flush_paragraph(); flush_list()
+            story.append(Paragraph(inline(stripped.lstrip("> ")), quote_style))
+        elif re.match(r"^(-{3,}|\*{3,}|_{3,})$", stripped):
+            flush_paragraph(); flush_list()
+            story.append(Spacer(1, 12))
+        else:
+            flush_list()
+            paragraph.append(stripped)
+        i += 1
+    flush_paragraph(); flush_list()
+
+    # Same footer as the LaTeX header: logo left, page number right, rule above
+    def footer(canvas, doc):
+        canvas.saveState()
+        width, _ = letter
+        canvas.setLineWidth(0.4)
+        canvas.line(inch, 0.85 * inch, width - inch, 0.85 * inch)
+        if os.path.exists(logo_path):
+            canvas.drawImage(logo_path, inch, 0.45 * inch, height=0.8 * 28.35, width=0.8 * 28.35, preserveAspectRatio=True, mask="auto")
+        canvas.setFont("Helvetica", 9)
+        canvas.drawRightString(width - inch, 0.55 * inch, f"Page {doc.page}")
+        canvas.restoreState()
+
+    buf = io.BytesIO()
+    doc = SimpleDocTemplate(buf, pagesize=letter, leftMargin=inch, rightMargin=inch, topMargin=inch, bottomMargin=inch)
+    doc.build(story or [Spacer(1, 1)], onFirstPage=footer, onLaterPages=footer)
+    return buf.getvalue()
+
+
+def render_pdf(content: str, template_dir: str) -> bytes:
+    """Runs in the export pool: reportlab for plain markdown, pandoc/LaTeX for the rest."""
+    has_pandoc = bool(shutil.which("pandoc") and shutil.which("pdflatex"))
+    if needs_latex(content) and has_pandoc:
+        return render_pandoc(content, template_dir)
+    try:
+        return render_reportlab(content)
+    except ValueError:
+        # reportlab rejected the paragraph markup: let pandoc try, else drop the inline formatting
+        if has_pandoc:
+            return render_pandoc(content, template_dir)
+        return render_reportlab(content, markup=False)
+
+
+def render_pdf_file(md_path: str, template_dir: str) -> str:
+    """Like render_pdf, but markdown comes from and the PDF goes to disk; returns the PDF path."""
+    with open(md_path, encoding="utf-8") as f:
+        content = strip_emoji(f.read())
+    pdf_path = os.path.splitext(md_path)[0] + ".pdf"
+    with open(pdf_path, "wb") as f:
+        f.write(render_pdf(content, template_dir))
+    return pdf_path
+
+
+_export_pool = None
+_template_dir = None
+_inflight = {}
+
+
+def get_export_pool():
+    global _export_pool
+    if _export_pool is None:
+        ctx = multiprocessing.get_context("spawn" if os.name == "nt" else "forkserver")
+        _export_pool = ProcessPoolExecutor(max_workers=PDF_EXPORT_WORKERS, mp_context=ctx)
+    return _export_pool
+
+
+def shutdown_export_pool():
+    global _export_pool
+    if _export_pool is not None:
+        _export_pool.shutdown(wait=False, cancel_futures=True)
+        _export_pool = None
+
+
+async def _get_template_dir() -> str:
+    global _template_dir
+    if _template_dir is None:
+        _template_dir = await asyncio.to_thread(prepare_template_dir)
+    return _template_dir
+
+
+async def export_pdf_file(md_path: str) -> str:
+    """Render a markdown file next to itself in the export pool (no caching); returns the PDF path."""
+    template_dir = await _get_template_dir()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_export_pool(), render_pdf_file, md_path, template_dir)
+
+
+async def export_pdf_bytes(content: str) -> bytes:
+    """Cached, de-duplicated PDF for `content`, rendered in the export pool."""
+    content = strip_emoji(content)
+    key = hashlib.sha256(f"{RENDERER_VERSION}\0{content}".encode("utf-8")).hexdigest()
+    pdf = pdf_cache.get(key)
+    if pdf is not None:
+        return pdf
+    template_dir = await _get_template_dir()
+    task = _inflight.get(key)
+    if task is None:
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(loop.run_in_executor(get_export_pool(), render_pdf, content, template_dir))
+        _inflight[key] = task
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+    # Shielded: a caller that disconnects must not cancel the render other callers wait on
+    pdf = await asyncio.shield(task)
+    pdf_cache.set(key, pdf)
+    return pdf
@@ -0,0 +1,97 @@
+import java.io.BufferedReader;
+import java.io.ByteArrayInputStream;
+import java.io.File;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.nio.charset.StandardCharsets;
+import javax.tools.JavaCompiler;
+import javax.tools.ToolProvider;
+
+/**
+ * Long-lived JVM for /run_code. Reads one tab-separated command per line on stdin:
+ *
+ *   compile TOKEN SOURCE_FILE CLASS_DIR
+ *   run     TOKEN CLASS_DIR
+ *
+ * Program output goes straight to this process's stdout/stderr. When a command
+ * finishes, SENTINEL + TOKEN is written to stderr and SENTINEL + "TOKEN CODE CLEAN"
+ * to stdout; CLEAN is 0 when the program left threads running and this JVM
+ * should be retired. A compile on a JRE without javac ends with
+ * SENTINEL + "TOKEN unavailable" instead, so the caller compiles cold. A
+ * program calling System.exit ends the JVM, exactly as it would a cold one.
+ */
+public class WarmRunner {
+    static final String SENTINEL = "\u0000__WARM_RUNNER__";
+
+    public static void main(String[] args) throws Exception {
+        PrintStream out = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        PrintStream err = new PrintStream(new FileOutputStream(FileDescriptor.err), true, "UTF-8");
+        System.setOut(out);
+        System.setErr(err);
+        BufferedReader commands = new BufferedReader(new InputStreamReader(System.in, StandardCharsets.UTF_8));
+        // Programs must not read the command channel
+        System.setIn(new ByteArrayInputStream(new byte[0]));
+
+        JavaCompiler compiler = ToolProvider.getSystemJavaCompiler();
+        int baseline = Thread.activeCount();
+        String line;
+        while ((line = commands.readLine()) != null) {
+            String[] parts = line.split("\t");
+            if (parts.length < 3) {
+                continue;
+            }
+            String token = parts[1];
+            if (parts[0].equals("compile") && compiler == null) {
+                finish(out, err, token, "unavailable");
+                continue;
+            }
+            int code;
+            if (parts[0].equals("compile")) {
+                code = compiler.run(null, out, err, "-d", parts[3], parts[2]);
+            } else {
+                code = run(parts[2], err);
+            }
+            boolean clean = Thread.activeCount() <= baseline;
+            finish(out, err, token, code + " " + (clean ? 1 : 0));
+        }
+    }
+
+    static void finish(PrintStream out, PrintStream err, String token, String status) {
+        out.flush();
+        err.print(SENTINEL + token + "\n");
+        err.flush();
+        out.print(SENTINEL + token + " " + status + "\n");
+        out.flush();
+    }
+
+    static int run(String classDir, PrintStream err) throws Exception {
+        // Fresh loader per program so static state never carries over
+        URLClassLoader loader = new URLClassLoader(
+            new URL[] {new File(classDir).toURI().toURL()}, ClassLoader.getPlatformClassLoader());
+        int[] code = {0};
+        Thread main = new Thread(() -> {
+            try {
+                Method entry = Class.forName("Main", true, loader).getMethod("main", String[].class);
+                entry.invoke(null, (Object) new String[0]);
+            } catch (InvocationTargetException e) {
+                err.print("Exception in thread \"main\" ");
+                e.getCause().printStackTrace(err);
+                code[0] = 1;
+            } catch (Throwable e) {
+                e.printStackTrace(err);
+                code[0] = 1;
+            }
+        }, "main");
+        main.setContextClassLoader(loader);
+        main.start();
+        main.join();
+        loader.close();
+        return code[0];
+    }
+}
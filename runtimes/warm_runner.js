@@ -0,0 +1,59 @@
+// Long-lived Node process for /run_code. Reads one tab-separated command per
+// line on stdin ("run TOKEN FILE") and runs FILE in a fresh worker thread, so
+// V8 and the core modules are already warm but no state is shared between
+// programs. Output is relayed to this process's stdout/stderr; when a program
+// finishes, SENTINEL + TOKEN goes to stderr and SENTINEL + "TOKEN CODE 1" to stdout.
+const readline = require("readline");
+const { Worker } = require("worker_threads");
+
+const SENTINEL = "\u0000__WARM_RUNNER__";
+const pending = [];
+let busy = false;
+
+function finish(token, code) {
+  process.stderr.write(`${SENTINEL}${token}\n`, () => {
+    process.stdout.write(`${SENTINEL}${token} ${code} 1\n`, () => {
+      busy = false;
+      next();
+    });
+  });
+}
+
+function next() {
+  if (busy || pending.length === 0) return;
+  busy = true;
+  const [, token, file] = pending.shift().split("\t");
+  let code = 0;
+  let remaining = 3; // stdout end, stderr end, exit
+
+  const done = () => {
+    remaining -= 1;
+    if (remaining === 0) finish(token, code);
+  };
+
+  let worker;
+  try {
+    worker = new Worker(file, { stdout: true, stderr: true, stdin: false, argv: [] });
+  } catch (e) {
+    process.stderr.write(`${e && e.stack ? e.stack : e}\n`);
+    finish(token, 1);
+    return;
+  }
+  worker.stdout.on("data", (chunk) => process.stdout.write(chunk));
+  worker.stderr.on("data", (chunk) => process.stderr.write(chunk));
+  worker.stdout.on("end", done);
+  worker.stderr.on("end", done);
+  worker.on("error", (e) => {
+    process.stderr.write(`${e && e.stack ? e.stack : e}\n`);
+    code = 1;
+  });
+  worker.on("exit", (exitCode) => {
+    code = code || exitCode;
+    done();
+  });
+}
+
+readline.createInterface({ input: process.stdin }).on("line", (line) => {
+  pending.push(line);
+  next();
+});
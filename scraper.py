@@ -5,6 +5,11 @@ import aiohttp
 import certifi
 import asyncio
 import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import aclosing
+from hashlib import sha256
+from html.parser import HTMLParser
 from aiohttp import ClientSession, TCPConnector
 from bs4 import BeautifulSoup
 from openai import OpenAI
@@ -15,15 +20,71 @@ try:
 except Exception:
     DDGS = None
 
+from functools import lru_cache
 from tiktoken import get_encoding
 
+from cache import TTLCache
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    """cl100k_base is loaded once per process."""
+    return get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text):
+    """Token count, memoized so repeated pages and history turns are encoded once."""
+    return len(get_tokenizer().encode(text))
+
+
+def truncate_to_tokens(text, max_tokens):
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    enc = get_tokenizer()
+    return enc.decode(enc.encode(text)[:max_tokens])
+
 
 def truncate_prompt_text(prompt_text, max_tokens=24000):
-    enc = get_encoding("cl100k_base")
-    tokens = enc.encode(prompt_text)
-    if len(tokens) > max_tokens:
-        tokens = tokens[:max_tokens]
-    return enc.decode(tokens)
+    return truncate_to_tokens(prompt_text, max_tokens)
+
+
+def fair_share(sizes, budget):
+    """
+    Split `budget` across items so small items keep everything they need and the
+    remainder is shared evenly by the larger ones (max-min fairness).
+    """
+    alloc = [0] * len(sizes)
+    remaining = budget
+    order = sorted(range(len(sizes)), key=lambda i: sizes[i])
+    for pos, i in enumerate(order):
+        share = remaining // (len(order) - pos)
+        alloc[i] = min(sizes[i], share)
+        remaining -= alloc[i]
+    return alloc
+
+
+def build_sources_prompt(results, max_tokens=24000):
+    """
+    Render scraped results as "[#n](url)" sections within max_tokens, giving each
+    source a fair share of the budget instead of cutting off the last ones.
+    """
+    headers = [f"[#{i+1}]({res['url']})\n" for i, res in enumerate(results)]
+    contents = [f"{res.get('content') or '<No content>'}\n" for res in results]
+    header_tokens = [count_tokens(h) for h in headers]
+    content_tokens = [count_tokens(c) for c in contents]
+
+    # One token of slack per section for the "\n" joins
+    content_budget = max_tokens - sum(header_tokens) - len(results)
+    if sum(content_tokens) > content_budget:
+        allowed = fair_share(content_tokens, max(content_budget, 0))
+        contents = [
+            c if n <= a else truncate_to_tokens(c, a)
+            for c, n, a in zip(contents, content_tokens, allowed)
+        ]
+    return "\n".join(h + c for h, c in zip(headers, contents))
 
 
 # --- Configuration Variables ---
@@ -117,8 +178,36 @@ def _ddg_search_query(query, max_results):
         return []
 
 
+# Two-level cache: search query -> links, and URL -> extracted page text.
+# SCRAPE_CACHE_DIR enables the on-disk backend so entries survive restarts.
+SCRAPE_CACHE_DIR = os.getenv("SCRAPE_CACHE_DIR")
+if SCRAPE_CACHE_DIR:
+    os.makedirs(SCRAPE_CACHE_DIR, exist_ok=True)
+_scrape_cache_db = os.path.join(SCRAPE_CACHE_DIR, "scrape_cache.db") if SCRAPE_CACHE_DIR else None
+
+search_cache = TTLCache(
+    "search_links",
+    ttl=int(os.getenv("SEARCH_CACHE_TTL", "900")),
+    stale_ttl=int(os.getenv("SEARCH_CACHE_STALE_TTL", "3600")),
+    max_bytes=int(os.getenv("SEARCH_CACHE_MAX_BYTES", str(4 * 1024 * 1024))),
+    disk_path=_scrape_cache_db,
+)
+page_cache = TTLCache(
+    "page_content",
+    ttl=int(os.getenv("PAGE_CACHE_TTL", "3600")),
+    stale_ttl=int(os.getenv("PAGE_CACHE_STALE_TTL", "21600")),
+    max_bytes=int(os.getenv("PAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    disk_path=_scrape_cache_db,
+)
+
+
 def get_search_links(query, num_links=NUM_LINKS):
-    """Fetches search links using DuckDuckGo (DDGS) only."""
+    """Fetches search links using DuckDuckGo (DDGS), served from search_cache when possible."""
+    key = f"{num_links}:{query.strip().lower()}"
+    return search_cache.get_or_load(key, lambda: _fetch_search_links(query, num_links))
+
+
+def _fetch_search_links(query, num_links):
     print(f"Fetching {num_links} links for query: '{query}' using DDGS...")
 
     links = []
@@ -139,8 +228,120 @@ def get_search_links(query, num_links=NUM_LINKS):
     return links[:num_links]
 
 
-async def extract_content_from_url(url, session, timeout=10):
-    """Asynchronously fetches and extracts paragraph text from a single URL."""
+class _ParagraphParser(HTMLParser):
+    """Collects <p> text while parsing and flags when enough has been gathered."""
+
+    SKIP_TAGS = {"script", "style", "noscript", "template"}
+
+    def __init__(self, limit_chars):
+        super().__init__(convert_charrefs=True)
+        self.limit_chars = limit_chars
+        self.paragraphs = []
+        self.total = 0
+        self.done = False
+        self._current = None
+        self._text = []
+        self._p_depth = 0
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        self._flush_text()
+        if tag in self.SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag == "p":
+            if self._p_depth == 0:
+                self._current = []
+            self._p_depth += 1
+
+    def handle_endtag(self, tag):
+        if self.done:
+            return
+        self._flush_text()
+        if tag in self.SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag == "p" and self._p_depth:
+            self._p_depth -= 1
+            if self._p_depth == 0:
+                self._close_paragraph()
+
+    def handle_data(self, data):
+        # A text node can arrive in pieces when it spans two feed() chunks, so it
+        # is only stripped once the next tag ends it.
+        if self._p_depth and not self._skip_depth and not self.done:
+            self._text.append(data)
+
+    def _flush_text(self):
+        if self._text:
+            text = "".join(self._text).strip()
+            self._text.clear()
+            if text:
+                self._current.append(text)
+
+    def _close_paragraph(self):
+        text = "".join(self._current)
+        self._current = None
+        self.paragraphs.append(text)
+        self.total += len(text) + 1
+        # Keep one char past the limit so callers still append the "…" marker
+        if self.limit_chars and self.total > self.limit_chars:
+            self.done = True
+
+    def close(self):
+        super().close()
+        if self._p_depth and not self.done:
+            self._flush_text()
+            self._p_depth = 0
+            self._close_paragraph()
+
+
+def extract_paragraphs(html, limit_chars=LINK_CHAR_LIMIT, chunk_size=8192):
+    """Default extractor: streams the page through HTMLParser and stops once limit_chars is reached."""
+    parser = _ParagraphParser(limit_chars)
+    for start in range(0, len(html), chunk_size):
+        parser.feed(html[start:start + chunk_size])
+        if parser.done:
+            break
+    else:
+        parser.close()
+    return "\n".join(parser.paragraphs)
+
+
+def extract_paragraphs_bs4(html, limit_chars=None):
+    """Original BeautifulSoup extractor, kept for comparison."""
+    soup = BeautifulSoup(html, "html.parser")
+    return "\n".join(p.get_text(strip=True) for p in soup.find_all("p"))
+
+
+EXTRACTORS = {
+    "stream": extract_paragraphs,
+    "bs4": extract_paragraphs_bs4,
+}
+SCRAPE_EXTRACTOR = os.getenv("SCRAPE_EXTRACTOR", "stream")
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", "0")) or None
+
+_extract_pool = None
+
+
+def get_extract_pool():
+    """Process pool for HTML parsing so CPU-bound extraction never runs on the event loop."""
+    global _extract_pool
+    if _extract_pool is None:
+        ctx = multiprocessing.get_context("spawn" if os.name == "nt" else "forkserver")
+        _extract_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=ctx)
+    return _extract_pool
+
+
+def shutdown_extract_pool():
+    global _extract_pool
+    if _extract_pool is not None:
+        _extract_pool.shutdown(wait=False, cancel_futures=True)
+        _extract_pool = None
+
+
+async def extract_content_from_url(url, session, timeout=10, limit_chars=LINK_CHAR_LIMIT, extractor=None):
+    """Asynchronously fetches a URL and extracts its paragraph text in the extract pool."""
     headers = random.choice(HEADERS_LIST)
     try:
         async with session.get(url, headers=headers, timeout=timeout) as resp:
@@ -151,37 +352,107 @@ async def extract_content_from_url(url, session, timeout=10):
     except Exception as e:
         print(f"Error scraping {url}: {e}")
         return None
-    
-    soup = BeautifulSoup(html, "html.parser")
-    return "\n".join(p.get_text(strip=True) for p in soup.find_all("p"))
 
-from hashlib import sha256
-async def scrape_links_content_async(links, limit_chars=LINK_CHAR_LIMIT):
-    ssl_ctx = ssl.create_default_context(cafile=certifi.where())
-    connector = TCPConnector(ssl=ssl_ctx)
-    timeout = aiohttp.ClientTimeout(total=15)
-    results = []
-
-    async with ClientSession(connector=connector, timeout=timeout) as session:
-        tasks = [extract_content_from_url(url, session) for url in links]
-        contents = await asyncio.gather(*tasks, return_exceptions=True)
-
-    seen_hashes = set()
-    for url, content in zip(links, contents):
-        # Skip errors or empty content
-        if isinstance(content, Exception) or not content:
-            continue
-
-        # Deduplicate content
-        h = sha256(content.encode('utf-8')).hexdigest()
-        if h in seen_hashes:
-            continue
-        seen_hashes.add(h)
-
-        snippet = (content[:limit_chars] + "…" if len(content) > limit_chars else content)
-        results.append({"url": url, "content": snippet})
-    
-    return results
+    extractor = extractor or EXTRACTORS.get(SCRAPE_EXTRACTOR, extract_paragraphs)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(get_extract_pool(), extractor, html, limit_chars)
+    except Exception as e:
+        print(f"Error extracting {url}: {e}")
+        return None
+
+
+def _snippet(content, limit_chars):
+    return content[:limit_chars] + "…" if len(content) > limit_chars else content
+
+
+class ScrapeEngine:
+    """
+    Long-lived scraper for one worker. Keeps a single aiohttp session (and so one
+    DNS cache and TLS connection pool) across searches, caps concurrent
+    connections per host, and yields pages as soon as each one finishes.
+    """
+
+    def __init__(self, per_host_limit=2, total_limit=64, timeout=15):
+        self.per_host_limit = per_host_limit
+        self.total_limit = total_limit
+        self.timeout = timeout
+        self._session = None
+        self._loop = None
+
+    def _get_session(self):
+        # Must be called from the loop that will use the session.
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            ssl_ctx = ssl.create_default_context(cafile=certifi.where())
+            connector = TCPConnector(
+                ssl=ssl_ctx,
+                limit=self.total_limit,
+                limit_per_host=self.per_host_limit,
+                ttl_dns_cache=300,
+                keepalive_timeout=30,
+            )
+            self._session = ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._loop = loop
+        return self._session
+
+    async def stream(self, links, limit_chars=LINK_CHAR_LIMIT):
+        """Yield (rank, {"url", "content"}) in completion order, skipping failures and duplicates."""
+        session = self._get_session()
+
+        async def fetch(rank, url):
+            content = await page_cache.aget_or_load(
+                f"{limit_chars}:{url}",
+                lambda: extract_content_from_url(url, session, limit_chars=limit_chars),
+            )
+            return rank, url, content
+
+        tasks = [asyncio.ensure_future(fetch(rank, url)) for rank, url in enumerate(links)]
+        seen_hashes = set()
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                try:
+                    rank, url, content = await next_done
+                except Exception as e:
+                    print(f"Error scraping link: {e}")
+                    continue
+                if not content:
+                    continue
+                h = sha256(content.encode('utf-8')).hexdigest()
+                if h in seen_hashes:
+                    continue
+                seen_hashes.add(h)
+                yield rank, {"url": url, "content": _snippet(content, limit_chars)}
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def collect(self, links, limit_chars=LINK_CHAR_LIMIT, enough=None):
+        """
+        Gather scraped pages in search-rank order. With `enough`, return as soon as
+        that many pages have arrived and cancel the stragglers.
+        """
+        ranked = []
+        async with aclosing(self.stream(links, limit_chars)) as pages:
+            async for rank, result in pages:
+                ranked.append((rank, result))
+                if enough and len(ranked) >= enough:
+                    break
+        return [result for _, result in sorted(ranked, key=lambda item: item[0])]
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+# One engine per worker process; main.py closes it on shutdown.
+scrape_engine = ScrapeEngine()
+
+
+async def scrape_links_content_async(links, limit_chars=LINK_CHAR_LIMIT, enough=None):
+    return await scrape_engine.collect(links, limit_chars, enough=enough)
 
 
 def get_content_from_links(links, limit_chars=LINK_CHAR_LIMIT):
@@ -191,7 +462,16 @@ def get_content_from_links(links, limit_chars=LINK_CHAR_LIMIT):
         return []
 
     print(f"Scraping content from {len(links)} links...")
-    scraped_data = asyncio.run(scrape_links_content_async(links, limit_chars))
+
+    async def run_once():
+        # asyncio.run() makes a fresh loop, so this path cannot reuse the shared session.
+        engine = ScrapeEngine()
+        try:
+            return await engine.collect(links, limit_chars)
+        finally:
+            await engine.close()
+
+    scraped_data = asyncio.run(run_once())
     print("Scraping complete.")
     return scraped_data
 
@@ -0,0 +1,332 @@
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import httpx
+
+from cache import TTLCache
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase")  # "supabase" or "local"
+STORAGE_BUCKET = os.getenv("STORAGE_BUCKET", "nexora-ai")
+STORAGE_LOCAL_DIR = os.getenv("STORAGE_LOCAL_DIR", "./storage")
+# Prefix for local file URLs; empty keeps them relative to this server (/files/...).
+STORAGE_PUBLIC_URL = os.getenv("STORAGE_PUBLIC_URL", "").rstrip("/")
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "8"))
+UPLOAD_TIMEOUT = float(os.getenv("UPLOAD_TIMEOUT", "60"))
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+# "bucket/<sha256><ext>" -> public URL of an object we already stored
+uploaded_objects = TTLCache(
+    "uploaded_objects",
+    ttl=int(os.getenv("UPLOAD_DEDUP_TTL", str(24 * 3600))),
+    max_bytes=8 * 1024 * 1024,
+)
+
+
+def _mime_type(name: str) -> str:
+    mime_type, _ = mimetypes.guess_type(name)
+    return mime_type or "application/octet-stream"
+
+
+def file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _file_chunks(path: Path):
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            yield chunk
+
+
+OBJECT_NAME_RE = re.compile(r"^[0-9a-f]{64}(\.[A-Za-z0-9]{1,10})?$")
+BUCKET_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def normalize_extension(extension: str) -> str:
+    """".JPEG" -> ".jpeg", ".my-ext~" -> ".myext"; "" when nothing usable is left."""
+    ext = re.sub(r"[^A-Za-z0-9]", "", extension or "").lower()[:10]
+    return f".{ext}" if ext else ""
+
+
+def with_download_name(url: str, filename: str) -> str:
+    """
+    Content-addressed names lose the original filename, so it rides along as
+    ?download=<name>: Supabase public URLs and the /files route both answer it
+    with a Content-Disposition carrying that name.
+    """
+    return f"{url}?{urllib.parse.urlencode({'download': filename}, quote_via=urllib.parse.quote)}"
+
+
+def content_disposition(filename: str) -> str:
+    filename = os.path.basename(filename.replace("\\", "/"))
+    fallback = re.sub(r'[^A-Za-z0-9._ -]', "_", filename) or "download"
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{urllib.parse.quote(filename, safe='')}"
+
+
+# Stored files are user and model output served from the app's own origin: only
+# these render inline, everything else is forced to download.
+INLINE_SAFE_TYPES = {"image/png", "image/jpeg", "image/gif", "image/webp", "text/plain", "text/csv"}
+
+
+def serving_headers(name: str, download: str | None = None) -> dict:
+    """
+    Content-Type plus headers that keep a stored object from running script on
+    the app's origin (a generated .html or .svg would otherwise render inline).
+    """
+    media_type = _mime_type(name)
+    headers = {
+        "Content-Type": media_type,
+        "X-Content-Type-Options": "nosniff",
+        "Content-Security-Policy": "sandbox",
+    }
+    if download or media_type not in INLINE_SAFE_TYPES:
+        headers["Content-Disposition"] = content_disposition(download or name)
+    return headers
+
+
+class StorageBackend:
+    """Where uploaded images and exec outputs are stored. `name` is always "<sha256><ext>"."""
+
+    def put(self, name: str, body, size: int, bucket: str) -> str:
+        """Store `body` (bytes or an iterator of chunks) and return its public URL."""
+        raise NotImplementedError
+
+    def put_file(self, name: str, path: Path, bucket: str) -> str:
+        return self.put(name, _file_chunks(path), path.stat().st_size, bucket)
+
+    def close(self):
+        pass
+
+
+class SupabaseBackend(StorageBackend):
+    """Supabase storage REST API over one pooled HTTP client."""
+
+    def __init__(self, max_connections=UPLOAD_WORKERS, timeout=UPLOAD_TIMEOUT):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> httpx.Client:
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(
+                    timeout=httpx.Timeout(self.timeout, connect=10.0),
+                    limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                )
+            return self._client
+
+    @staticmethod
+    def _config():
+        supabase_url = os.getenv("SUPABASE_URL")
+        supabase_key = os.getenv("SUPABASE_KEY")
+        if not supabase_url or not supabase_key:
+            raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
+        return supabase_url.rstrip("/"), supabase_key
+
+    def put(self, name, body, size, bucket):
+        supabase_url, supabase_key = self._config()
+        headers = {
+            "apikey": supabase_key,
+            "Authorization": f"Bearer {supabase_key}",
+            "Content-Type": _mime_type(name),
+            "Content-Length": str(size),
+        }
+        response = self.client.post(f"{supabase_url}/storage/v1/object/{bucket}/{name}", content=body, headers=headers)
+        # Same name means same content, so an existing object is as good as a new one
+        duplicate = response.status_code == 409 or (response.status_code == 400 and "Duplicate" in response.text)
+        if response.status_code not in (200, 201) and not duplicate:
+            raise Exception(f"Upload failed with status code {response.status_code}: {response.text}")
+        return f"{supabase_url}/storage/v1/object/public/{bucket}/{name}"
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+class LocalBackend(StorageBackend):
+    """
+    Content-addressed files on local disk, sharded as <root>/<bucket>/ab/cd/<name>
+    so no directory grows huge, and served by this app's /files route. Files
+    are written to a temp file and renamed into place, so readers never see
+    partial content.
+    """
+
+    def __init__(self, root=STORAGE_LOCAL_DIR, public_url=STORAGE_PUBLIC_URL):
+        self.root = Path(root)
+        self.public_url = public_url
+
+    def path_for(self, bucket: str, name: str) -> Path | None:
+        """On-disk path for an object, or None if the bucket/name is not one we could have written."""
+        if not BUCKET_RE.match(bucket) or not OBJECT_NAME_RE.match(name):
+            return None
+        return self.root / bucket / name[:2] / name[2:4] / name
+
+    def url_for(self, bucket: str, name: str) -> str:
+        return f"{self.public_url}/files/{bucket}/{name}"
+
+    def _store(self, name, bucket, write):
+        path = self.path_for(bucket, name)
+        if path is None:
+            raise ValueError(f"Invalid object name: {bucket}/{name}")
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    write(f)
+                os.replace(tmp, path)
+            except BaseException:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+                raise
+        return self.url_for(bucket, name)
+
+    def put(self, name, body, size, bucket):
+        def write(f):
+            if isinstance(body, (bytes, bytearray, memoryview)):
+                f.write(body)
+            else:
+                for chunk in body:
+                    f.write(chunk)
+        return self._store(name, bucket, write)
+
+    def put_file(self, name, path, bucket):
+        # copyfileobj between real files goes through sendfile/copy_file_range on Linux
+        def write(f):
+            with path.open("rb") as src:
+                shutil.copyfileobj(src, f)
+        return self._store(name, bucket, write)
+
+
+def parse_byte_range(header: str, size: int):
+    """
+    (start, end) inclusive for a single "bytes=" range, or None when the header
+    should be ignored (multiple ranges, other units). Raises ValueError when the
+    range cannot be satisfied.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        start = int(first) if first else None
+        end = int(last) if last else None
+    except ValueError:
+        return None
+    if start is None:
+        if end is None:
+            return None
+        # Suffix range: the last N bytes
+        if end <= 0 or size == 0:
+            raise ValueError(header)
+        return max(size - end, 0), size - 1
+    if end is None:
+        end = size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+def iter_file_range(path: Path, start: int, end: int, chunk_size=UPLOAD_CHUNK_SIZE):
+    with path.open("rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+
+
+def make_backend(kind=STORAGE_BACKEND) -> StorageBackend:
+    if kind == "local":
+        return LocalBackend()
+    if kind == "supabase":
+        return SupabaseBackend()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {kind}")
+
+
+class StorageUploader:
+    """
+    Front end for the configured storage backend. Objects are named by the
+    sha256 of their content, so identical outputs are stored once and a repeat
+    upload is skipped. File bodies are streamed from disk, never read whole, and
+    batches of files are uploaded concurrently.
+    """
+
+    def __init__(self, backend: StorageBackend | None = None, workers=UPLOAD_WORKERS):
+        self.backend = backend or make_backend()
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="upload")
+            return self._executor
+
+    def _upload(self, digest, extension, bucket, put):
+        name = f"{digest}{normalize_extension(extension)}"
+        key = f"{bucket}/{name}"
+        url = uploaded_objects.get(key)
+        if url is None:
+            url = put(name)
+            uploaded_objects.set(key, url)
+        return url
+
+    def upload_bytes(self, data: bytes, extension: str = ".png", bucket: str = STORAGE_BUCKET) -> str:
+        """Upload raw bytes and return the public URL."""
+        return self._upload(
+            hashlib.sha256(data).hexdigest(), extension, bucket,
+            lambda name: self.backend.put(name, data, len(data), bucket),
+        )
+
+    def upload_file(self, path, bucket: str = STORAGE_BUCKET) -> str:
+        """Upload a file, streaming it from disk, and return a public URL that downloads under its original name."""
+        path = Path(path)
+        if not path.is_file():
+            raise FileNotFoundError(f"File not found: {path}")
+        url = self._upload(
+            file_digest(path), path.suffix, bucket,
+            lambda name: self.backend.put_file(name, path, bucket),
+        )
+        return with_download_name(url, path.name)
+
+    def upload_files(self, paths, bucket: str = STORAGE_BUCKET):
+        """Upload files concurrently; yields (path, url, error) in completion order."""
+        futures = {self.executor.submit(self.upload_file, path, bucket): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+        self.backend.close()
+
+
+uploader = StorageUploader()
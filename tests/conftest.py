@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Must happen before db/main are imported: importing main migrates DATABASE_URL
+# and builds one LLM client per key.
+os.environ["DATABASE_URL"] = os.path.join(tempfile.mkdtemp(prefix="nexora-tests-"), "chat_history.db")
+for i in (1, 2):
+    os.environ.setdefault(f"key{i}", f"test-key-{i}")
+
+
+@pytest.fixture
+def fresh_db(tmp_path, monkeypatch):
+    """A migrated, empty database in tmp_path with its own write-behind queue."""
+    import db
+
+    db.close_all()
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "chat_history.db"))
+    monkeypatch.setattr(db, "write_queue", db.WriteBehindQueue())
+    db.migrate()
+    yield db
+    db.close_all()
+
+
+@pytest.fixture
+def user_id(fresh_db):
+    return fresh_db.create_user("tester", "tester@example.com", "x", None)
@@ -0,0 +1,145 @@
+import asyncio
+import pickle
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import cache
+from cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "time", clock)
+    return clock
+
+
+def test_fresh_stale_and_expired(clock):
+    c = TTLCache("t_states", ttl=10, stale_ttl=20, max_bytes=1024)
+    assert c.get_entry("k") == (None, "miss")
+    c.set("k", "v")
+    assert c.get_entry("k") == ("v", "fresh")
+    clock.now += 15
+    assert c.get_entry("k") == ("v", "stale")
+    clock.now += 20
+    assert c.get_entry("k") == (None, "miss")
+    assert c.stats() == {
+        "entries": 0, "bytes": 0, "max_bytes": 1024, "hits": 1, "stale_hits": 1, "misses": 2, "evictions": 0,
+    }
+
+
+def test_lru_eviction_respects_the_byte_budget(clock):
+    c = TTLCache("t_lru", ttl=10, max_bytes=10)
+    c.set("a", "aaaa")
+    c.set("b", "bbbb")
+    c.get("a")                  # "b" is now least recently used
+    c.set("c", "cccc")
+    assert c.get("b") is None
+    assert c.get("a") == "aaaa" and c.get("c") == "cccc"
+    assert c.stats()["evictions"] == 1
+    c.set("huge", "x" * 11)     # larger than the whole budget: not cached
+    assert c.get("huge") is None
+
+
+def test_stale_entry_is_served_while_it_refreshes(clock):
+    c = TTLCache("t_swr", ttl=10, stale_ttl=60, max_bytes=1024)
+    c.set("k", "old")
+    clock.now += 30
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        release.wait(5)
+        return "new"
+
+    assert c.get_or_load("k", loader) == "old"
+    assert c.get_or_load("k", loader) == "old"   # refresh already in flight
+    release.set()
+    for _ in range(100):
+        if c.get_entry("k") == ("new", "fresh"):
+            break
+        time.sleep(0.01)
+    assert c.get_entry("k") == ("new", "fresh")
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_async_stale_while_revalidate(clock):
+    c = TTLCache("t_aswr", ttl=10, stale_ttl=60, max_bytes=1024)
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        await asyncio.sleep(0)
+        return f"v{len(loads)}"
+
+    assert await c.aget_or_load("k", loader) == "v1"
+    assert await c.aget_or_load("k", loader) == "v1"
+    clock.now += 30
+    assert await c.aget_or_load("k", loader) == "v1"
+    await asyncio.gather(*c._tasks)
+    assert await c.aget_or_load("k", loader) == "v2"
+    assert len(loads) == 2
+
+
+def test_failed_loads_are_not_cached(clock):
+    c = TTLCache("t_empty", ttl=10, max_bytes=1024)
+    assert c.get_or_load("q", lambda: []) == []
+    assert c.get_or_load("q", lambda: ["link"]) == ["link"]
+    assert c.get_or_load("q", lambda: ["other"]) == ["link"]
+
+
+def test_disk_backend_survives_restart(clock, tmp_path):
+    path = str(tmp_path / "cache.db")
+    TTLCache("t_disk", ttl=10, stale_ttl=10, max_bytes=1024, disk_path=path).set("k", {"a": [1, 2]})
+    reopened = TTLCache("t_disk", ttl=10, stale_ttl=10, max_bytes=1024, disk_path=path)
+    assert reopened.get_entry("k") == ({"a": [1, 2]}, "fresh")
+    clock.now += 25
+    assert TTLCache("t_disk", ttl=10, stale_ttl=10, max_bytes=1024, disk_path=path).get("k") is None
+
+
+def test_disk_backend_evicts_least_recently_used(clock, tmp_path):
+    path = str(tmp_path / "cache.db")
+    c = TTLCache("t_disk_lru", ttl=60, max_bytes=10_000, disk_path=path, disk_max_bytes=3_500)
+    for key in ("a", "b", "c"):
+        c.set(key, "x" * 1000)
+        clock.now += 1
+    c._data.clear()                      # force reads through to disk
+    assert c.get("a") is not None        # "a" is now more recent than "b"
+    c.set("d", "x" * 1000)
+    stats = c.stats()
+    assert stats["disk_evictions"] == 1 and stats["disk_bytes"] <= 3_500
+    c._data.clear()
+    assert [k for k in "abcd" if c.get(k) is not None] == ["a", "c", "d"]
+
+
+def test_disk_backend_upgrades_files_without_sizes(clock, tmp_path):
+    path = str(tmp_path / "cache.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE cache_entries (name TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, "
+        "stored_at REAL NOT NULL, PRIMARY KEY (name, key))"
+    )
+    conn.execute("INSERT INTO cache_entries VALUES ('t_disk_old', 'k', ?, ?)", (pickle.dumps("v"), clock.now))
+    conn.commit()
+    conn.close()
+    c = TTLCache("t_disk_old", ttl=60, max_bytes=1024, disk_path=path)
+    assert c.get("k") == "v"
+    assert c.stats()["disk_bytes"] == len(pickle.dumps("v"))
+
+
+def test_all_stats_lists_registered_caches():
+    TTLCache("t_registered", ttl=1, max_bytes=1)
+    assert "t_registered" in cache.all_stats()
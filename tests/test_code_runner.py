@@ -0,0 +1,156 @@
+import asyncio
+import sys
+import time
+
+import pytest
+import pytest_asyncio
+
+from code_runner import ExecutionEngine, QueueFullError
+from warm_runtimes import RuntimePool, WarmRuntime
+
+# Speaks the warm runner protocol; `compile` answers according to the mode
+FAKE_RUNNER = """
+import sys
+SENTINEL = "\\x00__WARM_RUNNER__"
+mode, log = sys.argv[1], sys.argv[2]
+for line in sys.stdin:
+    command, token = line.rstrip("\\n").split("\\t")[:2]
+    with open(log, "a") as f:
+        f.write(command + "\\n")
+    if command == "compile" and mode == "exit":
+        sys.exit(1)
+    if command == "compile":
+        status = {"unavailable": "unavailable", "garbled": "?!"}[mode]
+    else:
+        print("ran")
+        status = "0 1"
+    sys.stdout.flush()
+    sys.stderr.write(SENTINEL + token + "\\n")
+    sys.stderr.flush()
+    sys.stdout.write(SENTINEL + token + " " + status + "\\n")
+    sys.stdout.flush()
+"""
+
+
+async def run(engine, code, language="python", user_id=None):
+    job = await engine.submit(language, code, user_id)
+    return await job.result()
+
+
+@pytest_asyncio.fixture
+async def engine():
+    engine = ExecutionEngine(workers=2, queue_size=4, per_user=2, timeout=5)
+    engine.warm = False
+    yield engine
+    await engine.close()
+
+
+@pytest.mark.asyncio
+async def test_output_line_longer_than_the_stream_limit(engine):
+    result = await run(engine, 'print("x" * 100000)\nprint("é" * 70000, end="")')
+    assert result["status"] == "success"
+    assert result["output"] == "x" * 100000 + "\n" + "é" * 70000
+
+
+@pytest.mark.asyncio
+async def test_output_is_streamed_line_by_line(engine):
+    job = await engine.submit("python", "import sys\nprint('a', flush=True)\nprint('b', file=sys.stderr)\nprint('c')", None)
+    events = [event async for event in job.stream()]
+    assert events[:2] == [("status", "queued"), ("status", "running")]
+    assert [e for e in events if e[0] == "stdout"] == [("stdout", "a\n"), ("stdout", "c\n")]
+    assert ("stderr", "b\n") in events
+    assert events[-1] == ("result", {"status": "success", "output": "a\nc\n", "error": "b\n"})
+
+
+@pytest.mark.asyncio
+async def test_failures_and_timeouts(engine):
+    engine.timeout = 1
+    failed = await run(engine, "import sys\nprint('partial')\nsys.exit(3)")
+    assert failed["status"] == "error" and failed["output"] == "partial\n"
+    assert failed["error"].startswith("Execution failed with exit code 3.")
+    timed_out = await run(engine, "print('started', flush=True)\nwhile True: pass")
+    assert timed_out == {
+        "status": "error",
+        "output": "started\n",
+        "error": "Code execution timed out after 1 seconds. The process was terminated.",
+    }
+
+
+@pytest.mark.asyncio
+async def test_queue_is_bounded():
+    engine = ExecutionEngine(workers=1, queue_size=1, per_user=10, timeout=5)
+    try:
+        jobs = [await engine.submit("python", "import time; time.sleep(0.5)", None)]
+        await asyncio.sleep(0.1)                      # the worker picks up the first job
+        jobs.append(await engine.submit("python", "print(1)", None))
+        with pytest.raises(QueueFullError):
+            await engine.submit("python", "print(2)", None)
+        assert [(await job.result())["status"] for job in jobs] == ["success", "success"]
+    finally:
+        await engine.close()
+
+
+@pytest.mark.asyncio
+async def test_event_loop_stays_responsive_under_load(engine):
+    """While every worker is busy, a 10 ms tick (standing in for chat streams) keeps running."""
+    busy = "import time\nend = time.time() + 1\nwhile time.time() < end: pass\nprint('done')"
+    lags = []
+
+    async def ticker(stop):
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lags.append(time.perf_counter() - started - 0.01)
+
+    stop = asyncio.Event()
+    tick = asyncio.create_task(ticker(stop))
+    results = await asyncio.gather(*(run(engine, busy, user_id=i) for i in range(4)))
+    stop.set()
+    await tick
+
+    assert [r["output"] for r in results] == ["done\n"] * 4
+    assert len(lags) > 10        # a loop blocked by the jobs barely ticks (see bench_event_loop_lag.py)
+
+
+@pytest_asyncio.fixture
+async def fake_java(tmp_path, monkeypatch):
+    runner = tmp_path / "fake_runner.py"
+    runner.write_text(FAKE_RUNNER)
+    log = tmp_path / "commands.log"
+    started = []
+    start = WarmRuntime.start
+
+    async def recording_start(runtime):
+        await start(runtime)
+        started.append(runtime)
+
+    monkeypatch.setattr(WarmRuntime, "start", recording_start)
+
+    def install(engine, mode):
+        engine.warm = True
+        engine._pools["java"] = RuntimePool([sys.executable, str(runner), mode, str(log)])
+        return lambda: log.read_text().split()
+    yield install
+    for runtime in started:
+        runtime.close()
+        await runtime.proc.wait()   # reap before the loop closes
+
+
+@pytest.mark.asyncio
+async def test_compiler_unavailable_falls_back_to_cold_javac(engine, fake_java, tmp_path):
+    commands = fake_java(engine, "unavailable")
+    compile_args = ["compile", str(tmp_path / "Main.java"), str(tmp_path / "classes")]
+    assert await engine._call_warm("java", compile_args, None) is None
+    assert await engine._call_warm("java", compile_args, None) is None
+    assert await engine._call_warm("java", ["run", str(tmp_path)], None) == (0, "ran\n", "", False)
+    assert commands() == ["compile", "run"]      # the second compile went straight to cold javac
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["garbled", "exit"])
+async def test_runner_protocol_errors_fall_back_to_cold(engine, fake_java, tmp_path, mode):
+    commands = fake_java(engine, mode)
+    compile_args = ["compile", str(tmp_path / "Main.java"), str(tmp_path / "classes")]
+    assert await engine._call_warm("java", compile_args, None) is None
+    assert await engine._call_warm("java", compile_args, None) is None
+    assert commands() == ["compile", "compile"]  # a broken reply only affects that call
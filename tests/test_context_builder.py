@@ -0,0 +1,93 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import context_builder
+from context_builder import ContextBuilder
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    """One token per word, so budgets are easy to reason about without cl100k_base."""
+    monkeypatch.setattr(context_builder, "count_tokens", lambda text: len(text.split()))
+    monkeypatch.setattr(context_builder, "truncate_to_tokens", lambda text, n: " ".join(text.split()[:n]))
+
+
+class SummaryClient:
+    def __init__(self):
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, **kwargs):
+        self.calls.append(kwargs["messages"][1]["content"])
+        message = SimpleNamespace(content=f"summary {len(self.calls)}")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def fill(db, chat_id, n):
+    return [db.add_history(chat_id, f"question {i}", f"answer {i} words words") for i in range(n)]
+
+
+@pytest.mark.asyncio
+async def test_build_packs_newest_turns_oldest_first(fresh_db, user_id):
+    chat_id = fresh_db.create_chat(user_id, "c")
+    fill(fresh_db, chat_id, 10)
+    builder = ContextBuilder(SummaryClient, budget=30)
+    context = await builder.build(chat_id)
+    # 6 tokens per turn
+    assert context.turns == [(f"question {i}", f"answer {i} words words") for i in range(5, 10)]
+    assert context.messages()[0] == {"role": "user", "content": "question 5"}
+
+
+@pytest.mark.asyncio
+async def test_build_runs_off_the_event_loop(fresh_db, user_id, monkeypatch):
+    chat_id = fresh_db.create_chat(user_id, "c")
+    fill(fresh_db, chat_id, 3)
+    threads = []
+    get_recent_history = fresh_db.get_recent_history
+
+    def recording(*args):
+        threads.append(threading.current_thread())
+        return get_recent_history(*args)
+
+    monkeypatch.setattr(fresh_db, "get_recent_history", recording)
+    await ContextBuilder(SummaryClient).build(chat_id)
+    assert threads and threading.main_thread() not in threads
+
+
+@pytest.mark.asyncio
+async def test_first_refresh_of_a_long_chat_is_bounded(fresh_db, user_id):
+    chat_id = fresh_db.create_chat(user_id, "long")
+    ids = fill(fresh_db, chat_id, 1000)
+    client = SummaryClient()
+    builder = ContextBuilder(lambda: client, budget=30)
+
+    context = await builder.build(chat_id)
+    await asyncio.gather(*builder._tasks)
+
+    oldest_packed = ids[-len(context.turns)]
+    assert len(client.calls) == context_builder.SUMMARY_MAX_TURNS // context_builder.SUMMARY_BATCH_TURNS
+    assert f"question {ids.index(oldest_packed) - context_builder.SUMMARY_MAX_TURNS}\n" in client.calls[0]
+    summary = fresh_db.get_chat_summary(chat_id)
+    assert summary["last_history_id"] == ids[ids.index(oldest_packed) - 1]
+
+    # The next request sees the summary; the summary now costs budget, so the one
+    # turn that drops out of the window is folded in with a single extra call
+    context = await builder.build(chat_id)
+    assert context.summary == summary["summary"]
+    await asyncio.gather(*builder._tasks)
+    assert len(client.calls) == context_builder.SUMMARY_MAX_TURNS // context_builder.SUMMARY_BATCH_TURNS + 1
+
+
+@pytest.mark.asyncio
+async def test_oversized_latest_turn_is_trimmed_on_both_sides(fresh_db, user_id):
+    chat_id = fresh_db.create_chat(user_id, "c")
+    fresh_db.add_history(chat_id, "pasted " * 100, "short reply")
+    context = await ContextBuilder(SummaryClient, budget=30).build(chat_id)
+    assert context.turns == [(" ".join(["pasted"] * 28), "short reply")]
+
+    fresh_db.add_history(chat_id, "pasted " * 100, "long " * 100)
+    context = await ContextBuilder(SummaryClient, budget=30).build(chat_id)
+    assert context.turns == [(" ".join(["pasted"] * 15), " ".join(["long"] * 15))]
@@ -0,0 +1,84 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def test_each_thread_gets_its_own_connection(fresh_db):
+    main_conn = fresh_db.get_conn()
+    assert fresh_db.get_conn() is main_conn
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        conns = set(pool.map(lambda _: id(fresh_db.get_conn()), range(4), chunksize=1))
+    assert id(main_conn) not in conns
+    assert main_conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert main_conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+
+
+def test_transaction_rolls_back_on_error(fresh_db, user_id):
+    try:
+        with fresh_db.transaction() as conn:
+            conn.execute("INSERT INTO chats (user_id, title) VALUES (?, ?)", (user_id, "lost"))
+            raise RuntimeError("boom")
+    except RuntimeError:
+        pass
+    assert fresh_db.list_user_chats(user_id) == []
+
+
+def test_concurrent_inserts_return_their_own_row_ids(fresh_db, user_id):
+    """The old shared cursor could hand one request another request's lastrowid."""
+    def write(n):
+        chat_id = fresh_db.create_chat(user_id, f"chat {n}")
+        history_id = fresh_db.add_history(chat_id, f"q{n}", f"a{n}")
+        return n, chat_id, history_id
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(write, range(400)))
+
+    for n, chat_id, history_id in results:
+        assert fresh_db.get_chat(chat_id)["title"] == f"chat {n}"
+        assert [tuple(r) for r in fresh_db.get_last_history(chat_id)] == [(f"q{n}", f"a{n}")]
+    assert len({history_id for _, _, history_id in results}) == 400
+
+
+def test_reads_proceed_while_writers_run(fresh_db, user_id):
+    """WAL: readers on other threads never see a locked database or a partial batch."""
+    chat_id = fresh_db.create_chat(user_id, "busy")
+    stop = threading.Event()
+    errors = []
+
+    def reader():
+        try:
+            while not stop.is_set():
+                rows = fresh_db.get_chat_history(chat_id)
+                assert [r["user_text"] for r in rows] == [f"q{i}" for i in range(len(rows))]
+        except Exception as e:  # surfaced below
+            errors.append(e)
+
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    for t in readers:
+        t.start()
+    started = time.perf_counter()
+    for i in range(300):
+        fresh_db.add_history(chat_id, f"q{i}", f"a{i}")
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for t in readers:
+        t.join()
+
+    assert errors == []
+    assert len(fresh_db.get_chat_history(chat_id)) == 300
+    assert elapsed < 10
+
+
+def test_hot_queries_use_indexes(fresh_db):
+    assert fresh_db.find_full_scans() == {}
+
+
+def test_migrations_are_idempotent(fresh_db):
+    version = fresh_db.get_conn().execute("PRAGMA user_version").fetchone()[0]
+    assert version == len(fresh_db.MIGRATIONS)
+    assert fresh_db.migrate() == version
+
+
+def test_full_scan_is_reported(fresh_db):
+    fresh_db.get_conn().execute("DROP INDEX idx_history_chat_id")
+    assert "get_chat_history" in fresh_db.find_full_scans()
@@ -0,0 +1,32 @@
+import pytest
+
+from exctr import is_time_dependent
+
+
+@pytest.mark.parametrize("code", [
+    "import time\nprint(time.time())",
+    "from datetime import date\nprint(date.today())",
+    "import os, random\nprint(random.random())",
+    "import numpy as np\nprint(np.random.rand(3))",
+    "import numpy.random\nprint(numpy.random.rand())",
+    "from numpy import random\nprint(random.rand())",
+    "from numpy.random import default_rng\nprint(default_rng().integers(9))",
+    "import pandas as pd\nprint(pd.Timestamp.now())",
+    "import os\nprint(os.urandom(8))",
+    "from os import urandom\nprint(urandom(8))",
+    "import urllib.request\nurllib.request.urlopen('http://example.com')",
+    "print(1)  # nocache",
+    "print(",
+])
+def test_nondeterministic_code_is_not_cached(code):
+    assert is_time_dependent(code)
+
+
+@pytest.mark.parametrize("code", [
+    "import pandas as pd\ndf = pd.read_csv('../input/a.csv')\ndf.describe().to_csv('out.csv')",
+    "import os\nprint(sorted(os.listdir('../input')))",
+    "import numpy as np\nprint(np.arange(10).sum())",
+    "timestamps = [1, 2]\nprint(timestamps)",
+])
+def test_deterministic_code_is_cached(code):
+    assert not is_time_dependent(code)
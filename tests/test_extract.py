@@ -0,0 +1,54 @@
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import scraper
+
+
+def article(n_paragraphs, words=60):
+    body = "".join(
+        f"<p>Paragraph {i} &amp; <b>bold {i}</b> " + " ".join(f"word{j}" for j in range(words)) + "</p>\n"
+        f"<div class='ad'><script>var x = '<p>not text</p>';</script>sidebar {i}</div>\n"
+        for i in range(n_paragraphs)
+    )
+    return (
+        "<!doctype html><html><head><title>t</title><style>p { color: red }</style></head>"
+        f"<body><nav><a href='/'>home</a></nav><article>{body}</article>"
+        "<footer><p>Footer &copy; 2025</p></footer></body></html>"
+    )
+
+
+CORPUS = [article(1), article(12), article(40, words=8), article(300)]
+
+
+@pytest.mark.parametrize("html", CORPUS, ids=range(len(CORPUS)))
+def test_stream_extractor_matches_bs4_output(html):
+    assert scraper.extract_paragraphs(html, limit_chars=None) == scraper.extract_paragraphs_bs4(html)
+
+
+def test_stream_extractor_stops_at_the_limit():
+    html = article(300)
+    full = scraper.extract_paragraphs(html, limit_chars=None)
+    limited = scraper.extract_paragraphs(html, limit_chars=2000)
+    assert full.startswith(limited)
+    assert 2000 < len(limited) + 1 < 2000 + max(len(p) for p in full.split("\n")) + 1
+
+
+@pytest.mark.asyncio
+async def test_extraction_runs_in_the_process_pool():
+    async def page(request):
+        return web.Response(text=article(12), content_type="text/html")
+
+    app = web.Application()
+    app.router.add_get("/page", page)
+    server = TestServer(app)
+    await server.start_server()
+    try:
+        async with aiohttp.ClientSession() as session:
+            content = await scraper.extract_content_from_url(str(server.make_url("/page")), session, limit_chars=500)
+    finally:
+        await server.close()
+        scraper.shutdown_extract_pool()
+    assert content == scraper.extract_paragraphs(article(12), limit_chars=500)
+    assert content.startswith("Paragraph 0 &bold 0word0")
@@ -0,0 +1,28 @@
+import httpx
+import pytest
+
+import main
+
+
+class FailingImageService:
+    async def generate(self, prompt, fresh=False):
+        yield "queue", 1
+        yield "error", "All image keys are rate limited"
+
+
+@pytest.mark.asyncio
+async def test_service_errors_reach_the_client(fresh_db, user_id, monkeypatch):
+    chat_id = fresh_db.create_chat(user_id, "images")
+    monkeypatch.setattr(main, "image_service", FailingImageService())
+    main.app.dependency_overrides[main.get_current_user_id] = lambda: user_id
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as api:
+            resp = await api.post("/generate-image", json={"message": "a red fox", "chat_id": chat_id})
+    finally:
+        main.app.dependency_overrides.clear()
+
+    events = [block.split("\n")[0] for block in resp.text.strip().split("\n\n")]
+    assert events == ["event: user", "event: queue", "event: error"]
+    assert 'data: "All image keys are rate limited"' in resp.text
+    assert fresh_db.get_chat_history(chat_id) == []
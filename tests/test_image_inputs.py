@@ -0,0 +1,72 @@
+import asyncio
+import base64
+
+import httpx
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import image_inputs
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+
+@pytest_asyncio.fixture
+async def image_server(monkeypatch):
+    hits = []
+    release = asyncio.Event()
+
+    async def image(request):
+        hits.append(request.path)
+        if request.query.get("slow"):
+            await release.wait()
+        return web.Response(body=PNG, content_type="image/png")
+
+    app = web.Application()
+    app.router.add_get("/{name}", image)
+    server = TestServer(app)
+    await server.start_server()
+    server.hits = hits
+    server.release = release
+    async with httpx.AsyncClient() as client:
+        monkeypatch.setattr(image_inputs, "image_http_client", client)
+        yield server
+    await server.close()
+
+
+DATA_URI = "data:image/png;base64," + base64.b64encode(PNG).decode()
+
+
+@pytest.mark.asyncio
+async def test_fetches_are_cached_by_url_and_content(image_server):
+    first, second = str(image_server.make_url("/a.png")), str(image_server.make_url("/b.png"))
+    assert await image_inputs.fetch_image_data_uri(first) == DATA_URI
+    assert await image_inputs.fetch_image_data_uri(first) == DATA_URI
+    assert await image_inputs.fetch_image_data_uri(second) == DATA_URI
+    assert image_server.hits == ["/a.png", "/b.png"]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_shared_fetch(image_server):
+    url = str(image_server.make_url("/shared.png").with_query(slow="1"))
+    leaver = asyncio.create_task(image_inputs.fetch_image_data_uri(url))
+    stayer = asyncio.create_task(image_inputs.fetch_image_data_uri(url))
+    await asyncio.sleep(0.05)
+    leaver.cancel()
+    await asyncio.sleep(0)
+    image_server.release.set()
+    assert await stayer == DATA_URI
+    assert leaver.cancelled()
+    assert image_server.hits == ["/shared.png"]
+
+
+@pytest.mark.asyncio
+async def test_parse_message_with_images(image_server):
+    url = str(image_server.make_url("/c.png"))
+    content = await image_inputs.parse_message_with_images(f"look <up-img>{url}</up-img> here", inline=True)
+    assert content == [
+        {"type": "text", "text": "look"},
+        {"type": "image_url", "image_url": {"url": DATA_URI}},
+        {"type": "text", "text": "here"},
+    ]
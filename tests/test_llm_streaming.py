@@ -0,0 +1,138 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from openai import AsyncOpenAI
+
+import main
+
+CHUNKS = ["Hel", "lo ", "there"]
+CHUNK_DELAY = 0.05
+
+
+def completion_chunk(content):
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "stub",
+        "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}],
+    }
+
+
+@pytest_asyncio.fixture
+async def openrouter_stub():
+    """Local stand-in for OpenRouter's streaming /chat/completions; records client sockets."""
+    peers = set()
+
+    async def completions(request):
+        peers.add(request.transport.get_extra_info("peername"))
+        await request.json()
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        for content in CHUNKS:
+            await asyncio.sleep(CHUNK_DELAY)
+            await resp.write(f"data: {json.dumps(completion_chunk(content))}\n\n".encode())
+        await resp.write(b"data: [DONE]\n\n")
+        await resp.write_eof()
+        return resp
+
+    app = web.Application()
+    app.router.add_post("/api/v1/chat/completions", completions)
+    server = TestServer(app)
+    await server.start_server()
+    server.peers = peers
+    yield server
+    await server.close()
+
+
+def pooled_clients(server, n_keys=2, max_connections=main.LLM_MAX_CONNECTIONS):
+    """Same wiring as main: one AsyncOpenAI per key over a single shared httpx pool."""
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=main.LLM_MAX_KEEPALIVE)
+    )
+    base_url = str(server.make_url("/api/v1"))
+    clients = [AsyncOpenAI(base_url=base_url, api_key=f"k{i}", http_client=http_client) for i in range(n_keys)]
+    return http_client, clients
+
+
+async def stream_text(client):
+    stream = await client.chat.completions.create(model="stub", stream=True, messages=[{"role": "user", "content": "hi"}])
+    return "".join([chunk.choices[0].delta.content or "" async for chunk in stream])
+
+
+def test_clients_share_the_pool_shards():
+    assert len(main.llm_http_clients) == main.LLM_POOL_SHARDS
+    assert len(main.async_clients) == main.LLM_POOL_SHARDS * len(main.api_keys)
+    assert {id(client._client) for client in main.async_clients} == {id(c) for c in main.llm_http_clients}
+    first = main.get_next_async_client()
+    assert main.get_next_async_client() is not first
+
+
+@pytest.mark.asyncio
+async def test_sequential_streams_reuse_a_connection(openrouter_stub):
+    http_client, clients = pooled_clients(openrouter_stub)
+    async with http_client:
+        for i in range(6):
+            assert await stream_text(clients[i % len(clients)]) == "".join(CHUNKS)
+    assert len(openrouter_stub.peers) == 1
+
+
+@pytest.mark.asyncio
+async def test_many_concurrent_streams_on_one_loop(openrouter_stub):
+    """200 open streams at once; a thread-per-stream path would need 200 threads."""
+    n_streams = 200
+    http_client, clients = pooled_clients(openrouter_stub)
+    async with http_client:
+        started = time.perf_counter()
+        texts = await asyncio.gather(*(stream_text(clients[i % len(clients)]) for i in range(n_streams)))
+        elapsed = time.perf_counter() - started
+    assert texts == ["".join(CHUNKS)] * n_streams
+    # Serially this would take n_streams * len(CHUNKS) * CHUNK_DELAY = 30 s
+    assert elapsed < 5
+    assert len(openrouter_stub.peers) <= main.LLM_MAX_CONNECTIONS
+
+
+@pytest.mark.asyncio
+async def test_pool_limit_caps_open_connections(openrouter_stub):
+    http_client, clients = pooled_clients(openrouter_stub, max_connections=4)
+    async with http_client:
+        await asyncio.gather(*(stream_text(clients[i % len(clients)]) for i in range(20)))
+    assert len(openrouter_stub.peers) <= 4
+
+
+@pytest.mark.asyncio
+async def test_chat_endpoint_streams_sse(openrouter_stub, fresh_db, user_id, monkeypatch):
+    http_client, clients = pooled_clients(openrouter_stub)
+    monkeypatch.setattr(main, "async_clients", clients)
+    monkeypatch.setattr(main, "async_client_index", 0)
+    chat_id = fresh_db.create_chat(user_id, "stub chat")
+
+    async with http_client, httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as api:
+        async with api.stream("POST", "/chat", json={"message": "hi", "chat_id": chat_id}) as resp:
+            assert resp.status_code == 200
+            assert resp.headers["content-type"].startswith("text/event-stream")
+            body = "".join([part async for part in resp.aiter_text()])
+
+    events = [block.split("\n") for block in body.strip().split("\n\n")]
+    assert events[0] == ["event: user", f"data: {json.dumps('hi')}"]
+    assert [json.loads(lines[1][len("data: "):]) for lines in events[1:]] == CHUNKS
+    assert all(lines[0] == "event: bot" for lines in events[1:])
+    assert [dict(r) for r in fresh_db.get_last_history(chat_id)] == [{"user_text": "hi", "bot_text": "".join(CHUNKS)}]
+
+
+@pytest.mark.asyncio
+async def test_codegen_streams_through_the_shared_pool(openrouter_stub):
+    from exctr import stream_codegen
+
+    http_client, clients = pooled_clients(openrouter_stub)
+    async with http_client:
+        text = "".join([d async for d in stream_codegen({"role": "user", "content": "plot"}, clients[0])])
+        assert await stream_text(clients[1]) == "".join(CHUNKS)
+    assert text == "".join(CHUNKS)
+    assert len(openrouter_stub.peers) == 1
@@ -0,0 +1,86 @@
+import httpx
+import pytest
+
+import main
+
+
+@pytest.fixture
+def logged_in(user_id, monkeypatch):
+    monkeypatch.setattr(main, "get_current_user_id", lambda request: user_id)
+    return user_id
+
+
+@pytest.fixture
+def api():
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test")
+
+
+def fill_chat(db, user_id, turns):
+    chat_id = db.create_chat(user_id, "long chat")
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO history (chat_id, user_text, bot_text) VALUES (?, ?, ?)",
+            [(chat_id, f"q{i}", f"a{i}") for i in range(turns)],
+        )
+    return chat_id
+
+
+async def walk(api, url, limit):
+    """Follow X-Next-Before-Id until the last page; returns every page."""
+    pages, params = [], {"limit": limit}
+    while True:
+        response = await api.get(url, params=params)
+        assert response.status_code == 200
+        pages.append(response.json())
+        cursor = response.headers.get(main.NEXT_CURSOR_HEADER)
+        if cursor is None:
+            return pages
+        params = {"limit": limit, "before_id": int(cursor)}
+
+
+@pytest.mark.asyncio
+async def test_history_pages_cover_the_chat_oldest_first(fresh_db, logged_in, api):
+    chat_id = fill_chat(fresh_db, logged_in, 120)
+    async with api:
+        full = (await api.get(f"/chats/{chat_id}/history")).json()
+        pages = await walk(api, f"/chats/{chat_id}/history", 50)
+
+    assert [len(p) for p in pages] == [50, 50, 20]
+    assert pages[0][-1]["user"] == "q119"                    # newest page first ...
+    assert [turn for page in reversed(pages) for turn in page] == full   # ... each oldest first
+    assert [t["user"] for t in full] == [f"q{i}" for i in range(120)]
+
+
+@pytest.mark.asyncio
+async def test_new_turns_do_not_shift_older_pages(fresh_db, logged_in, api):
+    chat_id = fill_chat(fresh_db, logged_in, 30)
+    async with api:
+        first = await api.get(f"/chats/{chat_id}/history", params={"limit": 10})
+        fresh_db.add_history(chat_id, "new", "turn")
+        cursor = first.headers[main.NEXT_CURSOR_HEADER]
+        second = await api.get(f"/chats/{chat_id}/history", params={"limit": 10, "before_id": cursor})
+    assert [t["user"] for t in second.json()] == [f"q{i}" for i in range(10, 20)]
+
+
+@pytest.mark.asyncio
+async def test_chat_pages_skip_private_chats(fresh_db, logged_in, api):
+    for i in range(7):
+        fresh_db.create_chat(logged_in, f"chat {i}", is_private=i % 3 == 0)
+    async with api:
+        pages = await walk(api, "/chats", 2)
+        unpaginated = (await api.get("/chats")).json()
+    titles = [c["title"] for page in pages for c in page]
+    assert titles == ["chat 5", "chat 4", "chat 2", "chat 1"]
+    assert sorted(c["title"] for c in unpaginated) == sorted(titles)
+
+
+@pytest.mark.asyncio
+async def test_limit_is_clamped_and_large_bodies_are_gzipped(fresh_db, logged_in, api):
+    chat_id = fill_chat(fresh_db, logged_in, 300)
+    async with api:
+        big = await api.get(f"/chats/{chat_id}/history", params={"limit": 1000},
+                            headers={"Accept-Encoding": "gzip"})
+        small = await api.get(f"/chats/{chat_id}/history", params={"limit": -5})
+    assert len(big.json()) == main.MAX_PAGE_SIZE
+    assert big.headers["content-encoding"] == "gzip"
+    assert len(small.json()) == 1 and "content-encoding" not in small.headers
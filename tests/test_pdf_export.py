@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import Paragraph
+
+import pdf_export
+from cache import TTLCache
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("**bold** and *italic*", "<b>bold</b> and <i>italic</i>"),
+    ("**bold *italic** text*", "**bold <i>italic** text</i>"),
+    ("[a **b](https://example.com/?x=1&y=2) c**", '<link href="https://example.com/?x=1&amp;y=2" color="blue">a **b</link> c**'),
+    ("**a [b](https://example.com) c**", '<b>a <link href="https://example.com" color="blue">b</link> c</b>'),
+    ("a * b * c <tag>", "a * b * c &lt;tag&gt;"),
+    ("`**code**` *x*", '<font face="Courier">**code**</font> <i>x</i>'),
+])
+def test_inline_markup_is_balanced(text, expected):
+    markup = pdf_export._inline(text)
+    assert markup == expected
+    Paragraph(markup, getSampleStyleSheet()["BodyText"])   # reportlab parses it
+
+
+def test_mismatched_emphasis_renders():
+    content = "# Title\n\n**bold *italic** text*\n\n- [a **b](https://example.com) c**\n"
+    assert pdf_export.render_pdf(content, "unused").startswith(b"%PDF")
+
+
+def test_markup_errors_fall_back_to_plain_text(monkeypatch):
+    monkeypatch.setattr(pdf_export, "_inline", lambda text: "<b>unclosed")
+    monkeypatch.setattr(pdf_export.shutil, "which", lambda name: None)
+    assert pdf_export.render_pdf("some *text*", "unused").startswith(b"%PDF")
+
+
+@pytest.fixture
+def renders(tmp_path, monkeypatch):
+    """Export pool swapped for threads and a counting renderer, with an empty cache."""
+    renders = SimpleNamespace(calls=[], release=threading.Event())
+
+    def render(content, template_dir):
+        renders.calls.append(content)
+        renders.release.wait(5)
+        return b"%PDF " + content.encode()
+
+    pool = ThreadPoolExecutor(max_workers=2)
+    monkeypatch.setattr(pdf_export, "render_pdf", render)
+    monkeypatch.setattr(pdf_export, "get_export_pool", lambda: pool)
+    monkeypatch.setattr(pdf_export, "_template_dir", str(tmp_path))
+    monkeypatch.setattr(pdf_export, "pdf_cache", TTLCache("pdf_exports_test", ttl=60, max_bytes=1 << 20))
+    yield renders
+    renders.release.set()
+    pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_cached_exports_skip_the_renderer(renders):
+    renders.release.set()
+    assert await pdf_export.export_pdf_bytes("# Report") == b"%PDF # Report"
+    assert await pdf_export.export_pdf_bytes("# Report") == b"%PDF # Report"
+    assert renders.calls == ["# Report"]
+    assert pdf_export.pdf_cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_shared_render(renders):
+    first = asyncio.create_task(pdf_export.export_pdf_bytes("same"))
+    second = asyncio.create_task(pdf_export.export_pdf_bytes("same"))
+    await asyncio.sleep(0.05)
+    first.cancel()
+    await asyncio.sleep(0)
+    renders.release.set()
+    assert await second == b"%PDF same"
+    assert first.cancelled()
+    assert renders.calls == ["same"]
@@ -0,0 +1,93 @@
+import httpx
+import pytest
+
+import main
+
+
+@pytest.fixture
+def users(fresh_db):
+    u1 = fresh_db.create_user("a", "a@example.com", "x", None)
+    u2 = fresh_db.create_user("b", "b@example.com", "x", None)
+    return u1, u2
+
+
+def ids(results):
+    return [r["id"] for r in results]
+
+
+def test_search_is_scoped_to_the_users_public_chats(fresh_db, users):
+    u1, u2 = users
+    mine = fresh_db.create_chat(u1, "Python help")
+    theirs = fresh_db.create_chat(u2, "Other")
+    private = fresh_db.create_chat(u1, "Private", 1)
+    hit = fresh_db.add_history(mine, "how do I parse JSON in python", "Use the json module: json.loads")
+    fresh_db.add_history(theirs, "python JSON?", "json.loads")
+    fresh_db.add_history(private, "secret python", "hidden")
+
+    (result,) = fresh_db.search_history(u1, "PÝTHON json")
+    assert result["id"] == hit and result["title"] == "Python help"
+    assert "<mark>python</mark>" in result["snippet"]
+    assert fresh_db.search_history(u1, "secret") == []
+    assert fresh_db.search_history(u1, "pyth") == []          # exact terms, no prefixes
+    assert fresh_db.search_history(u1, 'AND OR " NEAR(') == []
+
+
+def test_ranking_prefers_denser_matches(fresh_db, users):
+    chat = fresh_db.create_chat(users[0], "chat")
+    sparse = fresh_db.add_history(chat, "sqlite", "a long answer " * 20)
+    dense = fresh_db.add_history(chat, "sqlite sqlite", "sqlite index")
+    assert ids(fresh_db.search_history(users[0], "sqlite")) == [dense, sparse]
+    assert ids(fresh_db.search_history(users[0], "sqlite", limit=1)) == [dense]
+
+
+def test_index_follows_updates_and_deletes(fresh_db, users):
+    chat = fresh_db.create_chat(users[0], "chat")
+    turn = fresh_db.add_history(chat, "about pythonic code", "ok")
+    with fresh_db.transaction() as conn:
+        conn.execute("UPDATE history SET user_text = 'rewritten' WHERE id = ?", (turn,))
+    assert fresh_db.search_history(users[0], "pythonic") == []
+    assert ids(fresh_db.search_history(users[0], "rewritten")) == [turn]
+    fresh_db.delete_chat(chat)
+    assert fresh_db.search_history(users[0], "rewritten") == []
+    fresh_db.get_conn().execute("INSERT INTO history_fts(history_fts, rank) VALUES('integrity-check', 1)")
+
+
+def test_backfill_indexes_rows_from_before_the_migration(tmp_path, monkeypatch):
+    import db
+
+    db.close_all()
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "old.db"))
+    monkeypatch.setattr(db, "MIGRATIONS", db.MIGRATIONS[:5])
+    db.migrate()                                   # an existing deployment at schema v5
+    user = db.create_user("a", "a@example.com", "x", None)
+    chat = db.create_chat(user, "chat")
+    old = [db.add_history(chat, f"old python {i}", "x") for i in range(5)]
+    monkeypatch.undo()
+    monkeypatch.setattr(db, "DB_PATH", str(tmp_path / "old.db"))
+    db.migrate()
+
+    with db.transaction() as conn:                 # not indexed yet: must not touch the index
+        conn.execute("DELETE FROM history WHERE id = ?", (old[0],))
+    new = db.add_history(chat, "new python", "x")
+    assert ids(db.search_history(user, "python")) == [new]
+    while db.backfill_history_fts(batch_size=2):
+        pass
+    assert sorted(ids(db.search_history(user, "python"))) == old[1:] + [new]
+    db.get_conn().execute("INSERT INTO history_fts(history_fts, rank) VALUES('integrity-check', 1)")
+    assert db.find_full_scans() == {}
+    db.close_all()
+
+
+@pytest.mark.asyncio
+async def test_search_endpoint(fresh_db, users):
+    chat = fresh_db.create_chat(users[0], "chat")
+    turn = fresh_db.add_history(chat, "full text search", "with fts5")
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as api:
+        assert (await api.get("/search/history", params={"q": "search"})).status_code == 401
+        main.app.dependency_overrides[main.get_current_user_id] = lambda: users[0]
+        try:
+            response = await api.get("/search/history", params={"q": "fts5", "limit": 0})
+        finally:
+            main.app.dependency_overrides.clear()
+    assert ids(response.json()) == [turn]
@@ -0,0 +1,258 @@
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+import main
+import storage
+from cache import TTLCache
+from storage import LocalBackend, StorageUploader, SupabaseBackend, parse_byte_range
+
+
+class SupabaseStandIn(BaseHTTPRequestHandler):
+    """Just enough of Supabase's storage API: POST /storage/v1/object/<bucket>/<name>."""
+
+    def do_POST(self):
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            time.sleep(server.delay)
+            key = self.path.removeprefix("/storage/v1/object/")
+            with server.lock:
+                server.posts.append((key, self.headers["Content-Type"], self.headers["Authorization"]))
+                status = server.fail_with or 200
+                if status == 200 and key in server.objects:
+                    status = 400
+                elif status == 200:
+                    server.objects[key] = body
+            payload = b'{"error": "Duplicate", "message": "The resource already exists"}' if status == 400 else b"{}"
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def supabase(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SupabaseStandIn)
+    server.lock = threading.Lock()
+    server.objects, server.posts = {}, []
+    server.active = server.max_active = 0
+    server.delay = 0
+    server.fail_with = None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    monkeypatch.setenv("SUPABASE_URL", url)
+    monkeypatch.setenv("SUPABASE_KEY", "service-key")
+    server.url = url
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_dedupe_cache(monkeypatch):
+    monkeypatch.setattr(storage, "uploaded_objects", TTLCache("uploaded_objects_test", ttl=60, max_bytes=1 << 20))
+
+
+@pytest.fixture
+def supabase_uploader(supabase):
+    uploader = StorageUploader(SupabaseBackend(max_connections=4), workers=4)
+    yield uploader
+    uploader.close()
+
+
+def test_upload_bytes(supabase, supabase_uploader):
+    data = b"\x89PNG fake image"
+    digest = hashlib.sha256(data).hexdigest()
+    url = supabase_uploader.upload_bytes(data, ".png", bucket="b1")
+    assert url == f"{supabase.url}/storage/v1/object/public/b1/{digest}.png"
+    assert supabase.objects == {f"b1/{digest}.png": data}
+    assert supabase.posts == [(f"b1/{digest}.png", "image/png", "Bearer service-key")]
+
+
+def test_upload_file_streams_from_disk(supabase, supabase_uploader, tmp_path):
+    path = tmp_path / "report.pdf"
+    data = bytes(range(256)) * 4096 + b"tail"  # ~1 MiB, several upload chunks
+    path.write_bytes(data)
+    url = supabase_uploader.upload_file(path, bucket="b1")
+    name = f"{hashlib.sha256(data).hexdigest()}.pdf"
+    assert url == f"{supabase.url}/storage/v1/object/public/b1/{name}?download=report.pdf"
+    assert supabase.objects[f"b1/{name}"] == data
+
+
+def test_duplicate_uploads_are_skipped(supabase, supabase_uploader, tmp_path):
+    first = supabase_uploader.upload_bytes(b"same", ".txt", bucket="b1")
+    assert supabase_uploader.upload_bytes(b"same", ".txt", bucket="b1") == first
+    assert len(supabase.posts) == 1
+
+    # After a restart the dedupe cache is empty; Supabase's "Duplicate" answer counts as success
+    storage.uploaded_objects.delete(f"b1/{first.rsplit('/', 1)[1]}")
+    assert supabase_uploader.upload_bytes(b"same", ".txt", bucket="b1") == first
+    assert len(supabase.posts) == 2
+
+
+def test_upload_files_runs_concurrently_and_reports_errors(supabase, supabase_uploader, tmp_path):
+    supabase.delay = 0.2
+    paths = []
+    for i in range(8):
+        paths.append(tmp_path / f"out{i}.csv")
+        paths[-1].write_text(f"row,{i}\n")
+    started = time.monotonic()
+    results = list(supabase_uploader.upload_files(paths, bucket="b1"))
+    elapsed = time.monotonic() - started
+    assert sorted(str(p) for p, _, _ in results) == sorted(str(p) for p in paths)
+    assert all(url and error is None for _, url, error in results)
+    assert supabase.max_active > 1
+    assert elapsed < 8 * supabase.delay
+
+    supabase.fail_with = 500
+    missing = tmp_path / "missing.csv"
+    (tmp_path / "new.csv").write_text("new")
+    errors = {p.name: e for p, _, e in supabase_uploader.upload_files([tmp_path / "new.csv", missing], bucket="b1")}
+    assert "Upload failed with status code 500" in str(errors["new.csv"])
+    assert isinstance(errors["missing.csv"], FileNotFoundError)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", (0, 9)),
+    ("bytes=90-", (90, 99)),
+    ("bytes=90-500", (90, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=-500", (0, 99)),
+    ("bytes=0-1,5-6", None),
+    ("items=0-1", None),
+    ("bytes=x-1", None),
+    ("bytes=-", None),
+])
+def test_parse_byte_range(header, expected):
+    assert parse_byte_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=-0", "bytes=100-", "bytes=5-2", "bytes=--3"])
+def test_unsatisfiable_ranges(header):
+    with pytest.raises(ValueError):
+        parse_byte_range(header, 100)
+
+
+@pytest.fixture
+def local_uploader(tmp_path, monkeypatch):
+    uploader = StorageUploader(LocalBackend(root=tmp_path / "storage", public_url=""), workers=2)
+    monkeypatch.setattr(main, "uploader", uploader)
+    yield uploader
+    uploader.close()
+
+
+@pytest.mark.asyncio
+async def test_files_route_serves_ranges(local_uploader):
+    data = bytes(range(100))
+    url = local_uploader.upload_bytes(data, ".bin", bucket="b1")
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as api:
+        full = await api.get(url)
+        part = await api.get(url, headers={"Range": "bytes=10-19"})
+        suffix = await api.get(url, headers={"Range": "bytes=-5"})
+        empty = await api.get(url, headers={"Range": "bytes=-0"})
+        missing = await api.get("/files/b1/" + "0" * 64 + ".bin")
+
+    assert full.status_code == 200 and full.content == data
+    assert full.headers["accept-ranges"] == "bytes"
+    assert part.status_code == 206 and part.content == data[10:20]
+    assert part.headers["content-range"] == "bytes 10-19/100"
+    assert suffix.status_code == 206 and suffix.content == data[95:]
+    assert empty.status_code == 416 and empty.headers["content-range"] == "bytes */100"
+    assert missing.status_code == 404
+
+
+def test_local_backend_stores_content_addressed_shards(tmp_path):
+    backend = LocalBackend(root=tmp_path, public_url="https://cdn.example.com")
+    data = b"hello local storage"
+    name = hashlib.sha256(data).hexdigest() + ".txt"
+    assert backend.put(name, iter([data[:5], data[5:]]), len(data), "b1") == f"https://cdn.example.com/files/b1/{name}"
+    path = tmp_path / "b1" / name[:2] / name[2:4] / name
+    assert path.read_bytes() == data
+    assert [p.name for p in path.parent.iterdir()] == [name]   # no temp files left behind
+
+    # Same name means same content: a second write is skipped
+    mtime = path.stat().st_mtime_ns
+    src = tmp_path / "copy.txt"
+    src.write_bytes(data)
+    backend.put_file(name, src, "b1")
+    assert path.stat().st_mtime_ns == mtime
+
+
+@pytest.mark.parametrize("bucket, name", [
+    ("b1", "../../etc/passwd"),
+    ("b1", "0" * 63 + ".txt"),
+    ("b1", "0" * 64 + ".toolongextension"),
+    ("../b1", "0" * 64),
+])
+def test_local_backend_rejects_names_it_never_writes(tmp_path, bucket, name):
+    backend = LocalBackend(root=tmp_path)
+    assert backend.path_for(bucket, name) is None
+    with pytest.raises(ValueError):
+        backend.put(name, b"x", 1, bucket)
+
+
+@pytest.mark.parametrize("filename, extension", [
+    ("plot.PNG", ".png"),
+    ("data.my-ext~", ".myext"),
+    ("archive.averyveryverylongextension", ".averyveryv"),
+    ("Makefile", ""),
+    ("notes.", ""),
+])
+def test_unusual_extensions_are_normalised(local_uploader, tmp_path, filename, extension):
+    path = tmp_path / filename
+    path.write_bytes(b"content of " + filename.encode())
+    url = local_uploader.upload_file(path, bucket="b1")
+    name = hashlib.sha256(path.read_bytes()).hexdigest() + extension
+    assert url.startswith(f"/files/b1/{name}?download=")
+    assert local_uploader.backend.path_for("b1", name).is_file()
+
+
+@pytest.mark.asyncio
+async def test_downloads_keep_the_original_filename(local_uploader, tmp_path):
+    path = tmp_path / "Quarterly report é.pdf"
+    path.write_bytes(b"%PDF-1.4 fake")
+    url = local_uploader.upload_file(path, bucket="b1")
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as api:
+        full = await api.get(url)
+        part = await api.get(url, headers={"Range": "bytes=0-3"})
+    expected = "attachment; filename=\"Quarterly report _.pdf\"; filename*=UTF-8''Quarterly%20report%20%C3%A9.pdf"
+    assert full.status_code == 200 and full.content == b"%PDF-1.4 fake"
+    assert full.headers["content-disposition"] == expected
+    assert full.headers["content-type"] == "application/pdf"
+    assert part.status_code == 206 and part.headers["content-disposition"] == expected
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("extension, body, inline", [
+    (".html", b"<script>alert(document.cookie)</script>", False),
+    (".svg", b'<svg xmlns="http://www.w3.org/2000/svg" onload="alert(1)"/>', False),
+    (".png", b"\x89PNG fake", True),
+    (".txt", b"plain", True),
+])
+async def test_stored_files_cannot_run_script_on_the_app_origin(local_uploader, extension, body, inline):
+    url = local_uploader.upload_bytes(body, extension, bucket="b1")
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as api:
+        response = await api.get(url)
+    assert response.status_code == 200 and response.content == body
+    assert response.headers["x-content-type-options"] == "nosniff"
+    assert response.headers["content-security-policy"] == "sandbox"
+    assert ("content-disposition" not in response.headers) == inline
+    if not inline:
+        assert response.headers["content-disposition"].startswith("attachment;")
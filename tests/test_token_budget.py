@@ -0,0 +1,60 @@
+import pytest
+
+import scraper
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    try:
+        return scraper.get_tokenizer()
+    except Exception as e:  # tiktoken downloads cl100k_base on first use
+        pytest.skip(f"cl100k_base encoding unavailable: {e}")
+
+
+def page(n, words):
+    return {"url": f"https://example.com/{n}", "content": " ".join(f"token{n}x{i}" for i in range(words))}
+
+
+def test_tokenizer_is_loaded_once(tokenizer):
+    assert scraper.get_tokenizer() is scraper.get_tokenizer()
+
+
+def test_token_counts_are_memoized(tokenizer):
+    text = "memoized " * 5000
+    scraper.count_tokens.cache_clear()
+    first = scraper.count_tokens(text)
+    second = scraper.count_tokens(text)
+    assert first == second == len(scraper.get_tokenizer().encode(text))
+    assert scraper.count_tokens.cache_info().hits == 1
+
+
+def test_fair_share_keeps_small_items_whole():
+    assert scraper.fair_share([10, 500, 20, 800], 400) == [10, 185, 20, 185]
+    assert scraper.fair_share([10, 20], 100) == [10, 20]
+    assert scraper.fair_share([], 100) == []
+
+
+def test_sources_prompt_gives_every_source_a_share(tokenizer):
+    results = [page(0, 50), page(1, 4000), page(2, 4000), page(3, 4000)]
+    prompt = scraper.build_sources_prompt(results, max_tokens=3000)
+    assert scraper.count_tokens(prompt) <= 3000
+    sections = prompt.split("\n[#")
+    assert len(sections) == 4
+    assert results[0]["content"] in sections[0]
+    for n in (1, 2, 3):
+        assert f"{n + 1}]({results[n]['url']})" in sections[n]
+        assert f"token{n}x0 " in sections[n]
+
+
+def test_sources_prompt_is_untouched_under_budget(tokenizer):
+    results = [page(0, 20), {"url": "https://example.com/empty", "content": None}]
+    assert scraper.build_sources_prompt(results, max_tokens=1000) == (
+        f"[#1]({results[0]['url']})\n{results[0]['content']}\n\n[#2](https://example.com/empty)\n<No content>\n"
+    )
+
+
+def test_truncate_prompt_text(tokenizer):
+    text = "alpha beta " * 100
+    assert scraper.truncate_prompt_text(text, max_tokens=10_000) == text
+    assert scraper.count_tokens(scraper.truncate_prompt_text(text, max_tokens=7)) == 7
+    assert scraper.truncate_prompt_text(text, max_tokens=0) == ""
@@ -0,0 +1,105 @@
+import time
+
+import pytest
+
+import warm_pool
+from warm_pool import WarmPool, _Template
+
+
+@pytest.fixture(autouse=True)
+def fast_templates(monkeypatch):
+    """No heavy preloads and short respawn delays, so templates start in well under a second."""
+    monkeypatch.setattr(warm_pool, "PRELOAD_MODULES", [])
+    monkeypatch.setattr(warm_pool, "WARM_POOL_RESPAWN_BASE_DELAY", 0.05)
+
+
+@pytest.fixture
+def script(tmp_path):
+    path = tmp_path / "job.py"
+    path.write_text("import os\nprint('pid', os.getpid())\nprint('done')\n")
+    return str(path)
+
+
+class FlakyTemplate:
+    """Fails the first `failures` starts, then behaves like the real template."""
+
+    failures = 0
+    attempts = 0
+
+    def __new__(cls):
+        cls.attempts += 1
+        if cls.attempts <= cls.failures:
+            raise RuntimeError("template failed to start")
+        return _Template()
+
+
+def until(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_warm_run(script, tmp_path):
+    pool = WarmPool(size=1)
+    try:
+        lines = []
+        code, output, timed_out = pool.run(script, str(tmp_path), timeout=10, on_line=lines.append)
+        assert (code, timed_out) == (0, False)
+        assert output.endswith("done\n") and lines[-1] == "done\n"
+    finally:
+        pool.shutdown()
+
+
+def test_spawn_failure_falls_back_to_cold_and_retries(script, tmp_path, monkeypatch):
+    monkeypatch.setattr(FlakyTemplate, "failures", 3)
+    monkeypatch.setattr(FlakyTemplate, "attempts", 0)
+    monkeypatch.setattr(warm_pool, "_Template", FlakyTemplate)
+    pool = WarmPool(size=1)
+    try:
+        pool.start()
+        assert until(lambda: FlakyTemplate.attempts >= 1)
+
+        started = time.monotonic()
+        code, output, timed_out = pool.run(script, str(tmp_path), timeout=10)
+        assert (code, timed_out) == (0, False) and output.endswith("done\n")
+        assert time.monotonic() - started < warm_pool.WARM_POOL_ACQUIRE_TIMEOUT
+
+        # Retries back off and eventually bring a template up
+        assert until(lambda: pool._idle.qsize() == 1)
+        assert FlakyTemplate.attempts == 4
+        assert pool.run(script, str(tmp_path), timeout=10)[0] == 0
+    finally:
+        pool.shutdown()
+
+
+def test_busy_pool_runs_cold_after_the_acquire_timeout(script, tmp_path, monkeypatch):
+    monkeypatch.setattr(warm_pool, "WARM_POOL_ACQUIRE_TIMEOUT", 0.2)
+    pool = WarmPool(size=1)
+    try:
+        pool.start()
+        assert until(lambda: pool._idle.qsize() == 1)
+        template = pool._idle.get()              # every template is busy
+        started = time.monotonic()
+        assert pool.run(script, str(tmp_path), timeout=10)[1].endswith("done\n")
+        assert time.monotonic() - started >= 0.2
+        pool._idle.put(template)
+    finally:
+        pool.shutdown()
+
+
+def test_warm_jobs_start_with_preloaded_modules(tmp_path, monkeypatch):
+    monkeypatch.setattr(warm_pool, "PRELOAD_MODULES", ["fractions"])
+    path = tmp_path / "preloaded.py"
+    path.write_text("import sys\nprint('fractions' in sys.modules)\n")
+
+    pool = WarmPool(size=1)
+    try:
+        pool.start()
+        assert until(lambda: pool._idle.qsize() == 1)
+        assert pool.run(str(path), str(tmp_path), 10)[1] == "True\n"
+    finally:
+        pool.shutdown()
+    assert warm_pool.run_cold(str(path), str(tmp_path), 10)[1] == "False\n"
@@ -0,0 +1,56 @@
+import shutil
+
+import pytest
+import pytest_asyncio
+
+from code_runner import ExecutionEngine
+
+pytestmark = pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+
+
+@pytest_asyncio.fixture
+async def engine():
+    engine = ExecutionEngine(workers=2, queue_size=8, per_user=4, timeout=5)
+    engine.warm = True
+    yield engine
+    procs = [runtime.proc for pool in engine._pools.values() for runtime in list(pool._idle._queue)]
+    await engine.close()
+    for proc in procs:
+        await proc.wait()   # reap before the loop closes
+
+
+async def run_js(engine, code):
+    job = await engine.submit("javascript", code, None)
+    return await job.result()
+
+
+def runtimes(engine):
+    pool = engine._pools["javascript"]
+    return list(pool._idle._queue)
+
+
+@pytest.mark.asyncio
+async def test_long_output_line_keeps_the_runtime(engine):
+    result = await run_js(engine, 'console.log("y".repeat(70000)); console.error("e".repeat(70000))')
+    assert result == {"status": "success", "output": "y" * 70000 + "\n", "error": "e" * 70000 + "\n"}
+    (runtime,) = runtimes(engine)
+    assert runtime.alive
+
+    assert (await run_js(engine, 'process.stdout.write("no newline")'))["output"] == "no newline"
+    assert runtimes(engine) == [runtime] and runtime.jobs == 2
+
+
+@pytest.mark.asyncio
+async def test_warm_results_match_cold(engine):
+    snippets = [
+        'console.log(1 + 1)',
+        'console.error("oops"); console.log("after")',
+        'throw new Error("boom")',
+        'console.log("ünïcödé ✓")',
+        'process.exitCode = 3; console.log("exit")',
+    ]
+    warm = [await run_js(engine, code) for code in snippets]
+    engine.warm = False
+    cold = [await run_js(engine, code) for code in snippets]
+    for w, c in zip(warm, cold):
+        assert (w["status"], w["output"]) == (c["status"], c["output"])
@@ -0,0 +1,66 @@
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+
+def insert_history(db, chat_id, text="q"):
+    return db.write_queue.execute(db.SQL_INSERT_HISTORY, (chat_id, text, "a"))
+
+
+@pytest.fixture
+def chat_id(fresh_db, user_id):
+    with fresh_db.transaction() as conn:
+        return conn.execute("INSERT INTO chats (user_id, title) VALUES (?, 'chat')", (user_id,)).lastrowid
+
+
+def test_lone_writer_commits_on_its_own_thread(fresh_db, chat_id):
+    ids = [insert_history(fresh_db, chat_id, f"q{i}") for i in range(5)]
+    assert fresh_db.write_queue._thread is None          # no handoff to the writer thread
+    assert fresh_db.write_queue.stats() == {"batches": 5, "rows": 5, "direct": 5}
+    assert [r["id"] for r in fresh_db.get_chat_history(chat_id)] == ids
+
+
+def test_concurrent_writers_share_commits(fresh_db, chat_id):
+    barrier = threading.Barrier(16)
+    ids, lock = [], threading.Lock()
+
+    def writer():
+        barrier.wait()
+        for _ in range(20):
+            row_id = insert_history(fresh_db, chat_id)
+            with lock:
+                ids.append(row_id)
+
+    threads = [threading.Thread(target=writer) for _ in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = fresh_db.write_queue.stats()
+    assert len(set(ids)) == 320 and stats["rows"] == 320
+    assert stats["batches"] < 320                         # some commits held several rows
+    assert len(fresh_db.get_chat_history(chat_id)) == 320
+
+
+@pytest.mark.asyncio
+async def test_a_failing_row_only_fails_its_own_caller(fresh_db, chat_id):
+    results = await asyncio.gather(
+        fresh_db.write_queue.execute_async(fresh_db.SQL_INSERT_HISTORY, (chat_id, "ok 1", "a")),
+        fresh_db.write_queue.execute_async(fresh_db.SQL_INSERT_HISTORY, (chat_id + 999, "orphan", "a")),
+        fresh_db.write_queue.execute_async(fresh_db.SQL_INSERT_HISTORY, (chat_id, "ok 2", "a")),
+        return_exceptions=True,
+    )
+    assert isinstance(results[1], sqlite3.IntegrityError)
+    with pytest.raises(sqlite3.IntegrityError):
+        insert_history(fresh_db, chat_id + 999)           # the direct path too
+    assert [r["user_text"] for r in fresh_db.get_chat_history(chat_id)] == ["ok 1", "ok 2"]
+
+
+def test_writes_after_close_go_straight_to_the_database(fresh_db, chat_id):
+    insert_history(fresh_db, chat_id, "before")
+    fresh_db.write_queue.close()
+    row_id = insert_history(fresh_db, chat_id, "after")
+    assert fresh_db.write_queue._conn is None
+    assert fresh_db.get_chat_history(chat_id)[-1]["id"] == row_id
@@ -0,0 +1,301 @@
+import multiprocessing
+import os
+import queue
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+# Modules generated scripts almost always import; the template pays for them once.
+PRELOAD_MODULES = [
+    "numpy",
+    "matplotlib",
+    "matplotlib.pyplot",
+    "networkx",
+    "openpyxl",
+    "reportlab.lib.pagesizes",
+    "reportlab.pdfgen.canvas",
+    "reportlab.platypus",
+    "docx",
+    "pptx",
+    "PIL.Image",
+]
+
+WARM_POOL_SIZE = int(os.getenv("WARM_POOL_SIZE", "2"))
+WARM_POOL_MAX_JOBS = int(os.getenv("WARM_POOL_MAX_JOBS", "50"))
+EXEC_MEMORY_LIMIT_MB = int(os.getenv("EXEC_MEMORY_LIMIT_MB", "2048"))
+EXEC_FILE_LIMIT_MB = int(os.getenv("EXEC_FILE_LIMIT_MB", "200"))
+WARM_POOL_ENABLED = os.getenv("WARM_POOL", "1") == "1" and hasattr(os, "fork")
+# How long a job waits for an idle template before running cold instead
+WARM_POOL_ACQUIRE_TIMEOUT = float(os.getenv("WARM_POOL_ACQUIRE_TIMEOUT", "5"))
+# A template that fails to start is retried after 1, 2, 4, ... seconds, up to this
+WARM_POOL_RESPAWN_BASE_DELAY = 1.0
+WARM_POOL_RESPAWN_MAX_DELAY = 60.0
+
+
+def _apply_rlimits(timeout):
+    import resource
+    limits = [
+        (resource.RLIMIT_CPU, int(timeout) + 1),
+        (resource.RLIMIT_FSIZE, EXEC_FILE_LIMIT_MB * 1024 * 1024),
+    ]
+    if EXEC_MEMORY_LIMIT_MB > 0:
+        limits.append((resource.RLIMIT_AS, EXEC_MEMORY_LIMIT_MB * 1024 * 1024))
+    for which, value in limits:
+        try:
+            soft, hard = resource.getrlimit(which)
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            resource.setrlimit(which, (value, hard))
+        except (ValueError, OSError):
+            pass
+
+
+def _run_child(job, write_fd):
+    """Runs in the forked job process; never returns."""
+    code = 1
+    try:
+        os.setsid()
+        os.dup2(write_fd, 1)
+        os.dup2(write_fd, 2)
+        os.close(write_fd)
+        sys.stdout = open(1, "w", buffering=1, encoding="utf-8", errors="replace", closefd=False)
+        sys.stderr = sys.stdout
+        _apply_rlimits(job["timeout"])
+        os.chdir(job["cwd"])
+        sys.path[:0] = [os.path.dirname(job["script"])] + list(job.get("extra_paths") or [])
+        sys.argv = [job["script"]]
+        import runpy
+        runpy.run_path(job["script"], run_name="__main__")
+        code = 0
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+        except Exception:
+            pass
+        os._exit(code)
+
+
+def _template_main(conn, preload):
+    """Template process: import the heavy modules once, then fork one child per job."""
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    for name in preload:
+        try:
+            __import__(name)
+        except Exception:
+            pass
+    conn.send(("ready", None))
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            conn.close()
+            _run_child(job, write_fd)
+        os.close(write_fd)
+
+        deadline = time.monotonic() + job["timeout"]
+        timed_out = False
+        pending = b""
+        with os.fdopen(read_fd, "rb", buffering=0) as pipe:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    timed_out = True
+                    try:
+                        os.killpg(pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+                    break
+                ready, _, _ = select.select([pipe], [], [], min(remaining, 0.5))
+                if not ready:
+                    continue
+                chunk = pipe.read(65536)
+                if not chunk:
+                    break
+                pending += chunk
+                *lines, pending = pending.split(b"\n")
+                for line in lines:
+                    conn.send(("line", line.decode("utf-8", "replace") + "\n"))
+        if pending:
+            conn.send(("line", pending.decode("utf-8", "replace")))
+        _, status = os.waitpid(pid, 0)
+        conn.send(("exit", (os.waitstatus_to_exitcode(status), timed_out)))
+
+
+class _Template:
+    def __init__(self):
+        ctx = multiprocessing.get_context("spawn")
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_template_main, args=(child_conn, PRELOAD_MODULES), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def wait_ready(self, timeout=120):
+        if not self.conn.poll(timeout):
+            raise RuntimeError("warm interpreter did not start")
+        self.conn.recv()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except Exception:
+            pass
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+class WarmPool:
+    """
+    Pool of template interpreters with the usual data/plotting/document modules
+    already imported. Each job runs in a fresh fork of a template, with per-job
+    rlimits, and templates are replaced after `max_jobs` jobs so leaked state or
+    memory growth in the template does not accumulate.
+    """
+
+    def __init__(self, size=WARM_POOL_SIZE, max_jobs=WARM_POOL_MAX_JOBS):
+        self.size = size
+        self.max_jobs = max_jobs
+        self._idle = queue.Queue()
+        self._started = False
+        self._closed = False
+        self._failing = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for _ in range(self.size):
+            threading.Thread(target=self._spawn, daemon=True).start()
+
+    def _spawn(self, attempt=0):
+        if self._closed:
+            return
+        template = None
+        try:
+            template = _Template()
+            template.wait_ready()
+        except Exception as e:
+            if template is not None:
+                template.stop()
+            self._failing = True
+            delay = min(WARM_POOL_RESPAWN_BASE_DELAY * 2 ** attempt, WARM_POOL_RESPAWN_MAX_DELAY)
+            print(f"[warm_pool] failed to start template: {e!r}, retrying in {delay:g}s")
+            retry = threading.Timer(delay, self._spawn, args=(attempt + 1,))
+            retry.daemon = True
+            retry.start()
+            return
+        self._failing = False
+        if self._closed:
+            template.stop()
+        else:
+            self._idle.put(template)
+
+    def _acquire(self):
+        """An idle template, or None when none is available in time (or templates are failing to start)."""
+        try:
+            if self._failing:
+                return self._idle.get_nowait()
+            return self._idle.get(timeout=WARM_POOL_ACQUIRE_TIMEOUT)
+        except queue.Empty:
+            return None
+
+    def run(self, script, cwd, timeout, on_line=None, extra_paths=None):
+        """Run `script` in a warm fork, or cold if no template is ready. Returns (returncode, output, timed_out)."""
+        self.start()
+        template = self._acquire()
+        if template is None:
+            return run_cold(script, cwd, timeout, on_line=on_line, extra_paths=extra_paths)
+        keep = True
+        output = []
+        try:
+            template.conn.send({"script": script, "cwd": cwd, "timeout": timeout, "extra_paths": extra_paths or []})
+            while True:
+                if not template.conn.poll(timeout + 10):
+                    raise RuntimeError("warm interpreter stopped responding")
+                kind, data = template.conn.recv()
+                if kind == "line":
+                    output.append(data)
+                    if on_line:
+                        on_line(data)
+                elif kind == "exit":
+                    returncode, timed_out = data
+                    return returncode, "".join(output), timed_out
+        except Exception:
+            keep = False
+            raise
+        finally:
+            template.jobs += 1
+            if keep and template.jobs < self.max_jobs and template.process.is_alive():
+                self._idle.put(template)
+            else:
+                threading.Thread(target=template.stop, daemon=True).start()
+                threading.Thread(target=self._spawn, daemon=True).start()
+
+    def shutdown(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                return
+
+
+def run_cold(script, cwd, timeout, on_line=None, extra_paths=None):
+    """Fallback when fork is unavailable: a fresh interpreter per job."""
+    env = dict(os.environ)
+    if extra_paths:
+        env["PYTHONPATH"] = os.pathsep.join(list(extra_paths) + [env.get("PYTHONPATH", "")])
+    proc = subprocess.Popen(
+        [sys.executable, script],
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1,
+    )
+    timer = threading.Timer(timeout, proc.kill)
+    timer.start()
+    output = []
+    try:
+        for line in iter(proc.stdout.readline, ''):
+            output.append(line)
+            if on_line:
+                on_line(line)
+        proc.wait()
+    finally:
+        timer.cancel()
+    timed_out = proc.returncode is not None and proc.returncode < 0
+    return proc.returncode, "".join(output), timed_out
+
+
+warm_pool = WarmPool()
+
+
+def run_python(script, cwd, timeout, on_line=None, extra_paths=None):
+    if WARM_POOL_ENABLED:
+        return warm_pool.run(script, cwd, timeout, on_line=on_line, extra_paths=extra_paths)
+    return run_cold(script, cwd, timeout, on_line=on_line, extra_paths=extra_paths)
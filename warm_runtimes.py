@@ -0,0 +1,287 @@
+import asyncio
+import codecs
+import hashlib
+import os
+import shutil
+import signal
+import subprocess
+import tempfile
+import uuid
+from pathlib import Path
+
+RUNTIME_DIR = Path(__file__).resolve().parent / "runtimes"
+SENTINEL = "\x00__WARM_RUNNER__"
+
+WARM_RUNTIMES_ENABLED = os.getenv("WARM_RUNTIMES", "1") == "1"
+WARM_RUNTIMES_PER_LANGUAGE = int(os.getenv("WARM_RUNTIMES_PER_LANGUAGE", "2"))
+WARM_RUNTIME_MAX_JOBS = int(os.getenv("WARM_RUNTIME_MAX_JOBS", "100"))
+JAVA_CLASS_CACHE_DIR = Path(os.getenv("JAVA_CLASS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "nexora-java-classes")))
+JAVA_CLASS_CACHE_MAX = int(os.getenv("JAVA_CLASS_CACHE_MAX", "500"))
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+class WarmRuntimeError(Exception):
+    """The runner broke its protocol; the command should be run cold instead."""
+
+
+class WarmCommandUnavailable(WarmRuntimeError):
+    """The runner cannot serve this command at all (e.g. a JRE without javac)."""
+
+
+def _kill(proc):
+    try:
+        if os.name != "nt":
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except ProcessLookupError:
+        pass
+
+
+async def read_lines(stream, chunk_size=STREAM_CHUNK_BYTES):
+    """
+    Decoded lines of `stream`, newline included, the last one possibly without.
+    Reads fixed-size chunks, so unlike StreamReader.readline() a line may be
+    longer than the reader's 64 KiB limit.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")("replace")
+    parts = []
+    while True:
+        chunk = await stream.read(chunk_size)
+        text = decoder.decode(chunk, final=not chunk)
+        start = 0
+        while (end := text.find("\n", start)) >= 0:
+            parts.append(text[start:end + 1])
+            yield "".join(parts)
+            parts = []
+            start = end + 1
+        if start < len(text):
+            parts.append(text[start:])
+        if not chunk:
+            if parts:
+                yield "".join(parts)
+            return
+
+
+class WarmRuntime:
+    """
+    One long-lived runner process (runtimes/WarmRunner.java or warm_runner.js)
+    that executes a program per command and marks the end of its output with a
+    per-command sentinel. It runs in a private scratch dir that is emptied
+    between programs.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.workdir = tempfile.mkdtemp(prefix="warm-runtime-")
+        self.proc = None
+        self.jobs = 0
+        self._lines = {}
+
+    async def start(self):
+        self.proc = await asyncio.create_subprocess_exec(
+            *self.command,
+            cwd=self.workdir,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=(os.name != "nt"),
+        )
+        # One reader per stream for the runtime's lifetime, so nothing buffered is lost between calls
+        self._lines = {"stdout": read_lines(self.proc.stdout), "stderr": read_lines(self.proc.stderr)}
+
+    @property
+    def alive(self):
+        return self.proc is not None and self.proc.returncode is None
+
+    async def call(self, args, timeout, job=None):
+        """
+        Send one command. Returns (code, stdout, stderr, timed_out, reusable); with
+        `job`, output lines are forwarded to it as they arrive.
+        """
+        self.jobs += 1
+        token = uuid.uuid4().hex
+        marker = SENTINEL + token
+        self.proc.stdin.write(("\t".join([args[0], token, *args[1:]]) + "\n").encode("utf-8"))
+        await self.proc.stdin.drain()
+
+        out_lines, err_lines, status = [], [], {}
+
+        async def pump(sink, kind):
+            async for text in self._lines[kind]:
+                idx = text.find(marker)
+                if idx >= 0:
+                    # Program output without a trailing newline shares the line with the marker
+                    text, tail = text[:idx], text[idx + len(marker):].split()
+                    if kind == "stdout":
+                        if tail == ["unavailable"]:
+                            status["unavailable"] = True
+                        elif len(tail) == 2 and tail[0].lstrip("-").isdigit():
+                            status["code"], status["clean"] = int(tail[0]), tail[1] == "1"
+                        else:
+                            status["malformed"] = " ".join(tail)
+                if text:
+                    sink.append(text)
+                    if job is not None:
+                        job.emit(kind, text)
+                if idx >= 0:
+                    return
+
+        timed_out = False
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(pump(out_lines, "stdout"), pump(err_lines, "stderr")),
+                timeout=timeout,
+            )
+        except asyncio.TimeoutError:
+            timed_out = True
+            self.stop()
+
+        if "unavailable" in status:
+            self._reset_workdir()
+            raise WarmCommandUnavailable(f"{args[0]} is not available in {self.command[0]}")
+        if "malformed" in status or (not timed_out and "code" not in status and args[0] != "run"):
+            # Only a program may end the runner; anything else means the protocol broke
+            self.stop()
+            self._reset_workdir()
+            raise WarmRuntimeError(f"bad status from {self.command[0]} for {args[0]}: {status.get('malformed', 'runner exited')}")
+        if "code" in status:
+            code, reusable = status["code"], status["clean"]
+        else:
+            # The program ended the runner itself (System.exit / process.exit in the main thread)
+            code = self.proc.returncode if timed_out else await self.proc.wait()
+            reusable = False
+        self._reset_workdir()
+        return code, "".join(out_lines), "".join(err_lines), timed_out, reusable and self.alive
+
+    def _reset_workdir(self):
+        for entry in os.scandir(self.workdir):
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+
+    def stop(self):
+        if self.alive:
+            _kill(self.proc)
+
+    def close(self):
+        self.stop()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class RuntimePool:
+    """Up to `size` warm runtimes for one language; created on demand, retired after `max_jobs`."""
+
+    def __init__(self, command, size=WARM_RUNTIMES_PER_LANGUAGE, max_jobs=WARM_RUNTIME_MAX_JOBS):
+        self.command = command
+        self.size = size
+        self.max_jobs = max_jobs
+        self._idle = None
+        self._created = 0
+
+    async def _acquire(self) -> WarmRuntime:
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+        if self._idle.empty() and self._created < self.size:
+            self._created += 1
+            runtime = WarmRuntime(self.command)
+            try:
+                await runtime.start()
+            except Exception:
+                self._created -= 1
+                runtime.close()
+                raise
+            return runtime
+        return await self._idle.get()
+
+    def _release(self, runtime, reusable):
+        if reusable and runtime.alive and runtime.jobs < self.max_jobs:
+            self._idle.put_nowait(runtime)
+        else:
+            runtime.close()
+            self._created -= 1
+
+    async def call(self, args, timeout, job=None):
+        runtime = await self._acquire()
+        reusable = False
+        try:
+            code, out, err, timed_out, reusable = await runtime.call(args, timeout, job)
+            return code, out, err, timed_out
+        finally:
+            self._release(runtime, reusable)
+
+    def close(self):
+        if self._idle is None:
+            return
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+        self._created = 0
+
+
+class JavaClassCache:
+    """
+    Compiled classes keyed by the sha256 of the source, one directory per
+    source, so an unchanged snippet never goes through javac twice. Keeps at
+    most `max_entries` directories, dropping the least recently used.
+    """
+
+    def __init__(self, root=JAVA_CLASS_CACHE_DIR, max_entries=JAVA_CLASS_CACHE_MAX):
+        self.root = Path(root)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, source: str):
+        """(key, class dir if already compiled)."""
+        key = hashlib.sha256(source.encode("utf-8")).hexdigest()
+        class_dir = self.root / key
+        if (class_dir / "Main.class").exists():
+            self.hits += 1
+            os.utime(class_dir)
+            return key, class_dir
+        self.misses += 1
+        return key, None
+
+    def staging_dir(self) -> Path:
+        self.root.mkdir(parents=True, exist_ok=True)
+        return Path(tempfile.mkdtemp(prefix=".staging-", dir=self.root))
+
+    def commit(self, key, staging: Path) -> Path:
+        class_dir = self.root / key
+        try:
+            staging.rename(class_dir)
+        except OSError:
+            # Another job compiled the same source first
+            shutil.rmtree(staging, ignore_errors=True)
+        self._prune()
+        return class_dir
+
+    def _prune(self):
+        entries = [p for p in self.root.iterdir() if p.is_dir() and not p.name.startswith(".")]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=lambda p: p.stat().st_mtime)
+        for path in entries[: len(entries) - self.max_entries]:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
+def java_runner_command(java_cmd="java", javac_cmd="javac"):
+    """Compile WarmRunner.java once per source version and return the command that starts it."""
+    source = RUNTIME_DIR / "WarmRunner.java"
+    digest = hashlib.sha256(source.read_bytes()).hexdigest()[:16]
+    runner_dir = JAVA_CLASS_CACHE_DIR / f".runner-{digest}"
+    if not (runner_dir / "WarmRunner.class").exists():
+        runner_dir.mkdir(parents=True, exist_ok=True)
+        subprocess.run([javac_cmd, "-d", str(runner_dir), str(source)], check=True, capture_output=True, timeout=120)
+    return [java_cmd, "-XX:+UseSerialGC", "-Xshare:auto", "-cp", str(runner_dir), "WarmRunner"]
+
+
+def node_runner_command(node_cmd="node"):
+    return [node_cmd, str(RUNTIME_DIR / "warm_runner.js")]
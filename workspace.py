@@ -0,0 +1,148 @@
+import contextlib
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+
+EXEC_WORKSPACE_ROOT = Path(os.getenv("EXEC_WORKSPACE_ROOT", "./workspaces"))
+# Finished workspaces are kept this long (for debugging) before GC removes them.
+EXEC_WORKSPACE_RETENTION = int(os.getenv("EXEC_WORKSPACE_RETENTION", "3600"))
+# Total size of all workspaces; past it, GC evicts the oldest finished ones early.
+EXEC_WORKSPACE_QUOTA_MB = int(os.getenv("EXEC_WORKSPACE_QUOTA_MB", "1024"))
+EXEC_WORKSPACE_GC_INTERVAL = int(os.getenv("EXEC_WORKSPACE_GC_INTERVAL", "300"))
+
+DONE_MARKER = ".done"
+
+
+class Workspace:
+    """Private directories for one code-execution job."""
+
+    def __init__(self, root: Path):
+        self.id = root.name
+        self.root = root
+        self.input_dir = root / "input"
+        self.output_dir = root / "outputs"
+
+    def output_files(self) -> list[Path]:
+        return sorted(f for f in self.output_dir.iterdir() if f.is_file())
+
+
+def _dir_size(path: Path) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class WorkspaceManager:
+    """
+    Hands out one isolated workspace per job so concurrent /exec-chat requests
+    never see each other's inputs or outputs. A background thread removes
+    finished workspaces after `retention` seconds, and the oldest finished ones
+    sooner when the total size goes over `quota_bytes`.
+    """
+
+    def __init__(self, root=EXEC_WORKSPACE_ROOT, retention=EXEC_WORKSPACE_RETENTION,
+                 quota_bytes=EXEC_WORKSPACE_QUOTA_MB * 1024 * 1024, interval=EXEC_WORKSPACE_GC_INTERVAL):
+        self.root = Path(root)
+        self.retention = retention
+        self.quota_bytes = quota_bytes
+        self.interval = interval
+        self._active = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def create(self) -> Workspace:
+        workspace = Workspace(self.root / uuid.uuid4().hex)
+        workspace.input_dir.mkdir(parents=True)
+        workspace.output_dir.mkdir()
+        with self._lock:
+            self._active.add(workspace.id)
+        return workspace
+
+    def release(self, workspace: Workspace) -> None:
+        with self._lock:
+            self._active.discard(workspace.id)
+        if self.retention <= 0:
+            shutil.rmtree(workspace.root, ignore_errors=True)
+            return
+        try:
+            (workspace.root / DONE_MARKER).touch()
+        except OSError:
+            pass
+
+    @contextlib.contextmanager
+    def job(self):
+        workspace = self.create()
+        try:
+            yield workspace
+        finally:
+            self.release(workspace)
+
+    def _finished(self):
+        """(finished_at, size, path) for every workspace no job is using, oldest first."""
+        if not self.root.is_dir():
+            return []
+        with self._lock:
+            active = set(self._active)
+        now = time.time()
+        finished = []
+        for path in self.root.iterdir():
+            if not path.is_dir() or path.name in active:
+                continue
+            marker = path / DONE_MARKER
+            try:
+                if marker.exists():
+                    finished_at = marker.stat().st_mtime
+                else:
+                    # Left behind by a crashed or restarted worker; only reclaim once stale
+                    finished_at = path.stat().st_mtime
+                    if now - finished_at < self.retention:
+                        continue
+            except OSError:
+                continue
+            finished.append((finished_at, _dir_size(path), path))
+        finished.sort()
+        return finished
+
+    def gc(self) -> int:
+        """Remove expired workspaces, then evict down to the quota. Returns the number removed."""
+        finished = self._finished()
+        cutoff = time.time() - self.retention
+        total = sum(size for _, size, _ in finished)
+        removed = 0
+        for finished_at, size, path in finished:
+            if finished_at > cutoff and total <= self.quota_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                removed = self.gc()
+                if removed:
+                    print(f"[workspace] removed {removed} finished workspace(s)")
+            except Exception as e:
+                print(f"[workspace] gc failed: {e}")
+
+    def start(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+
+workspace_manager = WorkspaceManager()